@@ -0,0 +1,194 @@
+"""Cache for validated AI plan output, keyed on the normalized plan inputs.
+
+Identical requests (same subjects, dates, hours, off days, fixed schedule,
+goals and marks summary) are served from an in-process LRU, backed by the
+``ai_cache`` table so every worker process shares hits. Entries expire after
+a TTL and the table is trimmed to a maximum size, least recently used first.
+Clearing bumps the generation in ``ai_cache_generation``. Each process
+re-reads it at most every ``generation_check`` seconds and drops memory
+entries of an older generation, so a memory hit usually touches no
+database and a clear reaches every process within that interval. Lookups
+and stores are counted in metrics.py, so /metrics reports them for the
+whole server.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+from database import database
+
+# Bump when the prompt changes in a way that makes cached output stale
+CACHE_VERSION = 1
+
+DAY_ORDER = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def _clean(text):
+    """Collapse whitespace and ignore case in free-text fields."""
+    return re.sub(r'\s+', ' ', str(text or '')).strip().casefold()
+
+
+def _hours(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return _clean(value)
+
+
+def normalize_inputs(form_data, marks_data):
+    """Reduce plan inputs to the fields that shape the AI output, in a canonical form."""
+    subjects = {re.sub(r'\s+', ' ', s).strip() for s in form_data['subjects'].split(',')}
+    off_days = {d.strip() for d in (form_data.get('off_days') or '').split(',') if d.strip()}
+
+    totals = {}
+    for mark in marks_data:
+        obtained, maximum = totals.get(mark['subject_name'], (0.0, 0.0))
+        totals[mark['subject_name']] = (obtained + mark['obtained_marks'], maximum + mark['max_marks'])
+
+    return {
+        'version': CACHE_VERSION,
+        'subjects': sorted((s for s in subjects if s), key=str.casefold),
+        'start_date': form_data['start_date'].strip(),
+        'end_date': form_data['end_date'].strip(),
+        'hours_per_day': _hours(form_data['hours_per_day']),
+        'off_days': sorted(off_days, key=lambda d: DAY_ORDER.index(d) if d in DAY_ORDER else len(DAY_ORDER)),
+        'class_schedule': _clean(form_data.get('class_schedule')),
+        'learning_goal': _clean(form_data.get('learning_goal')),
+        'difficulty_feedback': _clean(form_data.get('difficulty_feedback')),
+        # The prompt only shows one decimal place of each subject's percentage
+        'marks': sorted((subject, round(obtained / maximum * 100, 1))
+                        for subject, (obtained, maximum) in totals.items() if maximum),
+    }
+
+
+def make_key(form_data, marks_data):
+    """Content address of a plan request: SHA-256 of its normalized inputs."""
+    normalized = json.dumps(normalize_inputs(form_data, marks_data), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def is_valid_output(ai_response):
+    """Only well-formed AI output is worth caching."""
+    schedule = ai_response.get('schedule')
+    return (isinstance(ai_response.get('learning_guide'), str)
+            and isinstance(ai_response.get('resources'), str)
+            and isinstance(schedule, dict) and len(schedule) > 0
+            and all(isinstance(blocks, list) for blocks in schedule.values()))
+
+
+class AICache:
+    """Two-tier (process LRU + SQLite) cache of AI responses."""
+
+    def __init__(self, ttl=7 * 24 * 3600, max_entries=5000, memory_entries=128, generation_check=5):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.generation_check = generation_check
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation_seen = None
+        self._generation_checked = float('-inf')
+
+    def _read_generation(self, db):
+        generation = db.execute('SELECT generation FROM ai_cache_generation WHERE id = 1').fetchone()[0]
+        with self._lock:
+            self._generation_seen = generation
+            self._generation_checked = time.monotonic()
+        return generation
+
+    def _generation(self, db):
+        """The current generation, read from the database at most every ``generation_check`` seconds."""
+        with self._lock:
+            if time.monotonic() - self._generation_checked < self.generation_check:
+                return self._generation_seen
+        return self._read_generation(db)
+
+    def _remember(self, key, value, created_at, generation):
+        with self._lock:
+            self._memory[key] = (value, created_at, generation)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, db, key):
+        """Return the cached response for ``key`` or None."""
+        now = time.time()
+        generation = self._generation(db)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] < self.ttl and entry[2] == generation:
+                self._memory.move_to_end(key)
+                hit = dict(entry[0])
+            else:
+                hit = None
+                if entry is not None:
+                    del self._memory[key]
+        if hit is not None:
+            metrics.inc('ai_cache_lookups_total', outcome='memory_hit')
+            return hit
+
+        row = db.execute(
+            'SELECT learning_guide, schedule, resources, created_at FROM ai_cache WHERE cache_key = ? AND created_at > ?',
+            (key, now - self.ttl)
+        ).fetchone()
+        if row is None:
+            metrics.inc('ai_cache_lookups_total', outcome='miss')
+            return None
+        with database.transaction(db):
+            db.execute('UPDATE ai_cache SET last_used_at = ?, hits = hits + 1 WHERE cache_key = ?', (now, key))
+        value = {
+            'learning_guide': row['learning_guide'],
+            'schedule': json.loads(row['schedule']),
+            'resources': row['resources'],
+        }
+        self._remember(key, value, row['created_at'], generation)
+        metrics.inc('ai_cache_lookups_total', outcome='db_hit')
+        return dict(value)
+
+    def put(self, db, key, ai_response):
+        """Store a validated response and evict expired and least recently used entries."""
+        if not is_valid_output(ai_response):
+            metrics.inc('ai_cache_stores_total', outcome='rejected')
+            return False
+        now = time.time()
+        value = {
+            'learning_guide': ai_response['learning_guide'],
+            'schedule': ai_response['schedule'],
+            'resources': ai_response['resources'],
+        }
+        with database.transaction(db):
+            db.execute('''
+                INSERT OR REPLACE INTO ai_cache (cache_key, learning_guide, schedule, resources, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (key, value['learning_guide'], json.dumps(value['schedule']), value['resources'], now, now))
+            evicted = db.execute('DELETE FROM ai_cache WHERE created_at <= ?', (now - self.ttl,)).rowcount
+            evicted += db.execute('''
+                DELETE FROM ai_cache WHERE cache_key IN (
+                    SELECT cache_key FROM ai_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,)).rowcount
+            # Read in the write transaction, so a clear can't slip in between
+            generation = self._read_generation(db)
+        self._remember(key, value, now, generation)
+        metrics.inc('ai_cache_stores_total', outcome='stored')
+        if evicted:
+            metrics.inc('ai_cache_evictions_total', evicted)
+        return True
+
+    def clear(self, db):
+        """Remove every entry, from the table and from the memory of every process."""
+        with database.transaction(db):
+            db.execute('DELETE FROM ai_cache')
+            db.execute('UPDATE ai_cache_generation SET generation = generation + 1 WHERE id = 1')
+            self._read_generation(db)
+        with self._lock:
+            self._memory.clear()
+
+    def stats(self, db):
+        """Size of the shared table and the hits it has served; per-lookup counts are in /metrics."""
+        row = db.execute('SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM ai_cache').fetchone()
+        return {'db_entries': row[0], 'db_total_hits': row[1]}
@@ -1,30 +1,120 @@
-from flask import Flask, render_template, request, redirect, url_for, g, flash
+import time
+# Start of this process's startup, for the report of time to first request (see record_startup)
+IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, render_template, request, redirect, url_for, g, flash, jsonify, Response, stream_with_context, abort, send_file, session
+from flask import before_render_template, template_rendered
+from markupsafe import Markup, escape
+import asyncio
+import click
+import cProfile
+import gzip
+import io
+import pstats
 import sqlite3
 import os
 import json
-from datetime import datetime
+import threading
+import hashlib
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import multiprocessing
 from dotenv import load_dotenv
-import google.generativeai as genai
 import re
 import logging
 from logging.handlers import RotatingFileHandler
 from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import safe_join
+import bulk
+import jobs
+import json_repair
+from database import database
+from ai_cache import AICache, make_key as ai_cache_key
+from page_cache import PageCache
+from schedule_stream import ScheduleStreamParser
+import exports
+import gemini_stub
+import metrics
+import replan
+import resilience
+import schedule_format
+import schedule_repair
+import scheduler
+import startup
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-if not os.path.exists('logs'):
-    os.mkdir('logs')
-file_handler = RotatingFileHandler('logs/ai-planner.log', maxBytes=10240, backupCount=10)
-file_handler.setFormatter(logging.Formatter(
-    '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-))
-file_handler.setLevel(logging.INFO)
-
 app = Flask(__name__)
-app.config['DATABASE'] = os.path.join(os.path.dirname(__file__), 'database', 'planner.db')
+app.logger.setLevel(logging.INFO)
+app.config['DATABASE'] = os.getenv('DATABASE_PATH', os.path.join(os.path.dirname(__file__), 'database', 'planner.db'))
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', os.urandom(24))
+# Background job workers (threads per process) that run AI plan generation
+app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', 2))
+app.config['JOB_POLL_INTERVAL'] = float(os.getenv('JOB_POLL_INTERVAL', 1.0))
+app.config['JOB_TIMEOUT'] = int(os.getenv('JOB_TIMEOUT', 600)) # Seconds before a running job is considered abandoned
+app.config['JOB_MAX_ATTEMPTS'] = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+app.config['ASYNC_JOB_CONCURRENCY'] = int(os.getenv('ASYNC_JOB_CONCURRENCY', 200)) # Jobs in flight per event loop (see jobs.work_async)
+# Cache of AI responses for identical plan inputs (see ai_cache.py)
+app.config['AI_CACHE_TTL'] = int(os.getenv('AI_CACHE_TTL', 7 * 24 * 3600)) # Seconds
+app.config['AI_CACHE_MAX_ENTRIES'] = int(os.getenv('AI_CACHE_MAX_ENTRIES', 5000))
+app.config['AI_CACHE_MEMORY_ENTRIES'] = int(os.getenv('AI_CACHE_MEMORY_ENTRIES', 128))
+app.config['AI_CACHE_GENERATION_CHECK'] = float(os.getenv('AI_CACHE_GENERATION_CHECK', 5)) # Seconds a clear takes to reach other processes
+
+# Stream AI output so finished days reach the plan page while the rest is generated
+app.config['STREAM_GENERATION'] = os.getenv('STREAM_GENERATION', '1') == '1'
+app.config['SSE_POLL_INTERVAL'] = float(os.getenv('SSE_POLL_INTERVAL', 0.25))
+app.config['SSE_MAX_SECONDS'] = int(os.getenv('SSE_MAX_SECONDS', 20)) # Browsers reconnect and resume after this
+# Long plans are generated as concurrent schedule windows (see generate_windowed_ai_response)
+app.config['SCHEDULE_WINDOW_DAYS'] = int(os.getenv('SCHEDULE_WINDOW_DAYS', 14))
+app.config['AI_MAX_PARALLEL'] = int(os.getenv('AI_MAX_PARALLEL', 4))
+app.config['AI_WINDOW_RETRIES'] = int(os.getenv('AI_WINDOW_RETRIES', 2))
+# Ask for schedules in the compact row format (see schedule_format.py); 0 asks for verbose blocks
+app.config['COMPACT_SCHEDULE'] = os.getenv('COMPACT_SCHEDULE', '1') == '1'
+# Gemini calls from every worker share one rate limit and circuit breaker (see resilience.py)
+app.config['AI_RATE_PER_MINUTE'] = float(os.getenv('AI_RATE_PER_MINUTE', 60))
+app.config['AI_RATE_BURST'] = float(os.getenv('AI_RATE_BURST', 10))
+app.config['AI_RATE_MAX_WAIT'] = float(os.getenv('AI_RATE_MAX_WAIT', 30)) # Seconds to queue for a token before falling back
+app.config['AI_MAX_RETRIES'] = int(os.getenv('AI_MAX_RETRIES', 3)) # Retries of quota, 5xx and network errors
+app.config['AI_RETRY_BASE_DELAY'] = float(os.getenv('AI_RETRY_BASE_DELAY', 1.0))
+app.config['AI_RETRY_MAX_DELAY'] = float(os.getenv('AI_RETRY_MAX_DELAY', 20.0))
+app.config['AI_CALL_DEADLINE'] = float(os.getenv('AI_CALL_DEADLINE', 90)) # Seconds of waiting and retrying per call
+app.config['AI_BREAKER_THRESHOLD'] = int(os.getenv('AI_BREAKER_THRESHOLD', 5)) # Consecutive failures that open the breaker
+app.config['AI_BREAKER_RESET'] = float(os.getenv('AI_BREAKER_RESET', 30)) # Seconds before a trial call is let through
+# Bulk plan creation (flask bulk-generate, POST /api/batches)
+app.config['BULK_CHUNK_SIZE'] = int(os.getenv('BULK_CHUNK_SIZE', 100)) # Plans written per transaction
+app.config['BULK_MAX_ITEMS'] = int(os.getenv('BULK_MAX_ITEMS', 1000)) # Largest JSON batch accepted
+# Plans per page of /plans (newest first, or search results)
+app.config['PLANS_PAGE_SIZE'] = int(os.getenv('PLANS_PAGE_SIZE', 20))
+# Finished schedule exports (ICS/CSV/TXT/PDF), one file per plan version and format
+app.config['EXPORT_CACHE_DIR'] = os.getenv('EXPORT_CACHE_DIR', os.path.join(os.path.dirname(__file__), 'cache', 'exports'))
+# Rendered pages of finished plans, shared by every worker (see page_cache.py); a TTL of 0 disables it
+app.config['PAGE_CACHE_DIR'] = os.getenv('PAGE_CACHE_DIR', os.path.join(os.path.dirname(__file__), 'cache', 'pages'))
+app.config['PAGE_CACHE_TTL'] = int(os.getenv('PAGE_CACHE_TTL', 24 * 3600)) # Seconds
+app.config['PAGE_CACHE_MAX_FILES'] = int(os.getenv('PAGE_CACHE_MAX_FILES', 5000))
+app.config['PAGE_CACHE_MEMORY_ENTRIES'] = int(os.getenv('PAGE_CACHE_MEMORY_ENTRIES', 256))
+# Requests sent with "X-Profile: <PROFILE_TOKEN>" are run under cProfile (disabled when unset)
+app.config['PROFILE_TOKEN'] = os.getenv('PROFILE_TOKEN')
+app.config['PROFILE_DIR'] = os.getenv('PROFILE_DIR', os.path.join(os.path.dirname(__file__), 'logs', 'profiles'))
+# gzip for text responses; static files linked with a content fingerprint are cached for STATIC_MAX_AGE
+app.config['COMPRESS_MIN_BYTES'] = int(os.getenv('COMPRESS_MIN_BYTES', 500))
+app.config['COMPRESS_LEVEL'] = int(os.getenv('COMPRESS_LEVEL', 6))
+app.config['STATIC_MAX_AGE'] = int(os.getenv('STATIC_MAX_AGE', 365 * 24 * 3600)) # Seconds
+
+ai_cache = AICache(ttl=app.config['AI_CACHE_TTL'],
+                   max_entries=app.config['AI_CACHE_MAX_ENTRIES'],
+                   memory_entries=app.config['AI_CACHE_MEMORY_ENTRIES'],
+                   generation_check=app.config['AI_CACHE_GENERATION_CHECK'])
+gemini_guard = resilience.Guard('gemini',
+                                rate=app.config['AI_RATE_PER_MINUTE'] / 60,
+                                burst=app.config['AI_RATE_BURST'],
+                                max_wait=app.config['AI_RATE_MAX_WAIT'],
+                                failure_threshold=app.config['AI_BREAKER_THRESHOLD'],
+                                reset_timeout=app.config['AI_BREAKER_RESET'],
+                                max_retries=app.config['AI_MAX_RETRIES'],
+                                base_delay=app.config['AI_RETRY_BASE_DELAY'],
+                                max_delay=app.config['AI_RETRY_MAX_DELAY'],
+                                deadline=app.config['AI_CALL_DEADLINE'])
 
 # Add security headers
 @app.after_request
@@ -35,17 +125,243 @@ def add_security_headers(response):
     response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
     return response
 
+# --- Compression and static file caching ---
+
+COMPRESSIBLE_TYPES = {'text/html', 'text/plain', 'text/css', 'text/javascript', 'application/javascript',
+                      'application/json', 'image/svg+xml'}
+_static_fingerprints = {} # path: (mtime, fingerprint)
+_static_gzip = {} # (path, mtime): gzipped contents
+
+def static_fingerprint(filename):
+    """Short hash of a static file's contents, or None if there is no such file."""
+    path = safe_join(app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        return None
+    mtime = os.path.getmtime(path)
+    cached = _static_fingerprints.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as f:
+            cached = _static_fingerprints[path] = (mtime, hashlib.sha1(f.read()).hexdigest()[:12])
+    return cached[1]
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    # url_for('static', ...) links carry ?v=<fingerprint>, so a changed file gets a new URL
+    if endpoint == 'static' and 'v' not in values:
+        fingerprint = static_fingerprint(values.get('filename', ''))
+        if fingerprint:
+            values['v'] = fingerprint
+
+def gzip_static(filename):
+    path = safe_join(app.static_folder, filename)
+    key = (path, os.path.getmtime(path))
+    data = _static_gzip.get(key)
+    if data is None:
+        with open(path, 'rb') as f:
+            data = _static_gzip[key] = gzip.compress(f.read(), app.config['COMPRESS_LEVEL'], mtime=0)
+    return data
+
+@app.after_request
+def compress_response(response):
+    """Cache fingerprinted static files for good, and gzip text responses for clients that accept it.
+
+    Streamed responses (exports, SSE) are sent as they are; static files are
+    compressed once and kept in memory.
+    """
+    is_static = request.endpoint == 'static'
+    if is_static and request.args.get('v') and request.args['v'] == static_fingerprint(request.view_args['filename']):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['STATIC_MAX_AGE']
+        response.cache_control.immutable = True
+    if response.mimetype not in COMPRESSIBLE_TYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or 'Content-Encoding' in response.headers
+            or not request.accept_encodings['gzip'] or request.method == 'HEAD'):
+        return response
+    if is_static and response.direct_passthrough:
+        data = gzip_static(request.view_args['filename'])
+        response.response.close() # The file send_file opened
+        response.direct_passthrough = False
+    elif response.is_streamed:
+        return response
+    else:
+        body = response.get_data()
+        if len(body) < app.config['COMPRESS_MIN_BYTES']:
+            return response
+        data = gzip.compress(body, app.config['COMPRESS_LEVEL'])
+    response.set_data(data)
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers.pop('Accept-Ranges', None) # Ranges would refer to the uncompressed bytes
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True) # The compressed bytes differ from the plain ones
+    return response
+
+# --- Rendered page cache (see page_cache.py) ---
+
+def page_release():
+    """Fingerprint of the code, templates and static files a rendered page depends on."""
+    paths = [os.path.abspath(__file__)]
+    for folder in (os.path.join(app.root_path, app.template_folder), app.static_folder):
+        for directory, _, names in os.walk(folder):
+            paths += [os.path.join(directory, name) for name in names]
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+page_cache = PageCache(app.config['PAGE_CACHE_DIR'], page_release(),
+                       ttl=app.config['PAGE_CACHE_TTL'],
+                       max_files=app.config['PAGE_CACHE_MAX_FILES'],
+                       memory_entries=app.config['PAGE_CACHE_MEMORY_ENTRIES'])
+def plan_changed(plan_id):
+    """Drop a plan's rendered page and cached exports; call after a write to the plan commits."""
+    page_cache.invalidate(plan_id)
+    exports.remove_cached(app.config['EXPORT_CACHE_DIR'], plan_id)
+
+# Plans are never deleted, so once one exists the home page stops asking the database
+plans_created = threading.Event()
+
+# --- Logging ---
+
+_file_handler = None
+
+def configure_logging():
+    """Also log to logs/ai-planner.log next to this file (once per process; see create_app)."""
+    global _file_handler
+    if _file_handler is not None:
+        return
+    log_dir = os.path.join(app.root_path, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+    # Opened on the first record, so a preloading gunicorn master hands no open file to its workers
+    _file_handler = RotatingFileHandler(os.path.join(log_dir, 'ai-planner.log'),
+                                        maxBytes=10240, backupCount=10, delay=True)
+    _file_handler.setFormatter(logging.Formatter(
+        '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
+    ))
+    _file_handler.setLevel(logging.INFO)
+    app.logger.addHandler(_file_handler)
+
+# --- Instrumentation (see metrics.py) ---
+
+# cProfile can only profile one request at a time
+_profile_lock = threading.Lock()
+_render_started = threading.local()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    token = app.config['PROFILE_TOKEN']
+    if token and request.headers.get('X-Profile') == token and _profile_lock.acquire(blocking=False):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def finish_request_timer(response):
+    g.response_status = response.status_code
+    elapsed = time.perf_counter() - g.get('request_started', time.perf_counter())
+    response.headers['Server-Timing'] = f'app;dur={elapsed * 1000:.1f}'
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        _profile_lock.release()
+        response.headers['X-Profile-File'] = save_profile(profiler)
+    return response
+
+@app.teardown_request
+def record_request_metrics(error=None):
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    profiler = g.pop('profiler', None)
+    if profiler is not None:  # The view raised, so after_request never ran
+        profiler.disable()
+        _profile_lock.release()
+    endpoint = request.url_rule.endpoint if request.url_rule else 'unmatched'
+    status = g.pop('response_status', 500)
+    metrics.inc('http_requests_total', endpoint=endpoint, method=request.method, status=status)
+    metrics.observe('http_request_duration_seconds', time.perf_counter() - started, endpoint=endpoint)
+    if _first_request_pid != os.getpid():
+        record_startup()
+
+_first_request_pid = None
+# When this process started: the import, or the fork from a gunicorn master that preloaded the app
+_process_started = IMPORT_STARTED
+
+def _record_fork():
+    global _process_started
+    _process_started = time.perf_counter()
+
+os.register_at_fork(after_in_child=_record_fork)
+
+def record_startup():
+    """Log and record how long the app took to import and this process to finish its first request."""
+    global _first_request_pid
+    _first_request_pid = os.getpid()
+    metrics.enable()  # A server process: its numbers belong on /metrics (one-off commands never get here)
+    first_request = time.perf_counter() - _process_started
+    metrics.observe('process_startup_seconds', app.config['STARTUP_IMPORT_SECONDS'], phase='import')
+    metrics.observe('process_startup_seconds', first_request, phase='first_request')
+    app.logger.info(f"Startup: app imported in {app.config['STARTUP_IMPORT_SECONDS']:.3f}s, first request "
+                    f"({request.method} {request.path}) finished {first_request:.3f}s after the process started")
+
+def save_profile(profiler):
+    """Write a request's profile to PROFILE_DIR and log its top functions. Returns the file name."""
+    os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+    name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{request.endpoint or 'unmatched'}.prof"
+    profiler.dump_stats(os.path.join(app.config['PROFILE_DIR'], name))
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(20)
+    app.logger.info(f"Profile of {request.method} {request.full_path.rstrip('?')} saved as {name}\n{summary.getvalue()}")
+    return name
+
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    _render_started.value = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def record_render_time(sender, template, context, **extra):
+    started = getattr(_render_started, 'value', None)
+    if started is not None:
+        _render_started.value = None
+        metrics.observe('template_render_duration_seconds', time.perf_counter() - started,
+                        template=template.name or 'string')
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape target, summed over every worker process."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # Configure Gemini API
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if GEMINI_API_KEY:
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        app.logger.info("Gemini API Key configured successfully.")
-    except Exception as e:
-        app.logger.error(f"Error configuring Gemini API: {e}")
-else:
+# Use the local stand-in model (gemini_stub.py) for development and tests
+USE_GEMINI_STUB = os.getenv("GEMINI_STUB") == '1'
+if not GEMINI_API_KEY and not USE_GEMINI_STUB:
     app.logger.warning("GEMINI_API_KEY not found in environment variables. AI features will be disabled.")
 
+_genai = None
+_genai_lock = threading.Lock()
+
+def get_genai():
+    """google.generativeai, imported and configured on first use.
+
+    Importing it takes about a second, most of the app's startup, and its gRPC
+    channels must not cross a fork, so it is loaded in each worker when the
+    first AI call is made rather than when the app is imported.
+    """
+    global _genai
+    if _genai is None:
+        with _genai_lock:
+            if _genai is None:
+                import google.generativeai as genai
+                genai.configure(api_key=GEMINI_API_KEY)
+                app.logger.info("Gemini API Key configured successfully.")
+                _genai = genai
+    return _genai
+
 # Add ProxyFix middleware for proper handling of proxy headers
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
@@ -67,29 +383,28 @@ def inject_now():
 
 def get_db():
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        # One long-lived, tuned connection per thread; see database/database.py
+        g.db = database.get_connection(app.config['DATABASE'])
     return g.db
 
 def close_db(e=None):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        database.release(db)
 
 def init_db():
-    db = get_db()
-    schema_path = os.path.join(os.path.dirname(__file__), 'database', 'schema.sql')
-    with open(schema_path, 'r') as f:
-        db.executescript(f.read())
+    database.init_schema(get_db())
+
+def upgrade_db():
+    """Apply migrations newer than the database's user_version. Returns the names applied."""
+    return database.upgrade_schema(get_db())
 
 @app.cli.command('init-db')
 def init_db_command():
     """Clear the existing data and create new tables."""
     # Check if DB exists, delete if it does to ensure clean init
     if os.path.exists(app.config['DATABASE']):
+        database.close_connection(app.config['DATABASE'])
         os.remove(app.config['DATABASE'])
         print('Deleted existing database.')
     # Ensure the database directory exists
@@ -102,111 +417,315 @@ def init_db_command():
         init_db()
     print('Initialized the database.')
 
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Bring an existing database up to date without losing data."""
+    applied = upgrade_db()
+    for name in applied:
+        print(f'Applied migration {name}.')
+    print('Database is up to date.')
+
+@app.cli.command('run-jobs')
+@click.option('--asyncio', 'use_asyncio', is_flag=True,
+              help='Run jobs as asyncio tasks, up to ASYNC_JOB_CONCURRENCY at once, instead of threads.')
+def run_jobs_command(use_asyncio):
+    """Run background job workers in the foreground (e.g. as a dedicated worker process)."""
+    configure_logging()
+    metrics.enable()
+    if use_asyncio:
+        print(f"Running up to {app.config['ASYNC_JOB_CONCURRENCY']} jobs at once on an event loop. Press Ctrl+C to stop.")
+        try:
+            asyncio.run(jobs.work_async(app, app.config['ASYNC_JOB_CONCURRENCY']))
+        except KeyboardInterrupt:
+            print('Stopping job workers.')
+        return
+    print(f"Running {app.config['JOB_WORKERS']} job worker(s). Press Ctrl+C to stop.")
+    jobs.start_workers(app)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print('Stopping job workers.')
+
+@app.cli.command('bulk-generate')
+@click.argument('csv_file', type=click.File('rb'))
+@click.option('--workers', default=8, show_default=True, help='Plans generated at once by this command.')
+@click.option('--chunk-size', default=None, type=int, help='Plans written per transaction (default BULK_CHUNK_SIZE).')
+@click.option('--no-wait', is_flag=True, help="Only queue the plans; the server's job workers generate them.")
+def bulk_generate_command(csv_file, workers, chunk_size, no_wait):
+    """Create and generate a plan for every row of a CSV file.
+
+    Columns are the fields of the new plan form; subject_marks uses the same
+    text format (quote it, as it spans lines). Run it again with the same file
+    to resume after an interruption.
+    """
+    configure_logging()
+    db = get_db()
+    data = csv_file.read()
+    try:
+        rows = bulk.read_csv(data)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise click.ClickException(str(e))
+    started = time.monotonic()
+
+    def report_chunk(done, total):
+        print(f'Queued {done}/{total} rows.')
+
+    batch_id, created, rejected, skipped = bulk.create_batch(
+        db, os.path.basename(csv_file.name), bulk.source_key(data), rows, prepare_plan,
+        chunk_size=chunk_size or app.config['BULK_CHUNK_SIZE'], on_chunk=report_chunk)
+    print(f'Batch {batch_id}: {created} plans created, {rejected} rows rejected, '
+          f'{skipped} rows already processed by an earlier run ({time.monotonic() - started:.1f}s).')
+    for item in database.get_batch_items(db, batch_id):
+        if item['error']:
+            print(f"  line {item['item_number']}: {item['error']}")
+    if no_wait:
+        return
+
+    requeued = jobs.requeue_orphaned(db)
+    if requeued:
+        print(f'Requeued {requeued} job(s) left running by a stopped process.')
+    stop = threading.Event()
+    threads = [threading.Thread(target=jobs.work, args=(app, jobs.make_worker_id(f'bulk-{i}'), stop),
+                                name=f'bulk-worker-{i}', daemon=True) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    started = time.monotonic()
+    initial = database.get_batch_progress(db, batch_id)
+    finished_before = initial['ready'] + initial['failed']
+    total = len(rows)
+    try:
+        progress = bulk.wait_for_batch(
+            db, batch_id, on_progress=lambda p: print(bulk.format_progress(p, total, started, finished_before)))
+    except KeyboardInterrupt:
+        print('Interrupted; run the same command again to resume.')
+        return
+    finally:
+        stop.set()
+    for thread in threads:
+        thread.join()
+    print(f"Batch {batch_id} finished: {progress['ready']} ready, {progress['failed']} failed, {progress['rejected']} rejected.")
+
+@app.cli.command('repair-schedules')
+@click.option('--dry-run', is_flag=True, help='Only report what would be repaired.')
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True, help='Processes checking and repairing schedules.')
+@click.option('--chunk-size', default=500, show_default=True, help='Plans read, and repaired, per transaction.')
+@click.option('--after-id', default=0, show_default=True, help='Start after this plan id (to resume an interrupted run).')
+@click.option('--show', default=20, show_default=True, help='Number of invalid plans to list with their problems.')
+def repair_schedules_command(dry_run, workers, chunk_size, after_id, show):
+    """Check every generated plan's schedule and repair the invalid ones.
+
+    Schedules are recovered like "Attempt to Fix JSON" does; days that can't
+    be recovered come from the local scheduler (see schedule_repair.py).
+    Repaired plans are marked ready.
+    """
+    db = get_db()
+    counts = dict.fromkeys(['valid', 'reparsed', 'patched', 'regenerated'], 0)
+    listed = []
+    started = time.monotonic()
+    # Spawned, not forked: the children only need schedule_repair, not this process's threads and connections
+    pool = (ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            if workers > 1 else None)
+    last_id = after_id
+    try:
+        for chunk in database.iter_plan_schedule_chunks(db, chunk_size, after_id):
+            marks = database.get_subject_marks_many(db, [plan['id'] for plan in chunk])
+            items = [(plan['id'], plan['generated_schedule'], plan_form_from_row(plan), marks[plan['id']])
+                     for plan in chunk]
+            if pool is None:
+                results = list(map(schedule_repair.repair_schedule, items))
+            else:
+                results = list(pool.map(schedule_repair.repair_schedule, items,
+                                        chunksize=max(1, len(items) // (workers * 4))))
+            repairs = {result.plan_id: result.schedule for result in results if result.action != 'valid'}
+            if repairs and not dry_run:
+                with database.transaction(db):
+                    database.update_plan_schedules(db, repairs)
+                for plan_id in repairs:
+                    plan_changed(plan_id)
+            for result in results:
+                counts[result.action] += 1
+                if result.action != 'valid' and len(listed) < show:
+                    listed.append(result)
+            last_id = chunk[-1]['id']
+            checked = sum(counts.values())
+            print(f"Checked {checked} plans (to id {last_id}, {checked / (time.monotonic() - started):.0f}/s): "
+                  f"{checked - counts['valid']} invalid.")
+    except KeyboardInterrupt:
+        print(f'Interrupted; run again with --after-id {last_id} to resume.')
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    for result in listed:
+        print(f"  plan {result.plan_id} ({result.action}): {'; '.join(result.problems[:3])}")
+    print(f"{sum(counts.values())} plans checked: {counts['valid']} valid, {counts['reparsed']} recovered from their "
+          f"stored text, {counts['patched']} patched with local days, {counts['regenerated']} regenerated locally "
+          f"({time.monotonic() - started:.1f}s).")
+    if dry_run:
+        print('Dry run: no plans were changed.')
+
+@app.cli.command('startup-report')
+@click.option('--path', default='/', show_default=True, help='Page to request first.')
+@click.option('--runs', default=3, show_default=True, help='Fresh processes to start; the fastest is shown.')
+@click.option('--top', default=15, show_default=True, help='Number of imports to list.')
+def startup_report_command(path, runs, top):
+    """Show how long a new server process takes to import the app and answer its first request."""
+    reports = [startup.measure(path, env={'JOB_WORKERS': '0'}) for _ in range(runs)]
+    best = min(reports, key=lambda report: report['import'] + report['create_app'] + report['first_request'])
+    print(startup.format_report(best, path, top))
+
+@app.cli.command('ai-cache-stats')
+def ai_cache_stats_command():
+    """Show the size of the AI response cache."""
+    stats = ai_cache.stats(get_db())
+    print(f"{stats['db_entries']} cached responses, served {stats['db_total_hits']} times from the database.")
+    print('Hits and misses of the running server are in /metrics (ai_cache_lookups_total).')
+
+@app.cli.command('ai-cache-clear')
+def ai_cache_clear_command():
+    """Remove every cached AI response (e.g. after changing the prompt)."""
+    ai_cache.clear(get_db())
+    print('Cleared the AI response cache.')
+
+@app.cli.command('page-cache-clear')
+def page_cache_clear_command():
+    """Remove every cached plan page (e.g. after editing plans in the database by hand)."""
+    page_cache.clear()
+    print('Cleared the plan page cache.')
+
 app.teardown_appcontext(close_db)
 
+@app.before_request
+def ensure_job_workers():
+    # Workers are started lazily so each (possibly forked) server process gets its own threads
+    configure_logging()  # Already done by create_app(), but `flask run` serves the app without it
+    jobs.start_workers(app)
+
 # --- Routes ---
 
 @app.route('/')
 def index():
-    plans_exist = False
-    try:
-        db = get_db()
-        # Check if there's at least one plan
-        count = db.execute('SELECT COUNT(id) FROM plans').fetchone()[0]
-        if count > 0:
-            plans_exist = True
-    except sqlite3.Error as e:
-        print(f"Database error checking for plans: {e}")
-        flash("Error checking for existing plans.", "danger")
+    plans_exist = plans_created.is_set()
+    if not plans_exist:
+        try:
+            # Check if there's at least one plan (another process may have created it)
+            plans_exist = database.plans_exist(get_db())
+            if plans_exist:
+                plans_created.set()
+        except sqlite3.Error as e:
+            app.logger.error(f"Database error checking for plans: {e}")
+            flash("Error checking for existing plans.", "danger")
 
     return render_template('index.html', plans_exist=plans_exist)
 
+def record_extraction(repairs):
+    """Count a JSON extraction outcome; `repairs` is None when nothing could be extracted."""
+    if repairs is None:
+        outcome = 'failed'
+    elif 'truncated' in repairs:
+        outcome = 'truncated'
+    else:
+        outcome = 'repaired' if repairs else 'clean'
+    metrics.inc('json_extractions_total', outcome=outcome)
+
 def extract_json_from_text(text):
     """Attempt to extract valid JSON from text - handles cases where model might add extra content."""
-    
-    # First try to parse the entire text as JSON
     try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        # If that fails, try to extract JSON object using regex
-        json_pattern = r'(\{[\s\S]*\})' # Match {...} including newlines
-        matches = re.findall(json_pattern, text)
-        
-        # Try each match from longest to shortest (assume larger match is more complete)
-        matches.sort(key=len, reverse=True)
-        
-        for match in matches:
-            try:
-                return json.loads(match)
-            except json.JSONDecodeError:
-                continue
-                
+        value, repairs = json_repair.extract_json(text)
+        record_extraction(repairs)
+        return value
+    except json_repair.JSONExtractionError:
+        record_extraction(None)
         # If no valid JSON found, create a structured object with the text
         return {
             "extraction_error": "Could not extract valid JSON",
             "raw_text": text
         }
 
-def generate_fallback_schedule(form_data):
-    """Generate a simple fallback schedule when AI fails to provide valid JSON."""
-    start_date = datetime.strptime(form_data['start_date'], '%Y-%m-%d')
-    end_date = datetime.strptime(form_data['end_date'], '%Y-%m-%d')
-    hours_per_day = form_data['hours_per_day']
-    subjects = form_data['subjects'].split(',')
-    off_days_list = form_data.getlist('off_days') if isinstance(form_data.get('off_days'), list) else \
-                    form_data.get('off_days', '').split(',') if form_data.get('off_days') else []
-    
-    # Generate simple schedule
-    schedule = {}
-    current_date = start_date
-    day_of_week = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    
-    while current_date <= end_date:
-        date_str = current_date.strftime('%Y-%m-%d')
-        current_day = day_of_week[current_date.weekday()]
-        
-        # Check if current day is an off day
-        if current_day in off_days_list or 'all' in off_days_list:
-            schedule[date_str] = []
-        else:
-            # Simple distribution of subjects
-            schedule[date_str] = []
-            subject_index = 0
-            study_blocks = []
-            
-            # Create a simple 2-hour block for each subject, up to hours_per_day
-            try:
-                hours = int(hours_per_day)
-                remaining_hours = hours
-                start_hour = 9  # Default start at 9 AM
-                
-                while remaining_hours > 0 and subject_index < len(subjects):
-                    block_hours = min(2, remaining_hours)  # 2-hour blocks or remaining time
-                    
-                    study_blocks.append({
-                        "start_time": f"{start_hour:02d}:00",
-                        "end_time": f"{start_hour + block_hours:02d}:00",
-                        "subject": subjects[subject_index].strip(),
-                        "task": f"Study {subjects[subject_index].strip()}"
-                    })
-                    
-                    start_hour += block_hours
-                    remaining_hours -= block_hours
-                    subject_index = (subject_index + 1) % len(subjects)
-                
-                schedule[date_str] = study_blocks
-            except (ValueError, TypeError):
-                # If hours_per_day is invalid, create a simple default block
-                schedule[date_str] = [{
-                    "start_time": "09:00",
-                    "end_time": "12:00",
-                    "subject": subjects[0].strip() if subjects else "Study",
-                    "task": "General study session"
-                }]
-        
-        current_date = datetime.fromordinal(current_date.toordinal() + 1)
-    
-    return schedule
+# Fields of the new plan form that must not be blank
+REQUIRED_PLAN_FIELDS = ['title', 'start_date', 'end_date', 'subjects', 'learning_goal', 'difficulty_feedback', 'hours_per_day']
+
+def plan_form_data(values):
+    """The plan inputs generate_plan stores, from the submitted form, a CSV row or a JSON object.
+
+    Off days may be repeated form values, a list or a comma separated string.
+    Raises ValueError, naming the field, for a missing or malformed field,
+    unusable dates or hours that are not a positive number.
+    """
+    def text(field):
+        value = values.get(field)
+        if value is None:
+            return ''
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise ValueError(f"'{field}' must be text")
+        return str(value)
+
+    for field in REQUIRED_PLAN_FIELDS:
+        if not text(field).strip():
+            raise ValueError(f"'{field}' is required")
+    off_days = values.getlist('off_days') if hasattr(values, 'getlist') else values.get('off_days') or ''
+    if not isinstance(off_days, str):
+        if not isinstance(off_days, (list, tuple)) or not all(isinstance(day, str) for day in off_days):
+            raise ValueError("'off_days' must be day names, as text or a list")
+        off_days = ','.join(off_days)
+    form_data = {
+        'title': text('title'),
+        'description': text('description'),
+        'start_date': text('start_date').strip(),
+        'end_date': text('end_date').strip(),
+        'subjects': text('subjects'),
+        'learning_goal': text('learning_goal'),
+        'difficulty_feedback': text('difficulty_feedback'),
+        'hours_per_day': text('hours_per_day').strip(),
+        'off_days': off_days,
+        'class_schedule': text('class_schedule')
+    }
+    try:
+        hours = float(form_data['hours_per_day'])
+    except ValueError:
+        raise ValueError("'hours_per_day' must be a number") from None
+    if not 0 < hours <= 24:
+        raise ValueError("'hours_per_day' must be more than 0 and at most 24")
+    if datetime.strptime(form_data['start_date'], '%Y-%m-%d') > datetime.strptime(form_data['end_date'], '%Y-%m-%d'):
+        raise ValueError('start_date is after end_date')
+    return form_data
+
+def plan_form_from_row(plan):
+    """A stored plan's inputs in the form generate_plan receives them (dates as YYYY-MM-DD, hours as text)."""
+    return {
+        'title': plan['title'],
+        'description': plan['description'] or '',
+        'start_date': str(plan['start_date']),
+        'end_date': str(plan['end_date']),
+        'subjects': plan['subjects'],
+        'learning_goal': plan['learning_goal'] or '',
+        'difficulty_feedback': plan['difficulty_feedback'] or '',
+        'hours_per_day': f"{plan['hours_per_day']:g}" if isinstance(plan['hours_per_day'], float) else str(plan['hours_per_day']),
+        'off_days': plan['off_days'] or '',
+        'class_schedule': plan['class_schedule'] or ''
+    }
+
+def prepare_plan(values):
+    """(form_data, marks_data, draft_schedule) for one plan request; see plan_form_data()."""
+    form_data = plan_form_data(values)
+    marks = values.get('subject_marks')
+    if marks is not None and not isinstance(marks, str):
+        raise ValueError("'subject_marks' must be text")
+    marks_data = parse_subject_marks(marks or '')
+    return form_data, marks_data, generate_fallback_schedule(form_data, marks_data)
+
+def generate_fallback_schedule(form_data, marks_data=None):
+    """Generate a local schedule when the AI can't provide one (see scheduler.py).
+
+    Study time is weighted towards subjects with lower marks and kept clear of
+    off days and the parsed class/fixed schedule.
+    """
+    return scheduler.build_schedule(
+        form_data['start_date'], form_data['end_date'], form_data['subjects'].split(','),
+        form_data['hours_per_day'], form_data.get('off_days', ''), form_data.get('class_schedule', ''),
+        marks_data
+    )
 
 def parse_subject_marks(marks_text):
     """Parse the complex subject marks format into a structured format."""
@@ -262,99 +781,193 @@ def parse_subject_marks(marks_text):
             
     return marks_data
 
-def generate_ai_response(prompt):
-    """Generate AI response using Gemini API."""
-    if not GEMINI_API_KEY:
-        return {
-            'learning_guide': "AI generation skipped: API key not configured.",
-            'schedule': {},
-            'resources': "AI generation skipped: API key not configured."
-        }
-    
+def get_generative_model():
+    if USE_GEMINI_STUB:
+        return gemini_stub.StubGenerativeModel('gemini-2.0-flash')
+    return get_genai().GenerativeModel('gemini-2.0-flash')
+
+def call_model(prompt, stream=False):
+    """generate_content through the shared rate limiter, retries and circuit breaker.
+
+    Raises resilience.CircuitOpenError or RateLimitedError at once when Gemini
+    is failing or saturated, so callers go straight to their fallback. With
+    stream=True the result is an iterator of chunks, guarded until it ends.
+    """
+    db = database.get_connection(app.config['DATABASE'])
+    if stream:
+        return gemini_guard.stream(db, get_generative_model().generate_content, prompt, stream=True)
+    return gemini_guard.call(db, get_generative_model().generate_content, prompt)
+
+async def call_model_async(prompt, stream=False):
+    """call_model for asyncio code: awaits generate_content_async under the same guard.
+
+    With stream=True the result is an async iterable of chunks.
+    """
+    if stream:
+        return gemini_guard.stream_async(app.config['DATABASE'], get_generative_model().generate_content_async,
+                                         prompt, stream=True)
+    return await gemini_guard.call_async(app.config['DATABASE'], get_generative_model().generate_content_async,
+                                         prompt)
+
+def ai_failure_reason(error):
+    if isinstance(error, resilience.CircuitOpenError):
+        return 'circuit_open'
+    if isinstance(error, resilience.RateLimitedError):
+        return 'rate_limited'
+    return 'api_error'
+
+def no_api_key_response(form_data, marks_data):
+    metrics.inc('fallback_schedules_total', reason='no_api_key')
+    return {
+        'learning_guide': "AI generation skipped: API key not configured.",
+        'schedule': generate_fallback_schedule(form_data, marks_data),
+        'resources': "AI generation skipped: API key not configured."
+    }
+
+def ai_error_response(error, form_data, marks_data):
+    """The fallback plan when the Gemini call itself failed."""
+    app.logger.error(f"Error calling Gemini API: {error}")
+    reason = ai_failure_reason(error)
+    metrics.inc('ai_failures_total', kind='plan', reason=reason)
+    metrics.inc('fallback_schedules_total', reason=reason)
+    return {
+        'learning_guide': f"AI generation failed: {error}",
+        'schedule': generate_fallback_schedule(form_data, marks_data),
+        'resources': f"AI generation failed. Consider using standard study resources for your subjects."
+    }
+
+def streamed_days(parser, text):
+    """The (date, blocks) pairs a chunk of a streamed plan response completed."""
+    for day, rows in parser.feed(text):
+        try:
+            yield day, schedule_format.expand_day(rows, parser.subjects)
+        except schedule_format.ScheduleFormatError:
+            continue # e.g. subjects listed after the schedule; the full response still has the day
+
+def plan_response_from_text(response_text, form_data, marks_data):
+    """The plan (guide, schedule, resources) in a model response, patched from the fallback schedule where needed."""
+    app.logger.info(f"Received plan response from Gemini ({len(response_text)} characters)")
     try:
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        print("--- Sending Prompt to Gemini ---")
-        response = model.generate_content(prompt)
-        print("--- Received Response from Gemini ---")
-        
-        # Process the response
         try:
-            ai_output = extract_json_from_text(response.text)
-            
-            if "learning_guide" in ai_output and "resources" in ai_output and "schedule" in ai_output:
-                return {
-                    'learning_guide': ai_output['learning_guide'],
-                    'schedule': ai_output['schedule'],
-                    'resources': ai_output['resources']
-                }
+            ai_output, repairs = json_repair.extract_json(response_text)
+            record_extraction(repairs)
+        except json_repair.JSONExtractionError:
+            ai_output, repairs = {}, ()
+            record_extraction(None)
+        if repairs:
+            app.logger.warning(f"Repaired AI response JSON: {', '.join(repairs)}")
+        
+        if "learning_guide" in ai_output and "resources" in ai_output and "schedule" in ai_output:
+            schedule, invalid_days = schedule_format.expand(ai_output['schedule'], ai_output.get('subjects'))
+            response = {
+                'learning_guide': ai_output['learning_guide'],
+                'schedule': schedule,
+                'resources': ai_output['resources']
+            }
+            if invalid_days:
+                app.logger.warning(f"Dropped {len(invalid_days)} malformed schedule days: {', '.join(invalid_days[:5])}")
+                metrics.inc('ai_failures_total', kind='plan', reason='invalid_blocks')
+            if 'truncated' not in repairs and not invalid_days:
+                response['ai_generated'] = True # Only genuine, complete AI output is cached
             else:
-                print("JSON extraction failed, using fallback schedule")
-                return {
-                    'learning_guide': "AI guide extraction failed. Please review the schedule for any available guidance.",
-                    'schedule': generate_fallback_schedule(request.form),
-                    'resources': "AI resources extraction failed. Consider using standard study resources for your subjects."
-                }
-                
-        except Exception as e:
-            print(f"Error processing AI response: {e}")
+                if 'truncated' in repairs:
+                    metrics.inc('ai_failures_total', kind='plan', reason='truncated')
+                if isinstance(schedule, dict):
+                    # Keep the days salvaged from the cut-off response and fill in the rest
+                    metrics.inc('fallback_schedules_total', reason='truncated' if 'truncated' in repairs else 'invalid_blocks')
+                    response['schedule'] = dict(generate_fallback_schedule(form_data, marks_data), **schedule)
+            return response
+        else:
+            app.logger.warning("JSON extraction failed, using fallback schedule")
+            metrics.inc('ai_failures_total', kind='plan', reason='invalid_output')
+            metrics.inc('fallback_schedules_total', reason='invalid_output')
             return {
-                'learning_guide': "Error during AI generation (Processing failed).",
-                'schedule': generate_fallback_schedule(request.form),
-                'resources': "AI generation failed. Consider using standard study resources for your subjects."
+                'learning_guide': "AI guide extraction failed. Please review the schedule for any available guidance.",
+                'schedule': generate_fallback_schedule(form_data, marks_data),
+                'resources': "AI resources extraction failed. Consider using standard study resources for your subjects."
             }
             
     except Exception as e:
-        print(f"Error calling Gemini API: {e}")
+        app.logger.exception(f"Error processing AI response: {e}")
+        metrics.inc('ai_failures_total', kind='plan', reason='processing_error')
+        metrics.inc('fallback_schedules_total', reason='processing_error')
         return {
-            'learning_guide': f"AI generation failed: {e}",
-            'schedule': generate_fallback_schedule(request.form),
-            'resources': f"AI generation failed. Consider using standard study resources for your subjects."
+            'learning_guide': "Error during AI generation (Processing failed).",
+            'schedule': generate_fallback_schedule(form_data, marks_data),
+            'resources': "AI generation failed. Consider using standard study resources for your subjects."
         }
 
-@app.route('/generate', methods=['GET', 'POST'])
-def generate_plan():
-    if request.method == 'POST':
-        try:
-            # Get form data
-            title = request.form['title']
-            description = request.form['description']
-            start_date = request.form['start_date']
-            end_date = request.form['end_date']
-            subjects = request.form['subjects']
-            learning_goal = request.form['learning_goal']
-            difficulty_feedback = request.form['difficulty_feedback']
-            hours_per_day = request.form['hours_per_day']
-            off_days = request.form.get('off_days', '')
-            class_schedule = request.form.get('class_schedule', '')
-            
-            # Parse subject marks
-            marks_text = request.form.get('subject_marks', '')
-            marks_data = parse_subject_marks(marks_text)
-            
-            # Calculate average marks for each subject
-            subject_averages = {}
-            for mark in marks_data:
-                subject = mark['subject_name']
-                if subject not in subject_averages:
-                    subject_averages[subject] = {'total_obtained': 0, 'total_max': 0}
-                subject_averages[subject]['total_obtained'] += mark['obtained_marks']
-                subject_averages[subject]['total_max'] += mark['max_marks']
-            
-            # Format marks for AI prompt
-            marks_summary = []
-            for subject, data in subject_averages.items():
-                percentage = (data['total_obtained'] / data['total_max']) * 100
-                marks_summary.append(f"{subject}: {percentage:.1f}%")
-            
-            # Sort subjects by performance (lowest first)
-            sorted_subjects = sorted(subject_averages.items(), 
-                                  key=lambda x: (x[1]['total_obtained'] / x[1]['total_max']))
-            
-            # Generate AI prompt
-            prompt = f"""
-            Generate a personalized study plan based on the following details.
-            Please provide the output STRICTLY in JSON format with three main keys: "learning_guide", "resources", and "schedule".
+def generate_ai_response(prompt, form_data, on_day=None, marks_data=None):
+    """Generate AI response using Gemini API. `form_data` and `marks_data` are used to build a fallback schedule.
+
+    If `on_day` is given the response is streamed and `on_day(date, blocks)` is
+    called for each schedule day as soon as it has been generated.
+    """
+    if not GEMINI_API_KEY and not USE_GEMINI_STUB:
+        return no_api_key_response(form_data, marks_data)
+    
+    try:
+        app.logger.info("Sending plan prompt to Gemini")
+        with metrics.timer('ai_request_duration_seconds', kind='plan'):
+            if on_day is None:
+                response_text = call_model(prompt).text
+            else:
+                parser = ScheduleStreamParser()
+                parts = []
+                for chunk in call_model(prompt, stream=True):
+                    parts.append(chunk.text)
+                    for day, blocks in streamed_days(parser, chunk.text):
+                        on_day(day, blocks)
+                response_text = ''.join(parts)
+    except Exception as e:
+        return ai_error_response(e, form_data, marks_data)
+    return plan_response_from_text(response_text, form_data, marks_data)
+
+async def generate_ai_response_async(prompt, form_data, on_day=None, marks_data=None):
+    """generate_ai_response for asyncio code: the Gemini call is awaited and `on_day` is a coroutine function."""
+    if not GEMINI_API_KEY and not USE_GEMINI_STUB:
+        return no_api_key_response(form_data, marks_data)
 
+    try:
+        app.logger.info("Sending plan prompt to Gemini")
+        with metrics.timer('ai_request_duration_seconds', kind='plan'):
+            if on_day is None:
+                response_text = (await call_model_async(prompt)).text
+            else:
+                parser = ScheduleStreamParser()
+                parts = []
+                async for chunk in await call_model_async(prompt, stream=True):
+                    parts.append(chunk.text)
+                    for day, blocks in streamed_days(parser, chunk.text):
+                        await on_day(day, blocks)
+                response_text = ''.join(parts)
+    except Exception as e:
+        return ai_error_response(e, form_data, marks_data)
+    return plan_response_from_text(response_text, form_data, marks_data)
+
+def describe_plan(form_data, marks_data):
+    """The "Plan Details" section shared by every prompt for a plan."""
+    title = form_data['title']
+    description = form_data['description']
+    start_date = form_data['start_date']
+    end_date = form_data['end_date']
+    subjects = form_data['subjects']
+    learning_goal = form_data['learning_goal']
+    difficulty_feedback = form_data['difficulty_feedback']
+    hours_per_day = form_data['hours_per_day']
+    off_days = form_data.get('off_days', '')
+    class_schedule = form_data.get('class_schedule', '')
+
+    # Average marks for each subject, as a percentage (shared with the local scheduler)
+    subject_averages = scheduler.subject_averages(marks_data)
+
+    # Format marks for AI prompt
+    marks_summary = [f"{subject}: {percentage:.1f}%" for subject, percentage in subject_averages.items()]
+
+    # Sort subjects by performance (lowest first)
+    sorted_subjects = sorted(subject_averages.items(), key=lambda x: x[1])
+
+    return f"""
             **Plan Details:**
             - Title: {title}
             - Description: {description}
@@ -362,183 +975,933 @@ def generate_plan():
             - Subjects: {subjects}
             - Previous Exam Performance: {', '.join(marks_summary) if marks_summary else 'Not provided'}
             - Subject Performance Ranking (from lowest to highest):
-              {', '.join([f"{subject}: {data['total_obtained']/data['total_max']*100:.1f}%" for subject, data in sorted_subjects]) if sorted_subjects else 'Not provided'}
+              {', '.join([f"{subject}: {percentage:.1f}%" for subject, percentage in sorted_subjects]) if sorted_subjects else 'Not provided'}
             - Learning Goal: {learning_goal}
             - Subject Confidence/Difficulty: {difficulty_feedback}
             - Target Study Hours Per Day: {hours_per_day}
             - Days Off (No Studying): {off_days if off_days else 'None'}
             - Existing Class/Fixed Schedule: {class_schedule if class_schedule else 'None'}
+"""
 
-            **Output Requirements:**
-
+GUIDE_REQUIREMENTS = """
             1.  **learning_guide**: (String) A concise, step-by-step guide outlining a study strategy. Focus on how to approach the subjects based on the provided confidence levels and previous marks. IMPORTANT: Prioritize subjects with lower marks and provide specific improvement strategies for them. Include actionable advice for each subject, with more detailed guidance for subjects with lower performance.
 
             2.  **resources**: (String) A list of relevant learning resources (like specific websites, concepts to search on YouTube, types of practice problems, or book recommendations if applicable) for the subjects listed. Format this as a simple bulleted list or paragraphs within the string. Prioritize resources that address weaker areas, with more resources suggested for subjects with lower marks.
+"""
 
-            3.  **schedule**: (JSON Object) A day-by-day schedule from {start_date} to {end_date}
-                - "start_time": (String) Estimated start time (e.g., "09:00").
-                - "end_time": (String) Estimated end time (e.g., "11:00").
-                - "subject": (String) The subject to study.
-                - "task": (String) A specific task or topic for that block (e.g., "Read Chapter 3", "Practice calculus problems", "Review lecture notes").
+SCHEDULE_PRIORITIES = """
                 IMPORTANT: Allocate more study time to subjects with lower marks. The schedule should reflect this priority by:
                 - Assigning more time blocks to subjects with lower performance
                 - Scheduling more frequent review sessions for weaker subjects
                 - Including more practice problems and revision tasks for subjects with lower marks
-                Factor in the `hours_per_day`, `off_days`, and `class_schedule`. Keep tasks focused and aligned with improvement needs.
+                Factor in the `hours_per_day`, `off_days`, and `class_schedule`. Keep tasks focused and aligned with improvement needs."""
+
+def schedule_keys():
+    """The JSON keys of the schedule part of a response, in the order the model should write them."""
+    return ['subjects', 'schedule'] if app.config['COMPACT_SCHEDULE'] else ['schedule']
+
+def describe_keys(keys):
+    return 'these main keys, in this order: ' + ', '.join(f'"{key}"' for key in keys)
+
+def schedule_requirements(start_date, end_date, number=3):
+    if not app.config['COMPACT_SCHEDULE']:
+        return f"""
+            {number}.  **schedule**: (JSON Object) A day-by-day schedule from {start_date} to {end_date}
+                - "start_time": (String) Estimated start time (e.g., "09:00").
+                - "end_time": (String) Estimated end time (e.g., "11:00").
+                - "subject": (String) The subject to study.
+                - "task": (String) A specific task or topic for that block (e.g., "Read Chapter 3", "Practice calculus problems", "Review lecture notes").{SCHEDULE_PRIORITIES}
                 Example for one day: "YYYY-MM-DD": [ {{"start_time": "10:00", "end_time": "12:00", "subject": "Math", "task": "Practice integration techniques"}}, {{"start_time": "14:00", "end_time": "15:30", "subject": "Physics", "task": "Review kinematics concepts"}} ]
                 If a day is an off_day, the value should be an empty array: "YYYY-MM-DD": []
+"""
+    # Rows instead of objects: no repeated keys or subject names (see schedule_format.py)
+    return f"""
+            {number}.  **subjects**: (JSON Array) Every subject used in the schedule, each listed once (e.g., ["Math", "Physics"]). Write this key before "schedule".
+
+            {number + 1}.  **schedule**: (JSON Object) A day-by-day schedule from {start_date} to {end_date}. Each date maps to an array of study blocks, and each block is an array of four values, in this order:
+                - start_time: (String) Estimated start time (e.g., "09:00").
+                - end_time: (String) Estimated end time (e.g., "11:00").
+                - subject: (Number) The position of the subject in "subjects", counting from 0.
+                - task: (String) A specific task or topic for that block (e.g., "Read Chapter 3", "Practice calculus problems", "Review lecture notes").{SCHEDULE_PRIORITIES}
+                Example for one day, with "subjects": ["Math", "Physics"]: "YYYY-MM-DD": [["10:00", "12:00", 0, "Practice integration techniques"], ["14:00", "15:30", 1, "Review kinematics concepts"]]
+                If a day is an off_day, the value should be an empty array: "YYYY-MM-DD": []
+"""
 
-            **Important:** Your response must be a valid JSON object with ONLY these three keys. Do not include any explanatory text, markdown formatting, or code blocks. Just return the raw JSON object.
+def build_plan_prompt(form_data, marks_data):
+    """Build the Gemini prompt for a plan from its form fields and parsed subject marks."""
+    return f"""
+            Generate a personalized study plan based on the following details.
+            Please provide the output STRICTLY in JSON format with {describe_keys(['learning_guide', 'resources'] + schedule_keys())}.
+{describe_plan(form_data, marks_data)}
+            **Output Requirements:**
+{GUIDE_REQUIREMENTS}{schedule_requirements(form_data['start_date'], form_data['end_date'])}
+            **Important:** Your response must be a valid JSON object with ONLY these keys. Do not include any explanatory text, markdown formatting, or code blocks. Just return the raw JSON object.
             """
-            
-            # Generate AI response and get JSON output
-            ai_response = generate_ai_response(prompt)
-            
-            # Save to database
+
+def build_guide_prompt(form_data, marks_data):
+    """Prompt for only the learning guide and resources (the schedule is requested per window)."""
+    return f"""
+            Generate a personalized study strategy based on the following details.
+            Please provide the output STRICTLY in JSON format with two main keys: "learning_guide" and "resources".
+{describe_plan(form_data, marks_data)}
+            **Output Requirements:**
+{GUIDE_REQUIREMENTS}
+            **Important:** Your response must be a valid JSON object with ONLY these two keys. Do not include any explanatory text, markdown formatting, or code blocks. Just return the raw JSON object.
+            """
+
+def build_schedule_window_prompt(form_data, marks_data, window_start, window_end, dates=None):
+    """Prompt for the schedule of one date window of a longer plan, or only the given `dates` of it."""
+    if dates:
+        # Regenerating days of an existing plan; the other days stay as they are
+        scope = f"Only some days of an existing plan are being updated; only produce these days: {', '.join(dates)}."
+        contents = "containing exactly these dates"
+    else:
+        scope = f"The full plan is split into date windows; only produce the days from {window_start} to {window_end}."
+        contents = f"containing every date from {window_start} to {window_end} and no other dates"
+    return f"""
+            Generate part of a personalized study schedule based on the following details.
+            {scope}
+            Please provide the output STRICTLY in JSON format with {describe_keys(schedule_keys())}.
+{describe_plan(form_data, marks_data)}
+            **Output Requirements:**
+{schedule_requirements(window_start, window_end, number=1)}
+            **Important:** Your response must be a valid JSON object with ONLY these keys, its "schedule" {contents}. Do not include any explanatory text, markdown formatting, or code blocks. Just return the raw JSON object.
+            """
+
+def split_date_range(start_date, end_date, window_days):
+    """Split an inclusive YYYY-MM-DD range into consecutive windows of at most `window_days` days."""
+    start = datetime.strptime(start_date, '%Y-%m-%d').date()
+    end = datetime.strptime(end_date, '%Y-%m-%d').date()
+    windows = []
+    while start <= end:
+        window_end = min(end, start + timedelta(days=window_days - 1))
+        windows.append((start.isoformat(), window_end.isoformat()))
+        start = window_end + timedelta(days=1)
+    return windows
+
+def validate_schedule_window(schedule, window_start, window_end, dates=None):
+    """Keep the well-formed days inside the window (or of `dates`). Returns (days, missing_dates)."""
+    expected = dates or [start for start, _ in split_date_range(window_start, window_end, 1)]
+    days = {}
+    if isinstance(schedule, dict):
+        for day in expected:
+            blocks = schedule.get(day)
+            if schedule_format.is_valid_day(blocks):
+                days[day] = blocks
+    return days, [day for day in expected if day not in days]
+
+def window_days_from_text(response_text, window_start, window_end, dates=None):
+    """The valid days of one window in a model response; (days, missing_dates) as validate_schedule_window."""
+    output = extract_json_from_text(response_text)
+    schedule, _ = schedule_format.expand(output.get('schedule'), output.get('subjects'))
+    return validate_schedule_window(schedule, window_start, window_end, dates)
+
+def window_attempt_failed(error, window_start, window_end, attempt):
+    """Record a failed window request; True if retrying is pointless (the guard is refusing calls)."""
+    app.logger.error(f"Error generating schedule window {window_start} to {window_end} (attempt {attempt + 1}): {error}")
+    metrics.inc('ai_failures_total', kind='window', reason=ai_failure_reason(error))
+    return isinstance(error, (resilience.CircuitOpenError, resilience.RateLimitedError))
+
+def complete_window(best_days, best_missing, form_data, marks_data, window_start, window_end):
+    """Patch whatever is still missing with fallback days for just this window. Returns (days, True)."""
+    metrics.inc('fallback_schedules_total', reason='window')
+    fallback = generate_fallback_schedule(dict(form_data, start_date=window_start, end_date=window_end), marks_data)
+    for day in (best_missing if best_missing is not None else fallback):
+        best_days[day] = fallback.get(day, [])
+    return dict(sorted(best_days.items())), True
+
+def generate_schedule_window(form_data, marks_data, window_start, window_end, dates=None):
+    """Ask the model for one window's schedule (or only its `dates`), retrying until enough of it is valid.
+
+    Returns (days, used_fallback). Days the model still got wrong after the
+    last attempt are filled in from the fallback schedule.
+    """
+    prompt = build_schedule_window_prompt(form_data, marks_data, window_start, window_end, dates)
+    best_days, best_missing = {}, None
+    for attempt in range(1 + app.config['AI_WINDOW_RETRIES']):
+        try:
+            with metrics.timer('ai_request_duration_seconds', kind='window'):
+                response_text = call_model(prompt).text
+            days, missing = window_days_from_text(response_text, window_start, window_end, dates)
+        except Exception as e:
+            if window_attempt_failed(e, window_start, window_end, attempt):
+                break # Another attempt would fail the same way; fall back now
+            continue
+        if missing:
+            metrics.inc('ai_failures_total', kind='window', reason='invalid_output')
+        if best_missing is None or len(missing) < len(best_missing):
+            best_days, best_missing = days, missing
+        if not missing:
+            return days, False
+    return complete_window(best_days, best_missing, form_data, marks_data, window_start, window_end)
+
+async def generate_schedule_window_async(form_data, marks_data, window_start, window_end, dates=None):
+    """generate_schedule_window for asyncio code."""
+    prompt = build_schedule_window_prompt(form_data, marks_data, window_start, window_end, dates)
+    best_days, best_missing = {}, None
+    for attempt in range(1 + app.config['AI_WINDOW_RETRIES']):
+        try:
+            with metrics.timer('ai_request_duration_seconds', kind='window'):
+                response_text = (await call_model_async(prompt)).text
+            days, missing = window_days_from_text(response_text, window_start, window_end, dates)
+        except Exception as e:
+            if window_attempt_failed(e, window_start, window_end, attempt):
+                break
+            continue
+        if missing:
+            metrics.inc('ai_failures_total', kind='window', reason='invalid_output')
+        if best_missing is None or len(missing) < len(best_missing):
+            best_days, best_missing = days, missing
+        if not missing:
+            return days, False
+    return complete_window(best_days, best_missing, form_data, marks_data, window_start, window_end)
+
+def limit_concurrency(coroutines, limit):
+    """Wrap coroutines so at most `limit` of them run at once, as AI_MAX_PARALLEL limits the thread pools."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def limited(coroutine):
+        async with semaphore:
+            return await coroutine
+    return [limited(coroutine) for coroutine in coroutines]
+
+def date_groups(dates):
+    size = app.config['SCHEDULE_WINDOW_DAYS']
+    return [dates[i:i + size] for i in range(0, len(dates), size)]
+
+def fallback_days(form_data, marks_data, dates):
+    metrics.inc('fallback_schedules_total', reason='no_api_key')
+    fallback = generate_fallback_schedule(dict(form_data, start_date=dates[0], end_date=dates[-1]), marks_data)
+    return {day: fallback.get(day, []) for day in dates}, True
+
+def generate_schedule_days(form_data, marks_data, dates):
+    """Generate only the given days of a plan, in concurrent requests of at most SCHEDULE_WINDOW_DAYS days each.
+
+    Returns (days, used_fallback), like generate_schedule_window.
+    """
+    if not (GEMINI_API_KEY or USE_GEMINI_STUB):
+        return fallback_days(form_data, marks_data, dates)
+    days, used_fallback = {}, False
+    with ThreadPoolExecutor(max_workers=app.config['AI_MAX_PARALLEL']) as pool:
+        futures = [pool.submit(generate_schedule_window, form_data, marks_data, group[0], group[-1], group)
+                   for group in date_groups(dates)]
+        for future in futures:
+            group_days, group_fallback = future.result()
+            days.update(group_days)
+            used_fallback = used_fallback or group_fallback
+    return dict(sorted(days.items())), used_fallback
+
+async def generate_schedule_days_async(form_data, marks_data, dates):
+    """generate_schedule_days for asyncio code."""
+    if not (GEMINI_API_KEY or USE_GEMINI_STUB):
+        return fallback_days(form_data, marks_data, dates)
+    results = await asyncio.gather(*limit_concurrency(
+        [generate_schedule_window_async(form_data, marks_data, group[0], group[-1], group) for group in date_groups(dates)],
+        app.config['AI_MAX_PARALLEL']))
+    days = {day: blocks for group_days, _ in results for day, blocks in group_days.items()}
+    return dict(sorted(days.items())), any(group_fallback for _, group_fallback in results)
+
+def generate_guide(form_data, marks_data):
+    """Ask the model for the learning guide and resources of a windowed plan."""
+    with metrics.timer('ai_request_duration_seconds', kind='guide'):
+        response_text = call_model(build_guide_prompt(form_data, marks_data)).text
+    return extract_json_from_text(response_text)
+
+async def generate_guide_async(form_data, marks_data):
+    with metrics.timer('ai_request_duration_seconds', kind='guide'):
+        response_text = (await call_model_async(build_guide_prompt(form_data, marks_data))).text
+    return extract_json_from_text(response_text)
+
+def windowed_response(guide_output, schedule, used_fallback):
+    """Combine a windowed plan's guide output (None if its request failed) with its schedule windows."""
+    if isinstance(guide_output, dict) and isinstance(guide_output.get('learning_guide'), str) \
+            and isinstance(guide_output.get('resources'), str):
+        guide = {'learning_guide': guide_output['learning_guide'], 'resources': guide_output['resources']}
+        guide_ok = True
+    else:
+        guide = {
+            'learning_guide': "AI guide extraction failed. Please review the schedule for any available guidance.",
+            'resources': "AI resources extraction failed. Consider using standard study resources for your subjects."
+        }
+        guide_ok = False
+        metrics.inc('ai_failures_total', kind='guide', reason='invalid_output')
+
+    response = dict(guide, schedule=dict(sorted(schedule.items())))
+    if guide_ok and not used_fallback:
+        response['ai_generated'] = True
+    return response
+
+def generate_windowed_ai_response(form_data, marks_data, windows, on_day=None):
+    """Generate a long plan as concurrent per-window schedule requests plus one guide request."""
+    schedule = {}
+    used_fallback = False
+    with ThreadPoolExecutor(max_workers=app.config['AI_MAX_PARALLEL']) as pool:
+        guide_future = pool.submit(generate_guide, form_data, marks_data)
+        window_futures = [pool.submit(generate_schedule_window, form_data, marks_data, start, end)
+                          for start, end in windows]
+        # Publish each window as soon as it is done; callbacks stay on this thread
+        for future in as_completed(window_futures):
+            days, window_fallback = future.result()
+            used_fallback = used_fallback or window_fallback
+            schedule.update(days)
+            if on_day is not None:
+                for day, blocks in days.items():
+                    on_day(day, blocks)
+        try:
+            guide_output = guide_future.result()
+        except Exception as e:
+            app.logger.error(f"Error generating learning guide: {e}")
+            guide_output = None
+    return windowed_response(guide_output, schedule, used_fallback)
+
+async def generate_windowed_ai_response_async(form_data, marks_data, windows, on_day=None):
+    """generate_windowed_ai_response for asyncio code; `on_day` is a coroutine function."""
+    guide, *window_coroutines = limit_concurrency(
+        [generate_guide_async(form_data, marks_data)]
+        + [generate_schedule_window_async(form_data, marks_data, start, end) for start, end in windows],
+        app.config['AI_MAX_PARALLEL'])
+    guide_task = asyncio.ensure_future(guide)
+    schedule = {}
+    used_fallback = False
+    for future in asyncio.as_completed(window_coroutines):
+        days, window_fallback = await future
+        used_fallback = used_fallback or window_fallback
+        schedule.update(days)
+        if on_day is not None:
+            for day, blocks in days.items():
+                await on_day(day, blocks)
+    try:
+        guide_output = await guide_task
+    except Exception as e:
+        app.logger.error(f"Error generating learning guide: {e}")
+        guide_output = None
+    return windowed_response(guide_output, schedule, used_fallback)
+
+def use_windows(form_data):
+    """The date windows of a plan, if it is long enough to be generated in windows; else None."""
+    windows = split_date_range(form_data['start_date'], form_data['end_date'],
+                               app.config['SCHEDULE_WINDOW_DAYS'])
+    return windows if len(windows) > 1 and (GEMINI_API_KEY or USE_GEMINI_STUB) else None
+
+def generate_plan_response(form_data, marks_data, on_day=None):
+    """Generate a plan in one request, or as concurrent windows when the date range is long."""
+    windows = use_windows(form_data)
+    if windows:
+        return generate_windowed_ai_response(form_data, marks_data, windows, on_day=on_day)
+    return generate_ai_response(build_plan_prompt(form_data, marks_data), form_data, on_day=on_day,
+                                marks_data=marks_data)
+
+async def generate_plan_response_async(form_data, marks_data, on_day=None):
+    """generate_plan_response for asyncio code."""
+    windows = use_windows(form_data)
+    if windows:
+        return await generate_windowed_ai_response_async(form_data, marks_data, windows, on_day=on_day)
+    return await generate_ai_response_async(build_plan_prompt(form_data, marks_data), form_data, on_day=on_day,
+                                            marks_data=marks_data)
+
+# Job steps that touch the database, shared by the threaded and the asyncio job handlers
+
+def begin_plan_generation(db, plan_id, cache_key):
+    """The cached AI response for a plan's inputs; if there is none, clear days an earlier attempt streamed."""
+    # Identical inputs (e.g. a whole cohort with the same subjects and dates) reuse one AI response
+    ai_response = ai_cache.get(db, cache_key)
+    if ai_response is None:
+        # Days streamed by an earlier, interrupted attempt are stale
+        with database.transaction(db):
+            database.clear_stream_days(db, plan_id)
+    else:
+        app.logger.info(f"Served plan {plan_id} from the AI response cache.")
+    return ai_response
+
+def publish_stream_day(db, plan_id, day, blocks):
+    # Picked up by stream_plan and pushed to the pending plan page
+    with database.transaction(db):
+        database.insert_stream_day(db, plan_id, day, blocks)
+
+def finish_plan_generation(db, plan_id, cache_key, ai_response, generated):
+    """Store a plan's AI response (caching it if `generated` by the AI just now) and mark the plan ready."""
+    if generated and ai_response.get('ai_generated'):
+        ai_cache.put(db, cache_key, ai_response)
+    with database.transaction(db):
+        database.update_plan_content(db, plan_id, ai_response['learning_guide'],
+                                     ai_response['schedule'], ai_response['resources'])
+        database.clear_stream_days(db, plan_id)
+    plan_changed(plan_id)
+
+def store_replanned_days(db, plan_id, revision_id, days):
+    with database.transaction(db):
+        # A later update may have shortened the plan meanwhile; never bring its dropped days back
+        plan = database.get_plan_summary(db, plan_id)
+        start, end = str(plan['start_date']), str(plan['end_date'])
+        database.replace_schedule_days(db, plan_id, {day: blocks for day, blocks in days.items() if start <= day <= end})
+        database.finish_plan_revision(db, revision_id, 'done')
+    plan_changed(plan_id)
+
+def fail_replan(db, plan_id, revision_id, error):
+    # The draft days written by replan_plan stay in place
+    with database.transaction(db):
+        database.finish_plan_revision(db, revision_id, 'failed', str(error))
+    plan_changed(plan_id)
+
+@jobs.register_failure('generate_plan')
+def fail_plan_generation(db, plan_id, payload, error):
+    # Out of attempts: the plan page shows that AI generation failed, over the draft schedule
+    with database.transaction(db):
+        database.mark_plan_failed(db, plan_id)
+    plan_changed(plan_id)
+
+@jobs.register('generate_plan')
+def generate_plan_job(app, plan_id, payload):
+    """Background job: call the AI for a pending plan and store the result."""
+    form_data = payload['form']
+    db = get_db()
+    cache_key = ai_cache_key(form_data, payload['marks'])
+    ai_response = begin_plan_generation(db, plan_id, cache_key)
+    generated = ai_response is None
+    if generated:
+        def publish_day(day, blocks):
+            publish_stream_day(db, plan_id, day, blocks)
+
+        ai_response = generate_plan_response(form_data, payload['marks'],
+                                             on_day=publish_day if app.config['STREAM_GENERATION'] else None)
+    finish_plan_generation(db, plan_id, cache_key, ai_response, generated)
+
+@jobs.register_async('generate_plan')
+async def generate_plan_job_async(app, plan_id, payload):
+    """generate_plan_job as a coroutine, for the asyncio job runner (see jobs.work_async)."""
+    form_data = payload['form']
+    path = app.config['DATABASE']
+    cache_key = ai_cache_key(form_data, payload['marks'])
+    ai_response = await database.run_async(path, begin_plan_generation, plan_id, cache_key)
+    generated = ai_response is None
+    if generated:
+        async def publish_day(day, blocks):
+            await database.run_async(path, publish_stream_day, plan_id, day, blocks)
+
+        ai_response = await generate_plan_response_async(
+            form_data, payload['marks'], on_day=publish_day if app.config['STREAM_GENERATION'] else None)
+    await database.run_async(path, finish_plan_generation, plan_id, cache_key, ai_response, generated)
+
+@jobs.register_failure('replan')
+def fail_replan_job(db, plan_id, payload, error):
+    # The job itself died (e.g. its worker was killed); the plan is still the last good one
+    revision = database.get_plan_revision(db, payload['revision_id'])
+    if revision is not None and revision['status'] == 'pending':
+        fail_replan(db, plan_id, payload['revision_id'], error)
+
+@jobs.register('replan')
+def replan_job(app, plan_id, payload):
+    """Background job: regenerate only the days a plan update affected (see replan_plan)."""
+    db = get_db()
+    try:
+        days, _ = generate_schedule_days(payload['form'], payload['marks'], payload['dates'])
+        store_replanned_days(db, plan_id, payload['revision_id'], days)
+    except Exception as e:
+        app.logger.exception(f"Could not regenerate days for revision {payload['revision_id']} of plan {plan_id}")
+        fail_replan(db, plan_id, payload['revision_id'], e)
+
+@jobs.register_async('replan')
+async def replan_job_async(app, plan_id, payload):
+    path = app.config['DATABASE']
+    try:
+        days, _ = await generate_schedule_days_async(payload['form'], payload['marks'], payload['dates'])
+        await database.run_async(path, store_replanned_days, plan_id, payload['revision_id'], days)
+    except Exception as e:
+        app.logger.exception(f"Could not regenerate days for revision {payload['revision_id']} of plan {plan_id}")
+        await database.run_async(path, fail_replan, plan_id, payload['revision_id'], e)
+
+@app.route('/generate', methods=['GET', 'POST'])
+def generate_plan():
+    if request.method == 'POST':
+        try:
+            # Form fields (off days are one checkbox value per day) and parsed subject marks
+            form_data, marks_data, draft_schedule = prepare_plan(request.form)
+
+            # Save a pending plan; the AI output is filled in by a background job
             db = get_db()
-            cursor = db.cursor()
-            
-            # Insert plan
-            cursor.execute('''
-                INSERT INTO plans (title, description, start_date, end_date, subjects, learning_goal, 
-                                 difficulty_feedback, hours_per_day, off_days, class_schedule, 
-                                 generated_guide, generated_schedule, resources)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (title, description, start_date, end_date, subjects, learning_goal,
-                  difficulty_feedback, hours_per_day, off_days, class_schedule,
-                  ai_response['learning_guide'], json.dumps(ai_response['schedule']),
-                  ai_response['resources']))
-            
-            plan_id = cursor.lastrowid
-            
-            # Insert subject marks
-            for mark in marks_data:
-                cursor.execute('''
-                    INSERT INTO subject_marks (plan_id, subject_name, component_type, 
-                                             assessment_name, max_marks, obtained_marks)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (plan_id, mark['subject_name'], mark['component_type'],
-                      mark['assessment_name'], mark['max_marks'], mark['obtained_marks']))
-            
-            db.commit()
-            flash("Study plan generated successfully!", "success")
+            with database.transaction(db):
+                plan_id = database.insert_pending_plan(db, form_data)
+                database.insert_subject_marks(db, plan_id, marks_data)
+                # A local draft schedule is shown until the AI plan is ready (and kept if it fails)
+                database.update_plan_schedule(db, plan_id, draft_schedule)
+                jobs.enqueue(db, plan_id, 'generate_plan', {'form': form_data, 'marks': marks_data})
+            plans_created.set()
+            jobs.notify()
+            flash("Your study plan is being generated. This page will update when it is ready.", "info")
             return redirect(url_for('view_plan', plan_id=plan_id))
-            
+
         except Exception as e:
-            print(f"Error generating plan: {e}")
+            app.logger.exception(f"Error generating plan: {e}")
             flash(f"An error occurred while generating the plan: {e}", "danger")
             return render_template('generate.html')
-    
+
     return render_template('generate.html')
 
+def highlight_snippet(snippet):
+    """A search snippet as HTML: escaped, with the matched words in <mark>."""
+    return Markup(str(escape(snippet or '')).replace(database.HIGHLIGHT_START, '<mark>')
+                  .replace(database.HIGHLIGHT_END, '</mark>'))
+
 @app.route('/plans')
 def list_plans():
+    """Plans newest first, or those matching ?q= best first, a page at a time.
+
+    Pages continue from a cursor (?before=<id>, or ?after=<rank>:<id> when
+    searching) instead of an offset, so every page is one indexed lookup.
+    """
     db = get_db()
-    plans = db.execute('SELECT id, title, start_date, end_date FROM plans ORDER BY id DESC').fetchall()
-    return render_template('plans.html', plans=plans)
+    query = request.args.get('q', '').strip()
+    page_size = app.config['PLANS_PAGE_SIZE']
+    next_url = None
+    if query:
+        match = database.search_match(query)
+        try:
+            rank, plan_id = request.args['after'].split(':')
+            after = (float(rank), int(plan_id))
+        except (KeyError, ValueError):
+            after = None
+        plans = database.search_plans(db, match, after, page_size + 1) if match else []
+        if len(plans) > page_size:
+            last = plans[page_size - 1]
+            next_url = url_for('list_plans', q=query, after=f"{last['rank']!r}:{last['id']}")
+    else:
+        plans = database.list_plans(db, request.args.get('before', type=int), page_size + 1)
+        if len(plans) > page_size:
+            next_url = url_for('list_plans', before=plans[page_size - 1]['id'])
+    plans = [dict(plan, snippet=highlight_snippet(plan['snippet']) if query else None) for plan in plans[:page_size]]
+    return render_template('plans.html', plans=plans, query=query, next_url=next_url)
 
 @app.route('/plan/<int:plan_id>')
 def view_plan(plan_id):
+    # A finished plan's page is rendered once; a page with flashed messages is always rendered afresh
+    cacheable = app.config['PAGE_CACHE_TTL'] > 0 and '_flashes' not in session
+    if cacheable:
+        page = page_cache.get(plan_id)
+        metrics.inc('page_cache_lookups_total', outcome='miss' if page is None else 'hit')
+        if page is not None:
+            return page
+    read_since = time.time_ns()
     plan = None
     try:
         db = get_db()
-        plan = db.execute(
-            'SELECT * FROM plans WHERE id = ?', (plan_id,)
-        ).fetchone()
+        # The schedule itself is loaded by the calendar from plan_events, so skip the big JSON column
+        plan = database.get_plan_summary(db, plan_id)
     except sqlite3.Error as e:
-        print(f"Database error fetching plan {plan_id}: {e}")
+        app.logger.error(f"Database error fetching plan {plan_id}: {e}")
         flash(f"Error retrieving plan details: {e}", "danger")
 
     if plan is None:
         flash("Study plan not found.", "warning")
         return redirect(url_for('list_plans')) # Redirect if plan doesn't exist
 
-    # Process generated_schedule for calendar view
-    calendar_data = {}
-    schedule_json_string = plan['generated_schedule']
+    if plan['status'] == 'pending':
+        # The AI job is still running; the page polls plan_status and reloads when done
+        return render_template('plan_pending.html', plan=plan)
+    if plan['status'] == 'failed':
+        flash("AI generation failed for this plan. Use 'Attempt to Fix JSON' to build a schedule from your plan details.", "danger")
+
+    has_schedule = database.has_schedule_blocks(db, plan_id)
+    schedule_json_string = None
     is_raw_schedule = False # Flag to indicate if schedule is not valid JSON
 
-    if schedule_json_string:
-        try:
-            calendar_data = json.loads(schedule_json_string)
-            if not isinstance(calendar_data, dict):
-                 # If it's valid JSON but not a dict (e.g., just a string), treat as raw
-                 print(f"Parsed schedule for plan {plan_id} is not a dictionary, treating as raw.")
-                 calendar_data = {}
-                 is_raw_schedule = True
-            # print(f"Successfully parsed schedule JSON for plan {plan_id}")
-        except json.JSONDecodeError:
-            print(f"Could not parse schedule JSON for plan {plan_id}, treating as raw text.")
-            calendar_data = {}
-            is_raw_schedule = True # Keep the raw string for display
+    # Only a plan without schedule blocks needs its JSON checked, to offer the raw text and a fix
+    if not has_schedule:
+        schedule_json_string = database.get_plan_schedule_json(db, plan_id)
+        if schedule_json_string:
+            try:
+                if not isinstance(json.loads(schedule_json_string), dict):
+                     # If it's valid JSON but not a dict (e.g., just a string), treat as raw
+                     app.logger.info(f"Parsed schedule for plan {plan_id} is not a dictionary, treating as raw.")
+                     is_raw_schedule = True
+            except json.JSONDecodeError:
+                app.logger.info(f"Could not parse schedule JSON for plan {plan_id}, treating as raw text.")
+                is_raw_schedule = True # Keep the raw string for display
+        else:
+            app.logger.info(f"Schedule data is empty for plan {plan_id}.")
+
+    revisions = [dict(revision, changes=json.loads(revision['changes']))
+                 for revision in database.get_plan_revisions(db, plan_id, limit=5)]
+    page = render_template('plan.html', plan=plan, has_schedule=has_schedule, revisions=revisions,
+                           schedule_raw=schedule_json_string if is_raw_schedule else None)
+    if cacheable and plan['status'] == 'ready':
+        page_cache.put(plan_id, page, read_since)
+    return page
+
+def _plan_last_modified(version):
+    return datetime.strptime(version['modified'][:19], '%Y-%m-%d %H:%M:%S')
+
+@app.route('/plan/<int:plan_id>/events')
+def plan_events(plan_id):
+    """FullCalendar event feed: the blocks between ?start= and ?end= (exclusive) only.
+
+    Responses carry an ETag derived from the plan's write counter and its
+    updated_at as Last-Modified, so revisiting a week the browser already has costs one indexed row lookup.
+    """
+    start = request.args.get('start', '')[:10]
+    end = request.args.get('end', '')[:10]
+    try:
+        datetime.strptime(start, '%Y-%m-%d')
+        datetime.strptime(end, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': 'start and end must be dates (YYYY-MM-DD...)'}), 400
+
+    db = get_db()
+    version = database.get_plan_version(db, plan_id)
+    if version is None:
+        return jsonify({'error': 'Plan not found'}), 404
+
+    etag = hashlib.sha1(f"{plan_id}:{version['version']}:{start}:{end}".encode('utf-8')).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        rows = database.get_schedule_blocks(db, plan_id, start, end, date_to_exclusive=True)
+        response = jsonify([{
+            'title': f"{row['subject']}: {row['task']}",
+            'start': f"{row['date']}T{row['start_time']}",
+            'end': f"{row['date']}T{row['end_time']}",
+            'extendedProps': {'subject': row['subject'], 'task': row['task']}
+        } for row in rows])
+    response.set_etag(etag)
+    response.last_modified = _plan_last_modified(version)
+    response.headers['Cache-Control'] = 'private, no-cache' # Always revalidate; usually a 304
+    return response
+
+@app.route('/plan/<int:plan_id>/export.<fmt>')
+def export_plan(plan_id, fmt):
+    """Download the schedule as .ics (also a calendar subscription URL), .csv, .txt or the full plan as .pdf.
+
+    The export is streamed from schedule_blocks while being saved to
+    EXPORT_CACHE_DIR under a key of the plan's write counter, so later requests
+    are served from that file and revalidated with an ETag. plan_changed
+    removes the files when the plan is written.
+    """
+    exporter = exports.EXPORTERS.get(fmt)
+    if exporter is None:
+        abort(404)
+    db = get_db()
+    version = database.get_plan_version(db, plan_id)
+    if version is None:
+        abort(404)
+
+    etag = hashlib.sha1(f"{plan_id}:{version['version']}:{fmt}:{exports.EXPORT_VERSION}".encode('utf-8')).hexdigest()
+    path = exports.cache_path(app.config['EXPORT_CACHE_DIR'], plan_id, etag[:16], fmt)
+    last_modified = _plan_last_modified(version)
+    download_name = f'study_plan_{plan_id}.{fmt}'
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    elif os.path.exists(path):
+        response = send_file(path, mimetype=exports.MIMETYPES[fmt], as_attachment=True,
+                             download_name=download_name, conditional=False)
     else:
-        print(f"Schedule data is empty for plan {plan_id}.")
+        plan = database.get_plan_summary(db, plan_id)
+        rows = database.get_schedule_blocks(db, plan_id)
+        chunks = exporter(plan, rows, stamp=last_modified) if fmt == 'ics' else exporter(plan, rows)
+        response = Response(stream_with_context(exports.cached_stream(path, chunks)), mimetype=exports.MIMETYPES[fmt])
+        response.headers['Content-Disposition'] = f'attachment; filename={download_name}'
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/plan/<int:plan_id>/status')
+def plan_status(plan_id):
+    """JSON status of a plan's generation job, polled by the pending plan page."""
+    db = get_db()
+    status = database.get_plan_status(db, plan_id)
+    if status is None:
+        return jsonify({'error': 'Plan not found'}), 404
+    job = jobs.get_plan_job(db, plan_id)
+    return jsonify({
+        'plan_id': plan_id,
+        'status': status,
+        'job_status': job['status'] if job else None,
+        'attempts': job['attempts'] if job else 0,
+        'url': url_for('view_plan', plan_id=plan_id)
+    })
+
+@app.route('/api/batches', methods=['POST'])
+def create_plan_batch():
+    """Create plans for a whole class: {"plans": [{...new plan form fields, "subject_marks": "..."}, ...]}.
+
+    Plans are generated in the background; poll the returned status_url.
+    Posting the same batch again returns the existing batch instead of duplicating it.
+    """
+    payload = request.get_json(silent=True)
+    items = payload.get('plans') if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+        return jsonify({'error': 'Expected a JSON object with a non-empty "plans" array of objects'}), 400
+    if len(items) > app.config['BULK_MAX_ITEMS']:
+        return jsonify({'error': f"At most {app.config['BULK_MAX_ITEMS']} plans per batch"}), 413
+    db = get_db()
+    batch_id, created, _, skipped = bulk.create_batch(db, 'api', bulk.source_key(items), list(enumerate(items)),
+                                                      prepare_plan, chunk_size=app.config['BULK_CHUNK_SIZE'])
+    if created:
+        plans_created.set()
+    body = batch_status(db, batch_id)
+    return jsonify(body), 200 if skipped and not created else 202
+
+@app.route('/api/batches/<int:batch_id>')
+def plan_batch_status(batch_id):
+    """Progress of a batch and the status of each of its plans."""
+    db = get_db()
+    if database.get_batch(db, batch_id) is None:
+        return jsonify({'error': 'Batch not found'}), 404
+    return jsonify(batch_status(db, batch_id))
+
+def batch_status(db, batch_id):
+    batch = database.get_batch(db, batch_id)
+    return {
+        'batch_id': batch_id,
+        'total': batch['total_items'],
+        'progress': database.get_batch_progress(db, batch_id),
+        'status_url': url_for('plan_batch_status', batch_id=batch_id),
+        'items': [{
+            'item': item['item_number'],
+            'plan_id': item['plan_id'],
+            'status': item['status'] or 'rejected',
+            'error': item['error'],
+            'url': url_for('view_plan', plan_id=item['plan_id']) if item['plan_id'] else None
+        } for item in database.get_batch_items(db, batch_id)]
+    }
 
-    return render_template('plan.html', plan=plan, calendar_data=calendar_data, schedule_raw=schedule_json_string if is_raw_schedule else None)
+def performance_json(row):
+    """A subject_performance aggregate row as JSON, with percentages rounded to one decimal."""
+    return {key: round(value, 1) if key.endswith('percentage') and value is not None else value
+            for key, value in dict(row).items()}
+
+@app.route('/api/analytics/subjects')
+def subject_analytics():
+    """Marks per subject across every plan (or ?batch_id=), weakest first.
+
+    ?weak_below= (default 50) sets the percentage under which a plan counts as
+    weak in a subject; ?limit= caps the number of subjects.
+    """
+    batch_id = request.args.get('batch_id', type=int)
+    weak_below = request.args.get('weak_below', 50.0, type=float)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    db = get_db()
+    if batch_id is not None and database.get_batch(db, batch_id) is None:
+        return jsonify({'error': 'Batch not found'}), 404
+    rows = database.get_cohort_subject_performance(db, weak_below, batch_id, limit)
+    return jsonify({'batch_id': batch_id, 'weak_below': weak_below, 'subjects': [performance_json(row) for row in rows]})
+
+@app.route('/api/analytics/plans/<int:plan_id>')
+def plan_analytics(plan_id):
+    """A plan's marks per subject compared with the same subjects across every plan (or ?batch_id=)."""
+    batch_id = request.args.get('batch_id', type=int)
+    db = get_db()
+    if not database.plan_exists(db, plan_id):
+        return jsonify({'error': 'Plan not found'}), 404
+    rows = database.get_subject_performance(db, plan_id, batch_id)
+    return jsonify({'plan_id': plan_id, 'batch_id': batch_id, 'subjects': [performance_json(row) for row in rows]})
+
+@app.route('/plan/<int:plan_id>/schedule')
+def plan_schedule(plan_id):
+    """JSON schedule blocks of a plan, optionally limited to ?from=&to= dates and a ?subject=.
+
+    Reads only the matching rows of schedule_blocks, never the whole schedule document.
+    """
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+    subject = request.args.get('subject')
+    for value in (date_from, date_to):
+        if value:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                return jsonify({'error': f"Invalid date '{value}', expected YYYY-MM-DD"}), 400
+
+    db = get_db()
+    if not database.plan_exists(db, plan_id):
+        return jsonify({'error': 'Plan not found'}), 404
+
+    schedule = {}
+    for row in database.get_schedule_blocks(db, plan_id, date_from, date_to, subject):
+        schedule.setdefault(row['date'], []).append({
+            'start_time': row['start_time'],
+            'end_time': row['end_time'],
+            'subject': row['subject'],
+            'task': row['task']
+        })
+    return jsonify({'plan_id': plan_id, 'from': date_from, 'to': date_to, 'subject': subject, 'schedule': schedule})
+
+def stream_events(db, plan_id, after, plan_url):
+    """The SSE events for a pending plan's days newer than stream row `after`, and a "done" event once it
+    is no longer pending. Returns (text, last_row_id, done); shared with the asyncio stream in asgi.py.
+    """
+    events = []
+    for row in database.get_stream_days_after(db, plan_id, after):
+        after = row['id']
+        events.append(f'id: {after}\nevent: day\ndata: {{"date": {json.dumps(row["day"])}, "blocks": {row["blocks"]}}}\n\n')
+    status = database.get_plan_status(db, plan_id)
+    if status != 'pending':
+        events.append(f'event: done\ndata: {json.dumps({"status": status or "missing", "url": plan_url})}\n\n')
+    return ''.join(events), after, status != 'pending'
+
+@app.route('/plan/<int:plan_id>/stream')
+def stream_plan(plan_id):
+    """Server-Sent Events: push each schedule day of a pending plan as soon as the AI produces it.
+
+    Streams end after SSE_MAX_SECONDS so they never pin a server worker; the
+    browser reconnects with Last-Event-ID and the stream resumes from there.
+    """
+    last_id = request.headers.get('Last-Event-ID', type=int) or request.args.get('after', 0, type=int)
+    plan_url = url_for('view_plan', plan_id=plan_id)
+
+    def events():
+        db = get_db()
+        after = last_id
+        deadline = time.monotonic() + app.config['SSE_MAX_SECONDS']
+        yield 'retry: 1000\n\n'
+        while True:
+            text, after, done = stream_events(db, plan_id, after, plan_url)
+            if text:
+                yield text
+            if done or time.monotonic() >= deadline:
+                return
+            time.sleep(app.config['SSE_POLL_INTERVAL'])
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/fix-schedule/<int:plan_id>', methods=['POST'])
 def fix_schedule(plan_id):
     """Attempt to fix invalid JSON in schedule data"""
     try:
         db = get_db()
-        plan = db.execute('SELECT generated_schedule FROM plans WHERE id = ?', (plan_id,)).fetchone()
-        
-        if not plan:
+        if not database.plan_exists(db, plan_id):
             flash("Plan not found", "danger")
             return redirect(url_for('list_plans'))
             
-        raw_schedule = plan['generated_schedule']
+        raw_schedule = database.get_plan_schedule_json(db, plan_id) or ''
         
         # Try to identify and fix common JSON issues using our improved function
         try:
             extracted_json = extract_json_from_text(raw_schedule)
             
             if "schedule" in extracted_json:
-                # We found a full JSON object with schedule
-                fixed_json = extracted_json["schedule"]
-                db.execute(
-                    'UPDATE plans SET generated_schedule = ? WHERE id = ?',
-                    (json.dumps(fixed_json), plan_id)
-                )
-                db.commit()
+                # We found a full JSON object with schedule, possibly in the compact format
+                fixed_json, _ = schedule_format.expand(extracted_json["schedule"], extracted_json.get("subjects"))
+                with database.transaction(db):
+                    database.update_plan_schedule(db, plan_id, fixed_json)
                 flash("Successfully extracted and fixed JSON schedule data!", "success")
             elif not "extraction_error" in extracted_json:
                 # We found some valid JSON but not with the expected structure
-                db.execute(
-                    'UPDATE plans SET generated_schedule = ? WHERE id = ?',
-                    (json.dumps(extracted_json), plan_id)
-                )
-                db.commit()
+                with database.transaction(db):
+                    database.update_plan_schedule(db, plan_id, extracted_json)
                 flash("JSON structure was fixed, but might not have the expected schedule format.", "warning")
             else:
                 # Generate a fallback schedule based on plan data
-                plan_data = db.execute('SELECT * FROM plans WHERE id = ?', (plan_id,)).fetchone()
+                plan_data = database.get_plan(db, plan_id)
                 
-                # Create a dict to mimic the form data structure
-                form_data = {
-                    'start_date': plan_data['start_date'],
-                    'end_date': plan_data['end_date'],
-                    'subjects': plan_data['subjects'],
-                    'hours_per_day': plan_data['hours_per_day'],
-                    'off_days': plan_data['off_days'].split(',') if plan_data['off_days'] else []
-                }
-                
-                fallback_schedule = generate_fallback_schedule(form_data)
-                db.execute(
-                    'UPDATE plans SET generated_schedule = ? WHERE id = ?',
-                    (json.dumps(fallback_schedule), plan_id)
-                )
-                db.commit()
+                fallback_schedule = generate_fallback_schedule(plan_form_from_row(plan_data),
+                                                               database.get_subject_marks(db, plan_id))
+                with database.transaction(db):
+                    database.update_plan_schedule(db, plan_id, fallback_schedule, mark_ready=True)
                 flash("Generated a new schedule based on your plan details.", "success")
                 
         except Exception as e:
             flash(f"Could not fix JSON: {e}", "danger")
+        plan_changed(plan_id)
             
     except sqlite3.Error as e:
         flash(f"Database error: {e}", "danger")
         
     return redirect(url_for('view_plan', plan_id=plan_id))
 
+def replan_response(plan_id, message, status, category='danger', **extra):
+    """JSON for API clients; a flash message and the plan page for the plan page's form."""
+    if request.is_json:
+        return jsonify(dict(extra, message=message) if status < 400 else {'error': message}), status
+    flash(message, category)
+    return redirect(url_for('view_plan', plan_id=plan_id))
+
+@app.route('/plan/<int:plan_id>/replan', methods=['POST'])
+def replan_plan(plan_id):
+    """Update a plan's dates, off days, hours, fixed schedule, subjects or marks, regenerating only what changed.
+
+    Takes JSON or the plan page's form; fields left out keep their values and
+    `effective_from` (YYYY-MM-DD) protects earlier days. Dropped, cleared and
+    draft days are written at once; the model then regenerates just the
+    affected days in a 'replan' job, recorded as a revision.
+    """
+    values = request.get_json(silent=True) if request.is_json else request.form
+    if not isinstance(values, dict):
+        return replan_response(plan_id, 'Expected a JSON object', 400)
+    db = get_db()
+    plan = database.get_plan(db, plan_id)
+    if plan is None:
+        return replan_response(plan_id, 'Plan not found', 404)
+    if plan['status'] == 'pending':
+        return replan_response(plan_id, 'The plan is still being generated; update it once it is ready.', 409)
+    try:
+        schedule = json.loads(plan['generated_schedule'] or '')
+    except ValueError:
+        schedule = None
+    if not isinstance(schedule, dict):
+        return replan_response(plan_id, "The schedule could not be read; use 'Attempt to Fix JSON' first.", 409)
+
+    old_form = plan_form_from_row(plan)
+    old_marks = [dict(mark) for mark in database.get_subject_marks(db, plan_id)]
+    updates = {}
+    for field in replan.FIELDS:
+        value = values.get(field)
+        if isinstance(value, list):
+            value = ','.join(map(str, value))
+        if value is not None:
+            updates[field] = str(value)
+    if hasattr(values, 'getlist'):
+        # The plan page's form posts every field, so no ticked boxes means no days off
+        updates['off_days'] = ','.join(values.getlist('off_days'))
+    try:
+        new_form = plan_form_data(dict(old_form, **updates))
+        marks_text = str(values.get('subject_marks') or '')
+        new_marks = parse_subject_marks(marks_text) if marks_text.strip() else old_marks
+        effective_from = str(values.get('effective_from') or '') or \
+            replan.default_effective_date(new_form['start_date'], new_form['end_date'])
+        datetime.strptime(effective_from, '%Y-%m-%d')
+    except (KeyError, ValueError, IndexError) as e:
+        return replan_response(plan_id, f'Invalid update: {e}', 400)
+
+    changes = replan.diff_inputs(old_form, old_marks, new_form, new_marks)
+    if not changes:
+        return replan_response(plan_id, 'Nothing changed.', 200, 'info', revision=None)
+    regenerate, clear, drop = replan.affected_days(old_form, new_form, changes, schedule, effective_from)
+
+    # Local draft blocks hold the regenerated days until the model's arrive
+    draft = generate_fallback_schedule(new_form, new_marks) if regenerate else {}
+    days = {day: draft.get(day, []) for day in regenerate}
+    days.update({day: [] for day in clear})
+    with database.transaction(db):
+        database.update_plan_inputs(db, plan_id, new_form)
+        if 'marks' in changes:
+            database.replace_subject_marks(db, plan_id, new_marks)
+        previous_days = database.replace_schedule_days(db, plan_id, days, drop)
+        revision_id = database.insert_plan_revision(db, plan_id, changes, regenerate, clear, drop, previous_days)
+        if regenerate:
+            jobs.enqueue(db, plan_id, 'replan', {'revision_id': revision_id, 'dates': regenerate,
+                                                 'form': new_form, 'marks': new_marks})
+        else:
+            database.finish_plan_revision(db, revision_id, 'done')
+    plan_changed(plan_id)
+    jobs.notify()
+    message = (f"Plan updated: {len(regenerate)} day(s) being regenerated, {len(clear)} cleared, "
+               f"{len(drop)} removed; the rest of the schedule is unchanged.")
+    return replan_response(plan_id, message, 202 if regenerate else 200, 'success',
+                           revision=revision_json(database.get_plan_revision(db, revision_id)))
+
+def revision_json(revision):
+    return dict(revision, changes=json.loads(revision['changes']))
+
+@app.route('/plan/<int:plan_id>/revisions')
+def plan_revisions(plan_id):
+    """JSON list of a plan's most recent revisions, newest first."""
+    db = get_db()
+    if not database.plan_exists(db, plan_id):
+        return jsonify({'error': 'Plan not found'}), 404
+    return jsonify({'plan_id': plan_id,
+                    'revisions': [revision_json(revision) for revision in database.get_plan_revisions(db, plan_id)]})
+
 # Error handlers
 @app.errorhandler(404)
 def not_found_error(error):
@@ -550,6 +1913,25 @@ def internal_error(error):
     db.rollback()
     return render_template('500.html'), 500
 
+def create_app():
+    """Return the app ready to serve; gunicorn's entry point (see gunicorn_config.py).
+
+    Sets up the log file and compiles every template up front. With preload_app this runs once in the
+    gunicorn master, before it forks, so workers share the compiled templates
+    instead of each compiling them on its first requests. Nothing here may
+    open connections or start threads, which must not cross a fork.
+    """
+    global _app_ready
+    if not _app_ready:
+        configure_logging()
+        for name in app.jinja_env.list_templates():
+            app.jinja_env.get_template(name)
+        _app_ready = True
+    return app
+
+_app_ready = False
+app.config['STARTUP_IMPORT_SECONDS'] = time.perf_counter() - IMPORT_STARTED
+
 if __name__ == '__main__':
     # Ensure the database directory exists before running
     db_dir = os.path.dirname(app.config['DATABASE'])
@@ -561,4 +1943,4 @@ if __name__ == '__main__':
     if not os.path.exists(app.config['DATABASE']):
         print("Database file not found. Run 'flask init-db' to initialize.")
 
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
\ No newline at end of file
@@ -0,0 +1,132 @@
+"""ASGI entry point: serve the app on an asyncio event loop.
+
+    pip install -r requirements-asgi.txt
+    gunicorn -c gunicorn_asgi_config.py      # or: uvicorn asgi:application
+
+The Flask routes run unchanged on a pool of ``ASGI_WSGI_THREADS`` threads
+(through a2wsgi). Everything that waits moves onto the event loop, where
+waiting does not hold a thread:
+
+- Background jobs run as tasks of ``jobs.work_async`` rather than on job
+  worker threads, with awaited Gemini calls, so one process can have up to
+  ``ASYNC_JOB_CONCURRENCY`` plans (default 200) waiting on the model at once.
+- ``/plan/<id>/stream`` (Server-Sent Events) is served here, polling the
+  database through ``database.run_async``, so open streams hold no thread.
+
+The WSGI entry point (``app:create_app()``, gunicorn_config.py) is unchanged.
+"""
+import asyncio
+import os
+import re
+import time
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+
+import jobs
+import metrics
+from app import create_app, stream_events
+from database import database
+
+# Flask requests are short once nothing in them waits on Gemini
+WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 16))
+# Seconds running jobs get to finish on shutdown; unfinished ones are requeued once stale
+SHUTDOWN_GRACE = float(os.getenv('ASGI_SHUTDOWN_GRACE', 10))
+
+STREAM_PATH = re.compile(r'/plan/(\d+)/stream')
+STREAM_HEADERS = [
+    (b'content-type', b'text/event-stream; charset=utf-8'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+    (b'x-content-type-options', b'nosniff'),
+    (b'x-frame-options', b'SAMEORIGIN'),
+]
+
+flask_app = create_app()
+# Jobs run on the event loop (see lifespan) instead of on each process's job threads
+flask_app.config['JOB_WORKERS'] = 0
+wsgi = WSGIMiddleware(flask_app, workers=WSGI_THREADS)
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+async def stream_plan(scope, receive, send, plan_id):
+    """app.stream_plan for the event loop: same events, same resumption with Last-Event-ID or ?after=."""
+    started = time.perf_counter()
+    headers = dict(scope['headers'])
+    after = (_int(headers.get(b'last-event-id', b'').decode('latin-1'))
+             or _int(parse_qs(scope['query_string'].decode('latin-1')).get('after', [None])[0]) or 0)
+    plan_url = (flask_app.url_map.bind('localhost', script_name=scope.get('root_path') or None)
+                .build('view_plan', {'plan_id': plan_id}))
+    path = flask_app.config['DATABASE']
+
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    await send({'type': 'http.response.start', 'status': 200, 'headers': STREAM_HEADERS})
+    await send({'type': 'http.response.body', 'body': b'retry: 1000\n\n', 'more_body': True})
+    deadline = time.monotonic() + flask_app.config['SSE_MAX_SECONDS']
+    try:
+        while not disconnected.is_set():
+            text, after, done = await database.run_async(path, stream_events, plan_id, after, plan_url)
+            if text:
+                await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
+            if done or time.monotonic() >= deadline:
+                break
+            try:
+                await asyncio.wait_for(disconnected.wait(), flask_app.config['SSE_POLL_INTERVAL'])
+            except asyncio.TimeoutError:
+                pass
+        if not disconnected.is_set():
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        watcher.cancel()
+        metrics.inc('http_requests_total', endpoint='stream_plan', method='GET', status=200)
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - started, endpoint='stream_plan')
+
+
+async def lifespan(receive, send):
+    """Start the asyncio job runner with the server process, and let it finish its jobs on shutdown."""
+    stop = asyncio.Event()
+    runner = None
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            metrics.start_server()  # uvicorn has no master to clear the directory, as gunicorn_config.py does
+            metrics.enable()
+            concurrency = flask_app.config['ASYNC_JOB_CONCURRENCY']
+            if concurrency > 0:  # 0 leaves the jobs to a separate `flask run-jobs` process
+                runner = asyncio.ensure_future(jobs.work_async(flask_app, concurrency, stop))
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            stop.set()
+            if runner is not None:
+                try:
+                    await asyncio.wait_for(runner, SHUTDOWN_GRACE)
+                except asyncio.TimeoutError:
+                    flask_app.logger.warning('Shut down with jobs still running; they will be requeued.')
+            metrics.flush()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] == 'http' and scope['method'] == 'GET':
+        match = STREAM_PATH.fullmatch(scope['path'])
+        if match:
+            await stream_plan(scope, receive, send, int(match.group(1)))
+            return
+    await wsgi(scope, receive, send)
@@ -0,0 +1,100 @@
+"""Compare the old regex-based JSON extraction with json_repair.extract_json.
+
+Runs both over the broken model outputs in bench/json_corpus/ and over large
+generated plans (clean, fenced and truncated), reporting the time per call
+and how many schedule days each recovered.
+
+    python bench/json_repair_bench.py [--repeat N]
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gemini_stub  # noqa: E402
+import json_repair  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'json_corpus')
+
+
+def legacy_extract(text):
+    """The extraction app.py used before json_repair: whole text, then regex matches longest first."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        matches = re.findall(r'(\{[\s\S]*\})', text)
+        matches.sort(key=len, reverse=True)
+        for match in matches:
+            try:
+                return json.loads(match)
+            except json.JSONDecodeError:
+                continue
+        return {'extraction_error': 'Could not extract valid JSON', 'raw_text': text}
+
+
+def repair_extract(text):
+    try:
+        return json_repair.extract_json(text).value
+    except json_repair.JSONExtractionError:
+        return {'extraction_error': 'Could not extract valid JSON', 'raw_text': text}
+
+
+def schedule_days(output):
+    schedule = output.get('schedule') if isinstance(output, dict) else None
+    return len(schedule) if isinstance(schedule, dict) else 0
+
+
+def generated_cases():
+    """Large plans from the stub model: a year of days, several blocks each."""
+    prompt = ('- Duration: 2025-01-01 to 2025-12-31\n- Subjects: Math, Physics, Chemistry, Biology\n'
+              '- Days Off (No Studying): Sunday\n- Target Study Hours Per Day: 6\n')
+    clean = gemini_stub.build_plan_output(prompt)
+    return {
+        'generated_year_clean': clean,
+        'generated_year_fenced': f'Here is your plan:\n```json\n{clean}\n```\nGood luck!',
+        'generated_year_truncated': clean[:int(len(clean) * 0.8)],
+        'generated_year_trailing_commas': re.sub(r'\}\n(\s*)\]', '},\n\\1]', clean),
+    }
+
+
+def time_call(func, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        output = func(text)
+    return (time.perf_counter() - start) / repeat, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20, help='calls per case (default 20)')
+    args = parser.parse_args()
+
+    cases = {}
+    for path in sorted(glob.glob(os.path.join(CORPUS_DIR, '*.txt'))):
+        with open(path, 'r') as f:
+            cases[os.path.basename(path)[:-4]] = f.read()
+    cases.update(generated_cases())
+
+    print(f"{'case':34} {'bytes':>8} {'legacy ms':>10} {'days':>5} {'repair ms':>10} {'days':>5}  repairs")
+    totals = [0.0, 0, 0.0, 0]
+    for name, text in cases.items():
+        legacy_time, legacy_output = time_call(legacy_extract, text, args.repeat)
+        repair_time, repair_output = time_call(repair_extract, text, args.repeat)
+        try:
+            repairs = ','.join(json_repair.extract_json(text).repairs) or '-'
+        except json_repair.JSONExtractionError:
+            repairs = 'FAILED'
+        legacy_days, repair_days = schedule_days(legacy_output), schedule_days(repair_output)
+        totals = [totals[0] + legacy_time, totals[1] + legacy_days, totals[2] + repair_time, totals[3] + repair_days]
+        print(f'{name:34} {len(text):8d} {legacy_time * 1000:10.3f} {legacy_days:5d} '
+              f'{repair_time * 1000:10.3f} {repair_days:5d}  {repairs}')
+    print(f"{'total':34} {'':8} {totals[0] * 1000:10.3f} {totals[1]:5d} {totals[2] * 1000:10.3f} {totals[3]:5d}")
+
+
+if __name__ == '__main__':
+    main()
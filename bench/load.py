@@ -0,0 +1,165 @@
+"""Concurrent HTTP load driver for a running planner server.
+
+Sends a weighted mix of requests to /, /plans, /plan/<id>, /generate and
+/fix-schedule/<id> from many threads with keep-alive connections, then prints
+p50/p95/p99 latency and requests per second for each endpoint. Run the server
+with the stand-in model so no Gemini quota is used, e.g.:
+
+    python bench/seed.py --database /tmp/planner-bench.db --plans 5000
+    DATABASE_PATH=/tmp/planner-bench.db GEMINI_STUB=1 GEMINI_STUB_LATENCY=2 \\
+        gunicorn -c gunicorn_config.py app:app
+    python bench/load.py --url http://127.0.0.1:10000 --concurrency 32 --duration 30 --plans 5000
+"""
+import argparse
+import http.client
+import random
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+DEFAULT_MIX = 'index=1,plans=2,view=6,generate=1,fix=0.5'
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def generate_form(rng):
+    subjects = rng.sample(['Math', 'Physics', 'Chemistry', 'Biology', 'History', 'English'], 3)
+    start = f'2025-{rng.randint(1, 12):02d}-01'
+    return urlencode({
+        'title': 'Load test plan', 'description': 'bench/load.py', 'start_date': start,
+        'end_date': start[:8] + '28', 'subjects': ', '.join(subjects), 'learning_goal': 'Pass exams',
+        'difficulty_feedback': f'{subjects[0]} is hard', 'hours_per_day': rng.choice(['2', '3.5']),
+        'off_days': 'Sunday', 'class_schedule': 'Classes MWF 9am-11am',
+        'subject_marks': f'{subjects[0]}\nQuiz\nQuiz 1/20\n{rng.randint(5, 19)}',
+    })
+
+
+class Worker(threading.Thread):
+    def __init__(self, url, mix, plans, deadline, requests_left, results, lock, seed):
+        super().__init__(daemon=True)
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80)
+        self.https = parts.scheme == 'https'
+        self.mix = mix
+        self.plans = plans
+        self.deadline = deadline
+        self.requests_left = requests_left
+        self.results = results
+        self.lock = lock
+        self.rng = random.Random(seed)
+        self.connection = None
+
+    def connect(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        self.connection = cls(self.host, self.port, timeout=120)
+
+    def request(self, name):
+        headers = {}
+        body = None
+        method = 'GET'
+        if name == 'index':
+            path = '/'
+        elif name == 'plans':
+            path = '/plans'
+        elif name == 'view':
+            path = f'/plan/{self.rng.randint(1, self.plans)}'
+        elif name == 'generate':
+            method, path, body = 'POST', '/generate', generate_form(self.rng)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        else:
+            method, path = 'POST', f'/fix-schedule/{self.rng.randint(1, self.plans)}'
+        if self.connection is None:
+            self.connect()
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            return 'error'
+
+    def run(self):
+        names, weights = zip(*self.mix)
+        while time.monotonic() < self.deadline:
+            with self.lock:
+                if self.requests_left[0] is not None:
+                    if self.requests_left[0] <= 0:
+                        break
+                    self.requests_left[0] -= 1
+            name = self.rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            status = self.request(name)
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.results.setdefault(name, []).append((elapsed, status))
+
+
+def parse_mix(text):
+    mix = []
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in ('index', 'plans', 'view', 'generate', 'fix'):
+            raise SystemExit(f'Unknown endpoint {name!r} in --mix')
+        if float(weight or 1) > 0:
+            mix.append((name.strip(), float(weight or 1)))
+    return mix
+
+
+def report(results, wall_time):
+    print(f"{'endpoint':10} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses")
+    everything = []
+    for name in sorted(results):
+        samples = results[name]
+        latencies = sorted(elapsed for elapsed, _ in samples)
+        everything += latencies
+        errors = sum(1 for _, status in samples if status == 'error' or status >= 500)
+        statuses = {}
+        for _, status in samples:
+            statuses[status] = statuses.get(status, 0) + 1
+        print(f'{name:10} {len(samples):9d} {errors:7d} {len(samples) / wall_time:8.1f} '
+              f'{percentile(latencies, 0.50) * 1000:8.1f} {percentile(latencies, 0.95) * 1000:8.1f} '
+              f'{percentile(latencies, 0.99) * 1000:8.1f}  {statuses}')
+    everything.sort()
+    print(f"{'total':10} {len(everything):9d} {'':7} {len(everything) / wall_time:8.1f} "
+          f'{percentile(everything, 0.50) * 1000:8.1f} {percentile(everything, 0.95) * 1000:8.1f} '
+          f'{percentile(everything, 0.99) * 1000:8.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:10000')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run')
+    parser.add_argument('--requests', type=int, help='stop after this many requests instead')
+    parser.add_argument('--plans', type=int, default=1000, help='plan ids 1..N exist (see bench/seed.py)')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'endpoint weights (default {DEFAULT_MIX})')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    results = {}
+    lock = threading.Lock()
+    requests_left = [args.requests]
+    started = time.monotonic()
+    deadline = started + (args.duration if args.requests is None else 24 * 3600)
+    workers = [Worker(args.url, mix, args.plans, deadline, requests_left, results, lock, args.seed + i)
+               for i in range(args.concurrency)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        print('Interrupted; reporting what was collected.')
+    report(results, time.monotonic() - started)
+
+
+if __name__ == '__main__':
+    main()
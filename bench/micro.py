@@ -0,0 +1,115 @@
+"""Micro-benchmarks for the CPU-bound helpers in app.py.
+
+Times extract_json_from_text, parse_subject_marks and generate_fallback_schedule
+on representative inputs. Save a baseline and compare later runs against it
+to catch regressions:
+
+    python bench/micro.py --save bench/baseline.json
+    python bench/micro.py --compare bench/baseline.json   # exits 1 if anything got slower
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('GEMINI_STUB', '1')
+os.environ.setdefault('JOB_WORKERS', '0')
+
+import app  # noqa: E402
+import gemini_stub  # noqa: E402
+
+
+def plan_form(start_date, end_date):
+    return {
+        'title': 'Benchmark', 'description': '', 'start_date': start_date, 'end_date': end_date,
+        'subjects': 'Math, Physics, Chemistry, Biology', 'learning_goal': '', 'difficulty_feedback': '',
+        'hours_per_day': '4.5', 'off_days': 'Sunday', 'class_schedule': 'Classes MWF 9am-11am\nWork Tue 1pm-5pm',
+    }
+
+
+def marks_text(subjects, assessments):
+    sections = []
+    for s in range(subjects):
+        lines = [f'Subject {s}', 'Quiz']
+        for a in range(assessments):
+            lines += [f'Quiz {a}/20', str(10 + (s + a) % 10)]
+        sections.append('\n'.join(lines))
+    return '\n\n'.join(sections)
+
+
+def model_output(start_date, end_date, mode='valid'):
+    prompt = (f'- Duration: {start_date} to {end_date}\n- Subjects: Math, Physics, Chemistry\n'
+              '- Days Off (No Studying): Sunday\n- Target Study Hours Per Day: 4\n')
+    return gemini_stub.shape_output(gemini_stub.build_plan_output(prompt), mode)
+
+
+def cases():
+    month, year, five_years = ('2025-01-01', '2025-01-31'), ('2025-01-01', '2025-12-31'), ('2025-01-01', '2029-12-31')
+    marks_data = app.parse_subject_marks(marks_text(6, 4))
+    outputs = {mode: model_output(*year, mode) for mode in gemini_stub.OUTPUT_MODES}
+    small = model_output(*month)
+    return {
+        'extract_json/month_valid': lambda: app.extract_json_from_text(small),
+        'extract_json/year_valid': lambda: app.extract_json_from_text(outputs['valid']),
+        'extract_json/year_fenced': lambda: app.extract_json_from_text(outputs['fenced']),
+        'extract_json/year_trailing_commas': lambda: app.extract_json_from_text(outputs['trailing_commas']),
+        'extract_json/year_truncated': lambda: app.extract_json_from_text(outputs['truncated']),
+        'extract_json/invalid': lambda: app.extract_json_from_text(outputs['invalid']),
+        'parse_subject_marks/6x4': lambda: app.parse_subject_marks(marks_text(6, 4)),
+        'parse_subject_marks/40x20': lambda: app.parse_subject_marks(marks_text(40, 20)),
+        'fallback_schedule/month': lambda: app.generate_fallback_schedule(plan_form(*month), marks_data),
+        'fallback_schedule/year': lambda: app.generate_fallback_schedule(plan_form(*year), marks_data),
+        'fallback_schedule/five_years': lambda: app.generate_fallback_schedule(plan_form(*five_years), marks_data),
+    }
+
+
+def measure(func, repeat):
+    """Best time per call in seconds, over `repeat` rounds of an auto-ranged loop."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare against results saved with --save')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown ratio reported as a regression (default 1.25)')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    for name, func in cases().items():
+        if args.filter not in name:
+            continue
+        seconds = results[name] = measure(func, args.repeat)
+        line = f'{name:40} {seconds * 1e6:12.1f} us'
+        if name in baseline:
+            ratio = seconds / baseline[name]
+            line += f'   {ratio:5.2f}x baseline'
+            if ratio > args.threshold:
+                line += '  REGRESSION'
+                regressions.append(name)
+        print(line)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f'Saved results to {args.save}')
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
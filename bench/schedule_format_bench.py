@@ -0,0 +1,127 @@
+"""Compare the verbose and compact schedule formats the model can be asked for.
+
+For generated plans of increasing length it reports the size of each format,
+a rough output-token count and the time to extract (and, for the compact
+format, expand) the schedule. It also checks the round trip: the compact form
+of every plan validates and expands back to the same schedule, and malformed
+compact output is reported by the validator and left out by ``expand``.
+Exits non-zero if any check fails.
+
+    python bench/schedule_format_bench.py [--repeat N]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json_repair  # noqa: E402
+import schedule_format  # noqa: E402
+import scheduler  # noqa: E402
+
+SUBJECTS = 'Calculus, Organic Chemistry, Physics, Biology, World History'
+MARKS = [
+    {'subject_name': 'Calculus', 'max_marks': 100, 'obtained_marks': 48},
+    {'subject_name': 'Organic Chemistry', 'max_marks': 100, 'obtained_marks': 61},
+    {'subject_name': 'Physics', 'max_marks': 100, 'obtained_marks': 74},
+]
+
+# Words, numbers and punctuation runs; close enough to a tokenizer to compare formats
+_TOKEN = re.compile(r'\w+|[^\w\s]+')
+
+# Malformed compact responses and the validator message each must produce
+INVALID_CASES = [
+    ({'subjects': ['Math'], 'schedule': {'2025-01-01': [['09:00', '10:00', 3, 'Read']]}}, 'subject index 3'),
+    ({'subjects': ['Math'], 'schedule': {'2025-01-01': [['09:00', '10:00', 0]]}}, 'row'),
+    ({'subjects': ['Math'], 'schedule': {'2025-01-01': [['9am', '10:00', 0, 'Read']]}}, 'HH:MM'),
+    ({'subjects': ['Math'], 'schedule': {'2025-01-01': {'start_time': '09:00'}}}, 'not a list'),
+    ({'subjects': ['Math'], 'schedule': {'Monday': []}}, 'YYYY-MM-DD'),
+    ({'subjects': 'Math', 'schedule': {}}, 'list of strings'),
+    ({'subjects': ['Math', 'Math'], 'schedule': {}}, 'twice'),
+    ({'subjects': ['Math'], 'schedule': []}, 'not an object'),
+]
+
+
+def plan_schedule(days):
+    """A local schedule of ``days`` days: several blocks a day with varied tasks, like a model's."""
+    end_date = (date(2025, 1, 1) + timedelta(days=days - 1)).isoformat()
+    return scheduler.build_schedule('2025-01-01', end_date, SUBJECTS.split(','), 6, 'Sunday',
+                                    'Classes MWF 9am-11am', MARKS)
+
+
+def tokens(text):
+    return len(_TOKEN.findall(text))
+
+
+def time_call(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def check_round_trip(schedule):
+    wire = schedule_format.compact(schedule)
+    problems = schedule_format.validate(wire)
+    decoded = json.loads(json.dumps(wire))
+    expanded, invalid = schedule_format.expand(decoded['schedule'], decoded['subjects'])
+    if problems or invalid or expanded != schedule:
+        return f'round trip failed: {problems[:3]} {invalid[:3]}'
+    verbose, invalid = schedule_format.expand(schedule)
+    if invalid or verbose != schedule:
+        return 'verbose schedule not passed through unchanged'
+    return None
+
+
+def check_invalid_cases():
+    failures = []
+    for output, expected in INVALID_CASES:
+        problems = schedule_format.validate(output)
+        if not any(expected in problem for problem in problems):
+            failures.append(f'{output!r}: expected "{expected}", got {problems}')
+    # A day whose rows cannot be expanded is left out, the others are kept
+    expanded, invalid = schedule_format.expand({'2025-01-01': [['09:00', '10:00', 0, 'Read']],
+                                                '2025-01-02': [['09:00', '10:00', 5, 'Read']]}, ['Math'])
+    if list(expanded) != ['2025-01-01'] or invalid != ['2025-01-02']:
+        failures.append(f'expand kept {list(expanded)}, reported {invalid} as invalid')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20, help='calls per case (default 20)')
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'days':>5} {'verbose B':>10} {'compact B':>10} {'verbose tok':>12} {'compact tok':>12} "
+          f"{'saved':>6} {'verbose ms':>11} {'compact ms':>11}")
+    for days in (7, 14, 30, 90, 365):
+        schedule = plan_schedule(days)
+        error = check_round_trip(schedule)
+        if error:
+            failures.append(f'{days} days: {error}')
+        verbose = json.dumps({'schedule': schedule}, indent=2)
+        compact = json.dumps(schedule_format.compact(schedule), indent=2)
+        verbose_time, _ = time_call(lambda: json_repair.extract_json(verbose).value['schedule'], args.repeat)
+
+        def parse_compact():
+            output = json_repair.extract_json(compact).value
+            return schedule_format.expand(output['schedule'], output['subjects'])
+        compact_time, _ = time_call(parse_compact, args.repeat)
+        verbose_tokens, compact_tokens = tokens(verbose), tokens(compact)
+        print(f'{days:5d} {len(verbose):10d} {len(compact):10d} {verbose_tokens:12d} {compact_tokens:12d} '
+              f'{1 - compact_tokens / verbose_tokens:6.0%} {verbose_time * 1000:11.3f} {compact_time * 1000:11.3f}')
+
+    failures += check_invalid_cases()
+    print(f'\nRound trip and validator checks: {len(failures)} failed')
+    for failure in failures:
+        print(f'  {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Seed a database with generated plans, subject marks and schedules for benchmarking.
+
+Plans get local schedules from scheduler.py. A share of them are left with
+broken AI output and no schedule blocks, so /fix-schedule/<id> has work to do.
+
+    python bench/seed.py --database /tmp/bench.db --plans 5000
+    DATABASE_PATH=/tmp/bench.db GEMINI_STUB=1 gunicorn -c gunicorn_config.py app:app
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gemini_stub  # noqa: E402
+import scheduler  # noqa: E402
+from database import database  # noqa: E402
+
+SUBJECTS = ['Math', 'Physics', 'Chemistry', 'Biology', 'History', 'English', 'Economics',
+            'Computer Science', 'Geography', 'Spanish', 'Statistics', 'Philosophy']
+COMPONENTS = ['Quiz', 'Midterm', 'Assignment', 'Lab']
+CLASS_SCHEDULES = ['', '', 'Classes MWF 9am-11am', 'Work Tue/Thu 1pm-5pm', 'Mon-Fri 8:30-15:00',
+                   'Unavailable Saturday mornings']
+OFF_DAYS = ['', 'Sunday', 'Saturday,Sunday', 'Friday']
+
+
+def make_plan(rng, index, min_days, max_days):
+    subjects = rng.sample(SUBJECTS, rng.randint(2, 5))
+    start = date(2025, 1, 1) + timedelta(days=rng.randint(0, 365))
+    end = start + timedelta(days=rng.randint(min_days, max_days) - 1)
+    form_data = {
+        'title': f'Benchmark plan {index}',
+        'description': 'Generated by bench/seed.py',
+        'start_date': start.isoformat(),
+        'end_date': end.isoformat(),
+        'subjects': ', '.join(subjects),
+        'learning_goal': 'Improve exam results',
+        'difficulty_feedback': f'{subjects[0]} is hard',
+        'hours_per_day': rng.choice(['1.5', '2', '3', '4.5']),
+        'off_days': rng.choice(OFF_DAYS),
+        'class_schedule': rng.choice(CLASS_SCHEDULES),
+    }
+    marks_data = []
+    for subject in subjects:
+        for component in rng.sample(COMPONENTS, 2):
+            max_marks = rng.choice([20.0, 50.0, 100.0])
+            marks_data.append({
+                'subject_name': subject,
+                'component_type': component,
+                'assessment_name': f'{component} 1',
+                'max_marks': max_marks,
+                'obtained_marks': round(max_marks * rng.uniform(0.3, 0.98), 1),
+            })
+    return form_data, marks_data
+
+
+def seed(path, plans, broken_share, min_days, max_days, seed_value):
+    rng = random.Random(seed_value)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    db = database.connect(path)
+    if not db.execute("SELECT name FROM sqlite_master WHERE name = 'plans'").fetchone():
+        database.init_schema(db)
+    with database.transaction(db):
+        for index in range(plans):
+            form_data, marks_data = make_plan(rng, index + 1, min_days, max_days)
+            plan_id = database.insert_pending_plan(db, form_data)
+            database.insert_subject_marks(db, plan_id, marks_data)
+            schedule = scheduler.build_schedule(
+                form_data['start_date'], form_data['end_date'], form_data['subjects'].split(','),
+                form_data['hours_per_day'], form_data['off_days'], form_data['class_schedule'], marks_data
+            )
+            if rng.random() < broken_share:
+                # What a misbehaving model leaves behind: not JSON, so the plan page offers the fix
+                output = gemini_stub.shape_output(json.dumps({'schedule': schedule}), rng.choice(['truncated', 'invalid']))
+                db.execute("UPDATE plans SET generated_guide = ?, generated_schedule = ?, resources = ?, status = 'ready' WHERE id = ?",
+                           ('Seeded guide', output, '- Seeded resources', plan_id))
+            else:
+                database.update_plan_content(db, plan_id, 'Seeded guide', schedule, '- Seeded resources')
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default='/tmp/planner-bench.db', help='SQLite file to create or extend')
+    parser.add_argument('--plans', type=int, default=2000)
+    parser.add_argument('--broken-share', type=float, default=0.1, help='share of plans with unparseable schedules')
+    parser.add_argument('--min-days', type=int, default=14)
+    parser.add_argument('--max-days', type=int, default=180)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    seed(args.database, args.plans, args.broken_share, args.min_days, args.max_days, args.seed)
+    print(f'Seeded {args.plans} plans into {args.database} in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
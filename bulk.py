@@ -0,0 +1,112 @@
+"""Bulk plan creation for whole classes, from a CSV file or a JSON batch.
+
+Items are written in chunks: each chunk's plans, subject marks, draft
+schedules and generation jobs go into the database in one transaction,
+mostly with executemany. Every processed item is recorded in
+``plan_batch_items`` in the same transaction, and a batch is identified by a
+hash of its input, so submitting the same input again (e.g. after a crash)
+continues where it stopped instead of creating duplicate plans. The AI work
+itself runs as ordinary ``generate_plan`` jobs (see jobs.py).
+"""
+import csv
+import hashlib
+import io
+import json
+import time
+
+import jobs
+from database import database
+
+CSV_COLUMNS = ['title', 'description', 'start_date', 'end_date', 'subjects', 'learning_goal',
+               'difficulty_feedback', 'hours_per_day', 'off_days', 'class_schedule', 'subject_marks']
+
+
+def source_key(data):
+    """SHA-256 of a batch's input (bytes or a JSON-serializable value)."""
+    if not isinstance(data, bytes):
+        data = json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_csv(data):
+    """(line_number, row) pairs from CSV bytes with a header row; see CSV_COLUMNS.
+
+    Multi-line cells (such as subject_marks) must be quoted.
+    """
+    reader = csv.DictReader(io.StringIO(data.decode('utf-8-sig'), newline=''))
+    missing = {'title', 'start_date', 'end_date', 'subjects', 'hours_per_day'} - set(reader.fieldnames or [])
+    if missing:
+        raise ValueError(f"CSV is missing column(s): {', '.join(sorted(missing))}")
+    rows = []
+    for row in reader:
+        if any((value or '').strip() for value in row.values()):
+            rows.append((reader.line_num, {key: value or '' for key, value in row.items() if key}))
+    return rows
+
+
+def create_batch(db, source, key, items, prepare, chunk_size=100, on_chunk=None):
+    """Create the plans of a batch, skipping items a previous run already processed.
+
+    ``items`` are (item_number, values) pairs and ``prepare(values)`` returns
+    (form_data, marks_data, draft_schedule) or raises KeyError/ValueError for
+    an item that can't become a plan; it must check every field (as
+    app.plan_form_data does), since any other error aborts the run. ``on_chunk(done, total)`` is called
+    after each committed chunk. Returns (batch_id, created, rejected, skipped).
+    """
+    with database.transaction(db):
+        batch = database.get_batch_by_key(db, key)
+        batch_id = batch['id'] if batch is not None else database.insert_batch(db, source, key, len(items))
+    done = database.get_batch_item_numbers(db, batch_id)
+    todo = [(number, values) for number, values in items if number not in done]
+    created = rejected = 0
+
+    for start in range(0, len(todo), chunk_size):
+        chunk = todo[start:start + chunk_size]
+        prepared, errors = [], []
+        for number, values in chunk:
+            try:
+                prepared.append((number,) + tuple(prepare(values)))
+            except (KeyError, ValueError, IndexError) as e:
+                errors.append((number, None, f'{type(e).__name__}: {e}'))
+        with database.transaction(db):
+            plan_ids = database.insert_pending_plans(db, [form_data for _, form_data, _, _ in prepared])
+            database.insert_subject_marks_many(db, [(plan_id, marks_data) for plan_id, (_, _, marks_data, _)
+                                                    in zip(plan_ids, prepared)])
+            database.set_new_plan_schedules(db, {plan_id: draft for plan_id, (_, _, _, draft) in zip(plan_ids, prepared)})
+            jobs.enqueue_many(db, 'generate_plan', [(plan_id, {'form': form_data, 'marks': marks_data})
+                                                    for plan_id, (_, form_data, marks_data, _) in zip(plan_ids, prepared)])
+            database.insert_batch_items(db, batch_id, [(number, plan_id, None) for plan_id, (number, _, _, _)
+                                                       in zip(plan_ids, prepared)] + errors)
+        jobs.notify()
+        created += len(prepared)
+        rejected += len(errors)
+        if on_chunk is not None:
+            on_chunk(len(done) + start + len(chunk), len(items))
+    return batch_id, created, rejected, len(done)
+
+
+def wait_for_batch(db, batch_id, interval=2.0, on_progress=None):
+    """Block until none of the batch's plans is pending, calling ``on_progress(progress)`` every interval."""
+    while True:
+        progress = database.get_batch_progress(db, batch_id)
+        if on_progress is not None:
+            on_progress(progress)
+        if not progress['pending']:
+            return progress
+        time.sleep(interval)
+
+
+def format_progress(progress, total, started, finished_before=0):
+    """One line such as "120/500 done (118 ready, 2 failed), 0 rejected, 380 pending, 1.9 plans/s, ~3m20s left".
+
+    ``finished_before`` plans were already done when timing ``started`` (when resuming a batch).
+    """
+    finished = progress['ready'] + progress['failed']
+    elapsed = max(time.monotonic() - started, 1e-6)
+    rate = (finished - finished_before) / elapsed
+    line = (f"{finished}/{total - progress['rejected']} done ({progress['ready']} ready, {progress['failed']} failed), "
+            f"{progress['rejected']} rejected, {progress['pending']} pending, {rate:.1f} plans/s")
+    if rate and progress['pending']:
+        left = int(progress['pending'] / rate)
+        line += f', ~{left // 60}m{left % 60:02d}s left'
+    return line
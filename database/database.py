@@ -1,4 +1,719 @@
-# This file is currently minimal as core DB functions are in app.py.
-# It could be expanded later for more complex database operations or ORM setup.
- 
-print("Database utility module loaded (currently minimal).") 
\ No newline at end of file
+"""Data-access layer: SQLite connection management and the application's named queries.
+
+Each thread of each worker process keeps one long-lived connection (reopened
+after a fork), configured for concurrent use by several gunicorn workers: WAL
+journaling so readers never block the writer, a busy timeout so writers wait
+for each other instead of failing with "database is locked", and a larger
+prepared-statement cache. Write transactions use BEGIN IMMEDIATE so a writer
+takes the lock up front rather than failing when upgrading a read lock.
+Code on an asyncio event loop reaches the database through ``run_async``.
+"""
+import asyncio
+import importlib.util
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import metrics
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'schema.sql')
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), 'migrations')
+
+BUSY_TIMEOUT_MS = int(os.getenv('DATABASE_BUSY_TIMEOUT_MS', 10000))
+CACHE_SIZE_KB = int(os.getenv('DATABASE_CACHE_SIZE_KB', 16384))
+MMAP_SIZE = int(os.getenv('DATABASE_MMAP_SIZE', 128 * 1024 * 1024))
+STATEMENT_CACHE_SIZE = 256
+# Plan text at least this long is stored compressed (see pack_text)
+COMPRESS_MIN_BYTES = int(os.getenv('DATABASE_COMPRESS_MIN_BYTES', 512))
+# Threads that run database calls for asyncio code (see run_async)
+ASYNC_THREADS = int(os.getenv('DATABASE_ASYNC_THREADS', 4))
+
+_local = threading.local()
+_async_executor = None
+_async_executor_pid = None
+_async_executor_lock = threading.Lock()
+
+
+# --- Connections ---
+
+class TimedConnection(sqlite3.Connection):
+    """Records how long every statement takes in metrics.sql_statement_duration_seconds."""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.observe_statement(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.observe_statement(sql, time.perf_counter() - started)
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            metrics.observe('sql_statement_duration_seconds', time.perf_counter() - started,
+                            operation='SCRIPT', table='')
+
+
+def connect(path):
+    """Open a new, tuned connection. Prefer get_connection(), which reuses one per thread."""
+    conn = sqlite3.connect(
+        path,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        factory=TimedConnection
+    )
+    conn.row_factory = sqlite3.Row
+    # Used by the plan_search triggers and view to index compressed columns
+    conn.create_function('unpack_text', 1, unpack_text, deterministic=True)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')  # Durable across app crashes; WAL keeps it consistent
+    conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    return conn
+
+
+def get_connection(path):
+    """Return this thread's long-lived connection to ``path``.
+
+    Connections must not cross a fork, so one inherited from a parent process
+    is abandoned (not closed, which could disturb the parent) and reopened.
+    """
+    if getattr(_local, 'pid', None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.connections = {}
+    conn = _local.connections.get(path)
+    if conn is None:
+        conn = _local.connections[path] = connect(path)
+    return conn
+
+
+def close_connection(path):
+    """Close this thread's connection to ``path`` (e.g. before deleting the database file)."""
+    if getattr(_local, 'pid', None) == os.getpid():
+        conn = _local.connections.pop(path, None)
+        if conn is not None:
+            conn.close()
+
+
+def release(conn):
+    """End of a request: keep the connection, but never leak an open transaction into the next one."""
+    if conn.in_transaction:
+        conn.rollback()
+
+
+def _get_async_executor():
+    global _async_executor, _async_executor_pid
+    if _async_executor_pid != os.getpid():
+        with _async_executor_lock:
+            if _async_executor_pid != os.getpid():
+                # Threads don't survive a fork; a new process gets its own pool
+                _async_executor = ThreadPoolExecutor(max_workers=ASYNC_THREADS, thread_name_prefix='db-async')
+                _async_executor_pid = os.getpid()
+    return _async_executor
+
+
+async def run_async(path, func, *args):
+    """Await ``func(db, *args)``, run with a connection to ``path`` on one of the database threads.
+
+    SQLite has no asynchronous API. Its calls are short, so a few threads,
+    each keeping its own connection, serve any number of tasks without
+    blocking the event loop. ``func`` may use transaction() as usual.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_async_executor(), lambda: func(get_connection(path), *args))
+
+
+@contextmanager
+def transaction(db):
+    """Run a write transaction that holds the write lock from the start, committing on success."""
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        yield db
+    except BaseException:
+        db.rollback()
+        raise
+    db.commit()
+
+
+# --- Schema ---
+
+def list_migrations():
+    """Return the numbered migration scripts in order, e.g. [(1, '.../0001_plan_jobs.sql')].
+
+    Schema changes are .sql scripts; data migrations are .py modules with an `upgrade(db)` function.
+    """
+    migrations = []
+    for name in sorted(os.listdir(MIGRATIONS_DIR)):
+        if name.endswith('.sql') or name.endswith('.py'):
+            migrations.append((int(name.split('_', 1)[0]), os.path.join(MIGRATIONS_DIR, name)))
+    return migrations
+
+
+def run_migration(db, path):
+    if path.endswith('.py'):
+        spec = importlib.util.spec_from_file_location(os.path.basename(path)[:-3], path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.upgrade(db)
+        db.commit()
+    else:
+        with open(path, 'r') as f:
+            db.executescript(f.read())
+
+
+def init_schema(db):
+    with open(SCHEMA_PATH, 'r') as f:
+        db.executescript(f.read())
+    # schema.sql is always the latest schema, so a fresh database needs no migrations
+    migrations = list_migrations()
+    db.execute(f'PRAGMA user_version = {migrations[-1][0] if migrations else 0}')
+
+
+def upgrade_schema(db):
+    """Apply migrations newer than the database's user_version. Returns the names applied."""
+    version = db.execute('PRAGMA user_version').fetchone()[0]
+    applied = []
+    for number, path in list_migrations():
+        if number <= version:
+            continue
+        run_migration(db, path)
+        db.execute(f'PRAGMA user_version = {number}')
+        applied.append(os.path.basename(path))
+    return applied
+
+
+# --- Compressed text ---
+# The generated guide, resources and schedule of a plan are stored zlib-compressed,
+# as a BLOB starting with COMPRESSED_PREFIX. Short values, and values written by
+# older versions, are plain TEXT; readers get text either way.
+
+COMPRESSED_PREFIX = b'z1:'
+COMPRESSED_PLAN_COLUMNS = ('generated_guide', 'resources', 'generated_schedule')
+
+
+def pack_text(text):
+    """The value to store for ``text``: compressed bytes, or the text itself if short or incompressible."""
+    if not isinstance(text, str):
+        return text
+    data = text.encode('utf-8')
+    if len(data) < COMPRESS_MIN_BYTES:
+        return text
+    packed = COMPRESSED_PREFIX + zlib.compress(data, 6)
+    return packed if len(packed) < len(data) else text
+
+
+def unpack_text(value):
+    if isinstance(value, bytes) and value.startswith(COMPRESSED_PREFIX):
+        return zlib.decompress(value[len(COMPRESSED_PREFIX):]).decode('utf-8')
+    return value
+
+
+def _unpack_plan(row):
+    if row is None:
+        return None
+    plan = dict(row)
+    for column in COMPRESSED_PLAN_COLUMNS:
+        if column in plan:
+            plan[column] = unpack_text(plan[column])
+    return plan
+
+
+# --- Plans ---
+
+def plans_exist(db):
+    return db.execute('SELECT EXISTS (SELECT 1 FROM plans)').fetchone()[0] == 1
+
+
+def list_plans(db, before=None, limit=None):
+    """Plans newest first; with ``limit``, one page of the plans older than plan id ``before``."""
+    sql = 'SELECT id, title, start_date, end_date, subjects, status FROM plans'
+    params = []
+    if before is not None:
+        sql += ' WHERE id < ?'
+        params.append(before)
+    sql += ' ORDER BY id DESC'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return db.execute(sql, params).fetchall()
+
+
+# --- Full-text search (plan_search is kept in sync with plans by triggers) ---
+
+# Snippets mark matched words with these, for the caller to turn into (escaped) HTML
+HIGHLIGHT_START, HIGHLIGHT_END = '\x02', '\x03'
+
+
+def search_match(text):
+    """An FTS5 query for what a user typed: every word must match, the last one as a prefix. None if no words."""
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    return ' '.join([f'"{word}"' for word in words[:-1]] + [f'"{words[-1]}"*'])
+
+
+def search_plans(db, match, after=None, limit=20):
+    """Plans matching an FTS5 query, best first, with a snippet of the best matching column.
+
+    ``after`` is the (rank, id) of the last plan of the previous page.
+    """
+    sql = f'''
+        SELECT p.id, p.title, p.start_date, p.end_date, p.subjects, p.status, plan_search.rank AS rank,
+               snippet(plan_search, -1, ?, ?, '…', 16) AS snippet
+        FROM plan_search JOIN plans AS p ON p.id = plan_search.rowid
+        WHERE plan_search MATCH ? {'AND (plan_search.rank > ? OR (plan_search.rank = ? AND p.id > ?))' if after else ''}
+        ORDER BY plan_search.rank, p.id
+        LIMIT ?
+    '''
+    params = [HIGHLIGHT_START, HIGHLIGHT_END, match]
+    if after:
+        params += [after[0], after[0], after[1]]
+    return db.execute(sql, params + [limit]).fetchall()
+
+
+def plan_exists(db, plan_id):
+    return db.execute('SELECT 1 FROM plans WHERE id = ?', (plan_id,)).fetchone() is not None
+
+
+def get_plan(db, plan_id):
+    return _unpack_plan(db.execute('SELECT * FROM plans WHERE id = ?', (plan_id,)).fetchone())
+
+
+def get_plan_summary(db, plan_id):
+    """Everything the plan page shows, without the (large) schedule JSON."""
+    return _unpack_plan(db.execute('''
+        SELECT id, title, description, start_date, end_date, subjects, learning_goal,
+               difficulty_feedback, hours_per_day, off_days, class_schedule,
+               generated_guide, resources, status, created_at
+        FROM plans WHERE id = ?
+    ''', (plan_id,)).fetchone())
+
+
+def get_plan_status(db, plan_id):
+    row = db.execute('SELECT status FROM plans WHERE id = ?', (plan_id,)).fetchone()
+    return row['status'] if row else None
+
+
+def get_plan_version(db, plan_id):
+    """The plan's write counter and last-change timestamp as text (created_at until it is first
+    updated), as a row of ``version`` and ``modified``; None if there is no such plan.
+    """
+    return db.execute(
+        'SELECT version, CAST(COALESCE(updated_at, created_at) AS TEXT) AS modified FROM plans WHERE id = ?',
+        (plan_id,)
+    ).fetchone()
+
+
+def get_plan_schedule_json(db, plan_id):
+    row = db.execute('SELECT generated_schedule FROM plans WHERE id = ?', (plan_id,)).fetchone()
+    return unpack_text(row['generated_schedule']) if row else None
+
+
+def iter_plan_schedule_chunks(db, chunk_size=500, after_id=0):
+    """Every generated plan's scheduling inputs and schedule JSON, as lists of at most ``chunk_size`` dicts.
+
+    Each chunk is one keyset query (id > the last id seen), so no read stays
+    open between chunks and the caller can write in between. Pending plans
+    are skipped, as their job will replace the schedule.
+    """
+    while True:
+        rows = db.execute('''
+            SELECT id, title, description, start_date, end_date, subjects, learning_goal, difficulty_feedback,
+                   hours_per_day, off_days, class_schedule, status, generated_schedule
+            FROM plans WHERE id > ? AND status != 'pending' ORDER BY id LIMIT ?
+        ''', (after_id, chunk_size)).fetchall()
+        if not rows:
+            return
+        yield [_unpack_plan(row) for row in rows]
+        after_id = rows[-1]['id']
+
+
+_INSERT_PENDING_PLAN = '''
+    INSERT INTO plans (title, description, start_date, end_date, subjects, learning_goal,
+                     difficulty_feedback, hours_per_day, off_days, class_schedule, status)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending')
+'''
+
+
+def _pending_plan_row(form_data):
+    return (form_data['title'], form_data['description'], form_data['start_date'],
+            form_data['end_date'], form_data['subjects'], form_data['learning_goal'],
+            form_data['difficulty_feedback'], form_data['hours_per_day'],
+            form_data['off_days'], form_data['class_schedule'])
+
+
+def insert_pending_plan(db, form_data):
+    """Insert a plan whose AI content will be filled in later by a job. Returns its id."""
+    return db.execute(_INSERT_PENDING_PLAN, _pending_plan_row(form_data)).lastrowid
+
+
+def insert_pending_plans(db, forms):
+    """Insert several pending plans with one executemany. Returns their ids in order.
+
+    Must run inside a write transaction: while it holds the write lock, the
+    AUTOINCREMENT ids of the new rows are consecutive and end at last_insert_rowid().
+    """
+    if not forms:
+        return []
+    db.executemany(_INSERT_PENDING_PLAN, [_pending_plan_row(form_data) for form_data in forms])
+    last_id = db.execute('SELECT last_insert_rowid()').fetchone()[0]
+    return list(range(last_id - len(forms) + 1, last_id + 1))
+
+
+def insert_subject_marks(db, plan_id, marks_data):
+    insert_subject_marks_many(db, [(plan_id, marks_data)])
+
+
+def insert_subject_marks_many(db, plan_marks):
+    """Insert the marks of several plans, given as (plan_id, marks_data) pairs, with one executemany."""
+    db.executemany('''
+        INSERT INTO subject_marks (plan_id, subject_name, component_type,
+                                 assessment_name, max_marks, obtained_marks)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(plan_id, mark['subject_name'], mark['component_type'], mark['assessment_name'],
+           mark['max_marks'], mark['obtained_marks'])
+          for plan_id, marks_data in plan_marks for mark in marks_data])
+
+
+def get_subject_marks(db, plan_id):
+    return db.execute('''
+        SELECT subject_name, component_type, assessment_name, max_marks, obtained_marks
+        FROM subject_marks WHERE plan_id = ? ORDER BY id
+    ''', (plan_id,)).fetchall()
+
+
+def get_subject_marks_many(db, plan_ids):
+    """{plan_id: [mark, ...]} for several plans in one query; marks are plain dicts."""
+    marks = {plan_id: [] for plan_id in plan_ids}
+    if not marks:
+        return marks
+    rows = db.execute(f'''
+        SELECT plan_id, subject_name, component_type, assessment_name, max_marks, obtained_marks
+        FROM subject_marks WHERE plan_id IN ({', '.join('?' * len(marks))}) ORDER BY plan_id, id
+    ''', list(marks)).fetchall()
+    for row in rows:
+        mark = dict(row)
+        marks[mark.pop('plan_id')].append(mark)
+    return marks
+
+
+def update_plan_content(db, plan_id, learning_guide, schedule, resources):
+    """Store a plan's generated content and mark it ready."""
+    db.execute('''
+        UPDATE plans SET generated_guide = ?, generated_schedule = ?, resources = ?, status = 'ready',
+                         updated_at = CURRENT_TIMESTAMP, version = version + 1
+        WHERE id = ?
+    ''', (pack_text(learning_guide), pack_text(json.dumps(schedule)), pack_text(resources), plan_id))
+    save_schedule_blocks(db, plan_id, schedule)
+
+
+def mark_plan_failed(db, plan_id):
+    """Mark a pending plan whose AI generation gave up as failed (its draft schedule stays)."""
+    db.execute(
+        "UPDATE plans SET status = 'failed', updated_at = CURRENT_TIMESTAMP, version = version + 1 "
+        "WHERE id = ? AND status = 'pending'",
+        (plan_id,)
+    )
+
+
+def update_plan_schedule(db, plan_id, schedule, mark_ready=False):
+    """Replace a plan's schedule (and its schedule blocks)."""
+    if mark_ready:
+        db.execute(
+            "UPDATE plans SET generated_schedule = ?, status = 'ready', updated_at = CURRENT_TIMESTAMP, "
+            'version = version + 1 WHERE id = ?',
+            (pack_text(json.dumps(schedule)), plan_id)
+        )
+    else:
+        db.execute(
+            'UPDATE plans SET generated_schedule = ?, updated_at = CURRENT_TIMESTAMP, version = version + 1 '
+            'WHERE id = ?',
+            (pack_text(json.dumps(schedule)), plan_id)
+        )
+    save_schedule_blocks(db, plan_id, schedule)
+
+
+def update_plan_schedules(db, schedules):
+    """Replace the schedules of several plans, {plan_id: schedule}, and mark them ready.
+
+    The batched form of update_plan_schedule(mark_ready=True), used by bulk repairs.
+    """
+    db.executemany(
+        "UPDATE plans SET generated_schedule = ?, status = 'ready', updated_at = CURRENT_TIMESTAMP, "
+        'version = version + 1 WHERE id = ?',
+        [(pack_text(json.dumps(schedule)), plan_id) for plan_id, schedule in schedules.items()]
+    )
+    db.executemany('DELETE FROM schedule_blocks WHERE plan_id = ?', [(plan_id,) for plan_id in schedules])
+    _insert_schedule_blocks(db, [row for plan_id, schedule in schedules.items()
+                                 for row in _schedule_block_rows(plan_id, schedule)])
+
+
+def replace_schedule_days(db, plan_id, days, drop=()):
+    """Replace some days of a plan's schedule, {date: blocks}, and remove the ``drop`` dates.
+
+    Only the affected dates' rows in schedule_blocks are rewritten. Returns the
+    previous blocks of every touched date ({date: blocks}, None where the date
+    was not in the schedule), for recording a revision.
+    """
+    schedule = json.loads(get_plan_schedule_json(db, plan_id) or '{}')
+    touched = list(days) + list(drop)
+    previous = {day: schedule.get(day) for day in touched}
+    schedule.update(days)
+    for day in drop:
+        schedule.pop(day, None)
+    db.execute('UPDATE plans SET generated_schedule = ?, updated_at = CURRENT_TIMESTAMP, version = version + 1 '
+               'WHERE id = ?',
+               (pack_text(json.dumps(dict(sorted(schedule.items())))), plan_id))
+    db.executemany('DELETE FROM schedule_blocks WHERE plan_id = ? AND date = ?', [(plan_id, day) for day in touched])
+    _insert_schedule_blocks(db, _schedule_block_rows(plan_id, days))
+    return previous
+
+
+def update_plan_inputs(db, plan_id, form_data):
+    """Store changed scheduling inputs of a plan (see replan.FIELDS)."""
+    db.execute('''
+        UPDATE plans SET start_date = ?, end_date = ?, hours_per_day = ?, off_days = ?, class_schedule = ?,
+                         subjects = ?, updated_at = CURRENT_TIMESTAMP, version = version + 1
+        WHERE id = ?
+    ''', (form_data['start_date'], form_data['end_date'], form_data['hours_per_day'], form_data['off_days'],
+          form_data['class_schedule'], form_data['subjects'], plan_id))
+
+
+def replace_subject_marks(db, plan_id, marks_data):
+    db.execute('DELETE FROM subject_marks WHERE plan_id = ?', (plan_id,))
+    insert_subject_marks(db, plan_id, marks_data)
+
+
+def set_new_plan_schedules(db, schedules):
+    """Store the first schedule of several new plans, {plan_id: schedule}, with two executemany calls.
+
+    Unlike update_plan_schedule this does not clear old blocks, as new plans have none.
+    """
+    db.executemany(
+        'UPDATE plans SET generated_schedule = ?, updated_at = CURRENT_TIMESTAMP, version = version + 1 '
+        'WHERE id = ?',
+        [(pack_text(json.dumps(schedule)), plan_id) for plan_id, schedule in schedules.items()]
+    )
+    _insert_schedule_blocks(db, [row for plan_id, schedule in schedules.items()
+                                 for row in _schedule_block_rows(plan_id, schedule)])
+
+
+# --- Schedule blocks ---
+
+def _schedule_block_rows(plan_id, schedule):
+    if not isinstance(schedule, dict):
+        return []
+    rows = []
+    for date, blocks in schedule.items():
+        if not isinstance(blocks, list):
+            continue
+        for block in blocks:
+            if isinstance(block, dict) and all(k in block for k in ('start_time', 'end_time', 'subject', 'task')):
+                rows.append((plan_id, date, str(block['start_time']), str(block['end_time']),
+                             str(block['subject']), str(block['task'])))
+    return rows
+
+
+def _insert_schedule_blocks(db, rows):
+    db.executemany('''
+        INSERT INTO schedule_blocks (plan_id, date, start_time, end_time, subject, task)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', rows)
+
+
+def save_schedule_blocks(db, plan_id, schedule):
+    """Replace a plan's rows in schedule_blocks with the blocks of `schedule`.
+
+    Runs inside the caller's transaction so the rows always match generated_schedule.
+    """
+    db.execute('DELETE FROM schedule_blocks WHERE plan_id = ?', (plan_id,))
+    _insert_schedule_blocks(db, _schedule_block_rows(plan_id, schedule))
+
+
+def has_schedule_blocks(db, plan_id):
+    return db.execute(
+        'SELECT 1 FROM schedule_blocks WHERE plan_id = ? LIMIT 1', (plan_id,)
+    ).fetchone() is not None
+
+
+def get_schedule_blocks(db, plan_id, date_from=None, date_to=None, subject=None, date_to_exclusive=False):
+    """Blocks of a plan ordered by date and time, optionally filtered; served from the indexes."""
+    query = 'SELECT date, start_time, end_time, subject, task FROM schedule_blocks WHERE plan_id = ?'
+    params = [plan_id]
+    if date_from:
+        query += ' AND date >= ?'
+        params.append(date_from)
+    if date_to:
+        query += ' AND date < ?' if date_to_exclusive else ' AND date <= ?'
+        params.append(date_to)
+    if subject:
+        query += ' AND subject = ?'
+        params.append(subject)
+    query += ' ORDER BY date, start_time'
+    return db.execute(query, params)
+
+
+# --- Streamed generation ---
+
+def clear_stream_days(db, plan_id):
+    db.execute('DELETE FROM plan_stream_days WHERE plan_id = ?', (plan_id,))
+
+
+def insert_stream_day(db, plan_id, day, blocks):
+    db.execute('INSERT INTO plan_stream_days (plan_id, day, blocks) VALUES (?, ?, ?)',
+               (plan_id, day, json.dumps(blocks)))
+
+
+def get_stream_days_after(db, plan_id, after_id):
+    return db.execute(
+        'SELECT id, day, blocks FROM plan_stream_days WHERE plan_id = ? AND id > ? ORDER BY id',
+        (plan_id, after_id)
+    ).fetchall()
+
+
+# --- Plan batches ---
+
+def get_batch_by_key(db, source_key):
+    return db.execute('SELECT * FROM plan_batches WHERE source_key = ?', (source_key,)).fetchone()
+
+
+def get_batch(db, batch_id):
+    return db.execute('SELECT * FROM plan_batches WHERE id = ?', (batch_id,)).fetchone()
+
+
+def insert_batch(db, source, source_key, total_items):
+    return db.execute(
+        'INSERT INTO plan_batches (source, source_key, total_items) VALUES (?, ?, ?)',
+        (source, source_key, total_items)
+    ).lastrowid
+
+
+def get_batch_item_numbers(db, batch_id):
+    """Numbers of the items of a batch that were already processed (created or rejected)."""
+    return {row[0] for row in db.execute('SELECT item_number FROM plan_batch_items WHERE batch_id = ?', (batch_id,))}
+
+
+def insert_batch_items(db, batch_id, items):
+    """Record processed items as (item_number, plan_id, error) tuples; plan_id is None for rejected ones."""
+    db.executemany(
+        'INSERT INTO plan_batch_items (batch_id, item_number, plan_id, error) VALUES (?, ?, ?, ?)',
+        [(batch_id, number, plan_id, error) for number, plan_id, error in items]
+    )
+
+
+def get_batch_progress(db, batch_id):
+    """Counts of a batch's plans by status, plus 'rejected' items that never became plans."""
+    progress = {'pending': 0, 'ready': 0, 'failed': 0, 'rejected': 0}
+    for status, count in db.execute('''
+        SELECT COALESCE(p.status, 'rejected'), COUNT(*)
+        FROM plan_batch_items i LEFT JOIN plans p ON p.id = i.plan_id
+        WHERE i.batch_id = ? GROUP BY 1
+    ''', (batch_id,)):
+        progress[status] = count
+    return progress
+
+
+def get_batch_items(db, batch_id):
+    return db.execute('''
+        SELECT i.item_number, i.plan_id, i.error, p.status
+        FROM plan_batch_items i LEFT JOIN plans p ON p.id = i.plan_id
+        WHERE i.batch_id = ? ORDER BY i.item_number
+    ''', (batch_id,)).fetchall()
+
+
+# --- Plan revisions ---
+
+def insert_plan_revision(db, plan_id, changes, regenerate, clear, drop, previous_days):
+    return db.execute('''
+        INSERT INTO plan_revisions (plan_id, changes, regenerated_days, cleared_days, dropped_days, previous_days)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (plan_id, json.dumps(changes), len(regenerate), len(clear), len(drop), json.dumps(previous_days))).lastrowid
+
+
+def finish_plan_revision(db, revision_id, status, error=None):
+    db.execute(
+        'UPDATE plan_revisions SET status = ?, error = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?',
+        (status, error, revision_id)
+    )
+
+
+def get_plan_revision(db, revision_id):
+    return db.execute('''
+        SELECT id, plan_id, status, changes, regenerated_days, cleared_days, dropped_days, error,
+               CAST(created_at AS TEXT) AS created_at, CAST(finished_at AS TEXT) AS finished_at
+        FROM plan_revisions WHERE id = ?
+    ''', (revision_id,)).fetchone()
+
+
+def get_plan_revisions(db, plan_id, limit=20):
+    """A plan's most recent revisions, newest first (without the previous days, which can be large)."""
+    return db.execute('''
+        SELECT id, plan_id, status, changes, regenerated_days, cleared_days, dropped_days, error,
+               CAST(created_at AS TEXT) AS created_at, CAST(finished_at AS TEXT) AS finished_at
+        FROM plan_revisions WHERE plan_id = ? ORDER BY id DESC LIMIT ?
+    ''', (plan_id, limit)).fetchall()
+
+
+# --- Marks analytics (subject_performance is maintained by triggers on subject_marks) ---
+
+_COHORT_PLANS = 'AND {alias}.plan_id IN (SELECT plan_id FROM plan_batch_items WHERE batch_id = ?)'
+
+
+def get_subject_performance(db, plan_id, batch_id=None):
+    """A plan's marks per subject next to the same subjects across all plans (or one batch's), in one query.
+
+    ``plans_below`` counts the cohort's plans with a lower percentage in the subject.
+    """
+    cohort = _COHORT_PLANS.format(alias='other') if batch_id is not None else ''
+    return db.execute(f'''
+        SELECT me.subject_name, me.assessments, me.obtained_total, me.max_total,
+               me.obtained_total * 100.0 / me.max_total AS percentage,
+               COUNT(*) AS cohort_plans,
+               SUM(other.obtained_total) * 100.0 / SUM(other.max_total) AS cohort_percentage,
+               AVG(other.obtained_total * 100.0 / other.max_total) AS cohort_mean_percentage,
+               SUM(other.obtained_total * me.max_total < me.obtained_total * other.max_total) AS plans_below
+        FROM subject_performance AS me
+        JOIN subject_performance AS other ON other.subject_key = me.subject_key AND other.max_total > 0 {cohort}
+        WHERE me.plan_id = ? AND me.max_total > 0
+        GROUP BY me.subject_key
+        ORDER BY percentage
+    ''', ((batch_id,) if batch_id is not None else ()) + (plan_id,)).fetchall()
+
+
+def get_cohort_subject_performance(db, weak_below=50.0, batch_id=None, limit=100):
+    """Marks per subject across all plans (or one batch's), weakest first.
+
+    ``percentage`` pools every mark; ``mean_percentage`` averages the plans'
+    own percentages, and ``weak_plans`` counts plans below ``weak_below``.
+    """
+    cohort = _COHORT_PLANS.format(alias='sp') if batch_id is not None else ''
+    return db.execute(f'''
+        SELECT MIN(sp.subject_name) AS subject_name, COUNT(*) AS plans, SUM(sp.assessments) AS assessments,
+               SUM(sp.obtained_total) * 100.0 / SUM(sp.max_total) AS percentage,
+               AVG(sp.obtained_total * 100.0 / sp.max_total) AS mean_percentage,
+               MIN(sp.obtained_total * 100.0 / sp.max_total) AS min_percentage,
+               MAX(sp.obtained_total * 100.0 / sp.max_total) AS max_percentage,
+               SUM(sp.obtained_total * 100.0 < ? * sp.max_total) AS weak_plans
+        FROM subject_performance AS sp
+        WHERE sp.max_total > 0 {cohort}
+        GROUP BY sp.subject_key
+        ORDER BY percentage
+        LIMIT ?
+    ''', (weak_below,) + ((batch_id,) if batch_id is not None else ()) + (limit,)).fetchall()
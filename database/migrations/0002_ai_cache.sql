@@ -0,0 +1,12 @@
+-- Cache of validated AI responses keyed on normalized plan inputs (see ai_cache.py).
+CREATE TABLE IF NOT EXISTS ai_cache (
+    cache_key TEXT PRIMARY KEY,
+    learning_guide TEXT NOT NULL,
+    schedule TEXT NOT NULL,
+    resources TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_ai_cache_last_used ON ai_cache(last_used_at);
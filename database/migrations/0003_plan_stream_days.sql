@@ -0,0 +1,10 @@
+-- Schedule days streamed by a running generation job, pushed to the browser over SSE.
+CREATE TABLE IF NOT EXISTS plan_stream_days (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    plan_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    blocks TEXT NOT NULL,
+    FOREIGN KEY (plan_id) REFERENCES plans(id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_plan_stream_days_plan ON plan_stream_days(plan_id, id);
@@ -0,0 +1,15 @@
+-- One row per study block, so schedules can be queried by date range or subject
+-- without parsing plans.generated_schedule.
+CREATE TABLE IF NOT EXISTS schedule_blocks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    plan_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    start_time TEXT NOT NULL,
+    end_time TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    task TEXT NOT NULL,
+    FOREIGN KEY (plan_id) REFERENCES plans(id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_schedule_blocks_plan_date ON schedule_blocks(plan_id, date, start_time);
+CREATE INDEX IF NOT EXISTS idx_schedule_blocks_plan_subject ON schedule_blocks(plan_id, subject);
@@ -0,0 +1,37 @@
+"""Populate schedule_blocks from the JSON schedules of existing plans."""
+import json
+
+BATCH_SIZE = 500
+
+
+def schedule_rows(plan_id, schedule_json):
+    try:
+        schedule = json.loads(schedule_json) if schedule_json else {}
+    except json.JSONDecodeError:
+        return []  # Unparseable schedules stay raw until "Attempt to Fix JSON" repairs them
+    if not isinstance(schedule, dict):
+        return []
+    rows = []
+    for date, blocks in schedule.items():
+        if not isinstance(blocks, list):
+            continue
+        for block in blocks:
+            if isinstance(block, dict) and all(k in block for k in ('start_time', 'end_time', 'subject', 'task')):
+                rows.append((plan_id, date, str(block['start_time']), str(block['end_time']),
+                             str(block['subject']), str(block['task'])))
+    return rows
+
+
+def upgrade(db):
+    cursor = db.execute('SELECT id, generated_schedule FROM plans ORDER BY id')
+    while True:
+        plans = cursor.fetchmany(BATCH_SIZE)
+        if not plans:
+            break
+        rows = []
+        for plan_id, schedule_json in plans:
+            rows.extend(schedule_rows(plan_id, schedule_json))
+        db.executemany('''
+            INSERT INTO schedule_blocks (plan_id, date, start_time, end_time, subject, task)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
@@ -0,0 +1,2 @@
+-- When a plan's content last changed; drives ETag/Last-Modified on the calendar feed.
+ALTER TABLE plans ADD COLUMN updated_at TIMESTAMP;
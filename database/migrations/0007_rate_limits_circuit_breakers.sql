@@ -0,0 +1,13 @@
+-- Shared state of the upstream rate limiters and circuit breakers (see resilience.py)
+CREATE TABLE IF NOT EXISTS rate_limits (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL -- Unix time of the last refill
+);
+
+CREATE TABLE IF NOT EXISTS circuit_breakers (
+    name TEXT PRIMARY KEY,
+    state TEXT NOT NULL DEFAULT 'closed', -- closed, open or half_open
+    failures INTEGER NOT NULL DEFAULT 0, -- Consecutive upstream failures
+    opened_at REAL -- Unix time the breaker opened (or its trial call started)
+);
@@ -0,0 +1,19 @@
+-- Bulk plan requests (a CSV file or a JSON batch); the same input resumes the same batch
+CREATE TABLE IF NOT EXISTS plan_batches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL, -- CSV file name, or 'api'
+    source_key TEXT NOT NULL UNIQUE, -- SHA-256 of the input
+    total_items INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Items of a batch that have been processed: the plan created for them, or why they were rejected
+CREATE TABLE IF NOT EXISTS plan_batch_items (
+    batch_id INTEGER NOT NULL,
+    item_number INTEGER NOT NULL, -- CSV line number or position in the JSON array
+    plan_id INTEGER, -- NULL when rejected
+    error TEXT,
+    PRIMARY KEY (batch_id, item_number),
+    FOREIGN KEY (batch_id) REFERENCES plan_batches(id),
+    FOREIGN KEY (plan_id) REFERENCES plans(id)
+);
@@ -0,0 +1,17 @@
+-- Incremental updates of a plan's inputs (see replan.py); previous_days allows undoing one
+CREATE TABLE IF NOT EXISTS plan_revisions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    plan_id INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending', -- "pending" while the affected days are regenerated, then "done" or "failed"
+    changes TEXT NOT NULL, -- JSON {field: [old, new]}, with per-subject averages under "marks"
+    regenerated_days INTEGER NOT NULL,
+    cleared_days INTEGER NOT NULL,
+    dropped_days INTEGER NOT NULL,
+    previous_days TEXT NOT NULL, -- JSON {date: blocks} of the touched days before the update (null if new)
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP,
+    FOREIGN KEY (plan_id) REFERENCES plans(id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_plan_revisions_plan ON plan_revisions(plan_id, id);
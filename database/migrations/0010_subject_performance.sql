@@ -0,0 +1,64 @@
+-- Marks lookups by plan and by subject
+CREATE INDEX IF NOT EXISTS idx_subject_marks_plan ON subject_marks(plan_id);
+CREATE INDEX IF NOT EXISTS idx_subject_marks_subject ON subject_marks(subject_name);
+
+-- Per plan and subject marks totals, kept up to date by the triggers below
+CREATE TABLE IF NOT EXISTS subject_performance (
+    plan_id INTEGER NOT NULL,
+    subject_key TEXT NOT NULL, -- lower(trim(subject_name)), so "Math" and "math " are one subject
+    subject_name TEXT NOT NULL,
+    assessments INTEGER NOT NULL,
+    obtained_total REAL NOT NULL,
+    max_total REAL NOT NULL,
+    PRIMARY KEY (plan_id, subject_key),
+    FOREIGN KEY (plan_id) REFERENCES plans(id)
+) WITHOUT ROWID;
+
+-- Covers the cohort aggregates, which group every plan's row of a subject
+CREATE INDEX IF NOT EXISTS idx_subject_performance_subject
+    ON subject_performance(subject_key, obtained_total, max_total, assessments, subject_name);
+
+CREATE TRIGGER IF NOT EXISTS subject_marks_performance_insert AFTER INSERT ON subject_marks
+BEGIN
+    INSERT INTO subject_performance (plan_id, subject_key, subject_name, assessments, obtained_total, max_total)
+    VALUES (NEW.plan_id, lower(trim(NEW.subject_name)), trim(NEW.subject_name), 1, NEW.obtained_marks, NEW.max_marks)
+    ON CONFLICT (plan_id, subject_key) DO UPDATE SET
+        assessments = assessments + 1,
+        obtained_total = obtained_total + excluded.obtained_total,
+        max_total = max_total + excluded.max_total;
+END;
+
+CREATE TRIGGER IF NOT EXISTS subject_marks_performance_delete AFTER DELETE ON subject_marks
+BEGIN
+    UPDATE subject_performance
+    SET assessments = assessments - 1,
+        obtained_total = obtained_total - OLD.obtained_marks,
+        max_total = max_total - OLD.max_marks
+    WHERE plan_id = OLD.plan_id AND subject_key = lower(trim(OLD.subject_name));
+    DELETE FROM subject_performance
+    WHERE plan_id = OLD.plan_id AND subject_key = lower(trim(OLD.subject_name)) AND assessments <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS subject_marks_performance_update
+AFTER UPDATE OF plan_id, subject_name, max_marks, obtained_marks ON subject_marks
+BEGIN
+    UPDATE subject_performance
+    SET assessments = assessments - 1,
+        obtained_total = obtained_total - OLD.obtained_marks,
+        max_total = max_total - OLD.max_marks
+    WHERE plan_id = OLD.plan_id AND subject_key = lower(trim(OLD.subject_name));
+    DELETE FROM subject_performance
+    WHERE plan_id = OLD.plan_id AND subject_key = lower(trim(OLD.subject_name)) AND assessments <= 0;
+    INSERT INTO subject_performance (plan_id, subject_key, subject_name, assessments, obtained_total, max_total)
+    VALUES (NEW.plan_id, lower(trim(NEW.subject_name)), trim(NEW.subject_name), 1, NEW.obtained_marks, NEW.max_marks)
+    ON CONFLICT (plan_id, subject_key) DO UPDATE SET
+        assessments = assessments + 1,
+        obtained_total = obtained_total + excluded.obtained_total,
+        max_total = max_total + excluded.max_total;
+END;
+
+-- Existing marks
+INSERT OR IGNORE INTO subject_performance (plan_id, subject_key, subject_name, assessments, obtained_total, max_total)
+SELECT plan_id, lower(trim(subject_name)), MIN(trim(subject_name)), COUNT(*), SUM(obtained_marks), SUM(max_marks)
+FROM subject_marks
+GROUP BY plan_id, lower(trim(subject_name));
@@ -0,0 +1,23 @@
+"""Compress the generated guide, resources and schedule of existing plans (see database.pack_text)."""
+from database.database import pack_text
+
+BATCH_SIZE = 200
+
+
+def upgrade(db):
+    last_id = 0
+    while True:
+        plans = db.execute('''
+            SELECT id, generated_guide, resources, generated_schedule FROM plans
+            WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, BATCH_SIZE)).fetchall()
+        if not plans:
+            break
+        db.executemany(
+            'UPDATE plans SET generated_guide = ?, resources = ?, generated_schedule = ? WHERE id = ?',
+            [(pack_text(guide), pack_text(resources), pack_text(schedule), plan_id)
+             for plan_id, guide, resources, schedule in plans]
+        )
+        last_id = plans[-1][0]
+    db.commit()
+    db.execute('VACUUM')  # Give the space freed by compression back to the file system
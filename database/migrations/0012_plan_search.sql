@@ -0,0 +1,45 @@
+-- Full-text search over plans (see database.search_plans). The index stores no text of
+-- its own: snippets are read through plan_search_source, which decompresses the
+-- generated columns with unpack_text(), a function every app connection registers.
+CREATE VIEW IF NOT EXISTS plan_search_source AS
+SELECT id, title, description, subjects, learning_goal,
+       unpack_text(generated_guide) AS generated_guide, unpack_text(resources) AS resources
+FROM plans;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS plan_search USING fts5(
+    title, description, subjects, learning_goal, generated_guide, resources,
+    content = 'plan_search_source', content_rowid = 'id',
+    tokenize = 'porter unicode61 remove_diacritics 2'
+);
+
+-- bm25 column weights: title, description, subjects, learning_goal, generated_guide, resources
+INSERT INTO plan_search (plan_search, rank) VALUES ('rank', 'bm25(10.0, 2.0, 5.0, 3.0, 1.0, 1.0)');
+
+CREATE TRIGGER IF NOT EXISTS plans_search_insert AFTER INSERT ON plans
+BEGIN
+    INSERT INTO plan_search (rowid, title, description, subjects, learning_goal, generated_guide, resources)
+    VALUES (NEW.id, NEW.title, NEW.description, NEW.subjects, NEW.learning_goal,
+            unpack_text(NEW.generated_guide), unpack_text(NEW.resources));
+END;
+
+CREATE TRIGGER IF NOT EXISTS plans_search_delete AFTER DELETE ON plans
+BEGIN
+    INSERT INTO plan_search (plan_search, rowid, title, description, subjects, learning_goal, generated_guide, resources)
+    VALUES ('delete', OLD.id, OLD.title, OLD.description, OLD.subjects, OLD.learning_goal,
+            unpack_text(OLD.generated_guide), unpack_text(OLD.resources));
+END;
+
+-- Only the searchable columns; schedule and status updates leave the index alone
+CREATE TRIGGER IF NOT EXISTS plans_search_update
+AFTER UPDATE OF title, description, subjects, learning_goal, generated_guide, resources ON plans
+BEGIN
+    INSERT INTO plan_search (plan_search, rowid, title, description, subjects, learning_goal, generated_guide, resources)
+    VALUES ('delete', OLD.id, OLD.title, OLD.description, OLD.subjects, OLD.learning_goal,
+            unpack_text(OLD.generated_guide), unpack_text(OLD.resources));
+    INSERT INTO plan_search (rowid, title, description, subjects, learning_goal, generated_guide, resources)
+    VALUES (NEW.id, NEW.title, NEW.description, NEW.subjects, NEW.learning_goal,
+            unpack_text(NEW.generated_guide), unpack_text(NEW.resources));
+END;
+
+-- Index existing plans
+INSERT INTO plan_search (plan_search) VALUES ('rebuild');
@@ -0,0 +1,3 @@
+-- Incremented by every write to a plan's content: keys its calendar ETags and cached
+-- exports, which updated_at (one-second resolution) cannot tell apart within a second.
+ALTER TABLE plans ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
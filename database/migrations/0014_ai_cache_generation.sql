@@ -0,0 +1,7 @@
+-- Bumped by `flask ai-cache-clear`; every process's in-memory AI cache checks it before a hit.
+CREATE TABLE IF NOT EXISTS ai_cache_generation (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    generation INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO ai_cache_generation (id, generation) VALUES (1, 0);
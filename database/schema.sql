@@ -2,6 +2,19 @@
 -- Drop any existing tables to start fresh.
 DROP TABLE IF EXISTS plans;
 DROP TABLE IF EXISTS subject_marks;
+DROP TABLE IF EXISTS jobs;
+DROP TABLE IF EXISTS ai_cache;
+DROP TABLE IF EXISTS ai_cache_generation;
+DROP TABLE IF EXISTS plan_stream_days;
+DROP TABLE IF EXISTS schedule_blocks;
+DROP TABLE IF EXISTS rate_limits;
+DROP TABLE IF EXISTS circuit_breakers;
+DROP TABLE IF EXISTS plan_batches;
+DROP TABLE IF EXISTS plan_batch_items;
+DROP TABLE IF EXISTS plan_revisions;
+DROP TABLE IF EXISTS subject_performance;
+DROP TABLE IF EXISTS plan_search;
+DROP VIEW IF EXISTS plan_search_source;
 
 -- Create the plans table
 CREATE TABLE plans (
@@ -19,7 +32,10 @@ CREATE TABLE plans (
     generated_guide TEXT, -- The AI-generated learning guide
     generated_schedule TEXT, -- The AI-generated schedule (e.g., JSON or structured text)
     resources TEXT, -- AI-generated links/resources
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    status TEXT NOT NULL DEFAULT 'ready', -- "pending" while the AI job runs, then "ready" or "failed"
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP, -- Last change to the generated content (NULL until first changed)
+    version INTEGER NOT NULL DEFAULT 0 -- Incremented by every change to the content
 );
 
 -- Create a table to store detailed subject marks
@@ -32,4 +48,224 @@ CREATE TABLE subject_marks (
     max_marks REAL NOT NULL,
     obtained_marks REAL NOT NULL,
     FOREIGN KEY (plan_id) REFERENCES plans(id)
-); 
\ No newline at end of file
+);
+
+CREATE INDEX idx_subject_marks_plan ON subject_marks(plan_id);
+CREATE INDEX idx_subject_marks_subject ON subject_marks(subject_name);
+
+-- Background jobs (e.g. AI plan generation) queued by the web app and run by job workers
+CREATE TABLE jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    plan_id INTEGER NOT NULL,
+    kind TEXT NOT NULL, -- e.g., "generate_plan"
+    payload TEXT NOT NULL, -- JSON-encoded job arguments
+    status TEXT NOT NULL DEFAULT 'queued', -- "queued", "running", "done" or "failed"
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker_id TEXT, -- host:pid:thread of the worker running the job
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    FOREIGN KEY (plan_id) REFERENCES plans(id)
+);
+
+CREATE INDEX idx_jobs_status ON jobs(status, id);
+CREATE INDEX idx_jobs_plan_id ON jobs(plan_id);
+
+-- Cache of validated AI responses keyed on normalized plan inputs (see ai_cache.py)
+CREATE TABLE ai_cache (
+    cache_key TEXT PRIMARY KEY, -- SHA-256 of the normalized plan inputs
+    learning_guide TEXT NOT NULL,
+    schedule TEXT NOT NULL, -- JSON schedule object
+    resources TEXT NOT NULL,
+    created_at REAL NOT NULL, -- Unix time, used for TTL expiry
+    last_used_at REAL NOT NULL, -- Unix time, used for least-recently-used eviction
+    hits INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX idx_ai_cache_last_used ON ai_cache(last_used_at);
+
+-- A single row, bumped when the cache is cleared; process memory tiers drop older entries
+CREATE TABLE ai_cache_generation (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    generation INTEGER NOT NULL
+);
+
+INSERT INTO ai_cache_generation (id, generation) VALUES (1, 0);
+
+-- Schedule days streamed by a running generation job, pushed to the browser over SSE
+CREATE TABLE plan_stream_days (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, -- Also the SSE event id, so reconnecting clients can resume
+    plan_id INTEGER NOT NULL,
+    day TEXT NOT NULL, -- YYYY-MM-DD
+    blocks TEXT NOT NULL, -- JSON array of study blocks for the day
+    FOREIGN KEY (plan_id) REFERENCES plans(id)
+);
+
+CREATE INDEX idx_plan_stream_days_plan ON plan_stream_days(plan_id, id);
+
+-- One row per study block of a plan's schedule, for date-range and subject queries
+-- (plans.generated_schedule keeps the full JSON document)
+CREATE TABLE schedule_blocks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    plan_id INTEGER NOT NULL,
+    date TEXT NOT NULL, -- YYYY-MM-DD
+    start_time TEXT NOT NULL, -- HH:MM
+    end_time TEXT NOT NULL, -- HH:MM
+    subject TEXT NOT NULL,
+    task TEXT NOT NULL,
+    FOREIGN KEY (plan_id) REFERENCES plans(id)
+);
+
+CREATE INDEX idx_schedule_blocks_plan_date ON schedule_blocks(plan_id, date, start_time);
+CREATE INDEX idx_schedule_blocks_plan_subject ON schedule_blocks(plan_id, subject);
+
+-- Shared state of the upstream rate limiters and circuit breakers (see resilience.py)
+CREATE TABLE rate_limits (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL -- Unix time of the last refill
+);
+
+CREATE TABLE circuit_breakers (
+    name TEXT PRIMARY KEY,
+    state TEXT NOT NULL DEFAULT 'closed', -- closed, open or half_open
+    failures INTEGER NOT NULL DEFAULT 0, -- Consecutive upstream failures
+    opened_at REAL -- Unix time the breaker opened (or its trial call started)
+);
+
+-- Bulk plan requests (a CSV file or a JSON batch); the same input resumes the same batch
+CREATE TABLE plan_batches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL, -- CSV file name, or 'api'
+    source_key TEXT NOT NULL UNIQUE, -- SHA-256 of the input
+    total_items INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Items of a batch that have been processed: the plan created for them, or why they were rejected
+CREATE TABLE plan_batch_items (
+    batch_id INTEGER NOT NULL,
+    item_number INTEGER NOT NULL, -- CSV line number or position in the JSON array
+    plan_id INTEGER, -- NULL when rejected
+    error TEXT,
+    PRIMARY KEY (batch_id, item_number),
+    FOREIGN KEY (batch_id) REFERENCES plan_batches(id),
+    FOREIGN KEY (plan_id) REFERENCES plans(id)
+);
+
+-- Incremental updates of a plan's inputs (see replan.py); previous_days allows undoing one
+CREATE TABLE plan_revisions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    plan_id INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending', -- "pending" while the affected days are regenerated, then "done" or "failed"
+    changes TEXT NOT NULL, -- JSON {field: [old, new]}, with per-subject averages under "marks"
+    regenerated_days INTEGER NOT NULL,
+    cleared_days INTEGER NOT NULL,
+    dropped_days INTEGER NOT NULL,
+    previous_days TEXT NOT NULL, -- JSON {date: blocks} of the touched days before the update (null if new)
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP,
+    FOREIGN KEY (plan_id) REFERENCES plans(id)
+);
+
+CREATE INDEX idx_plan_revisions_plan ON plan_revisions(plan_id, id);
+
+-- Per plan and subject marks totals, kept up to date by the triggers below
+CREATE TABLE subject_performance (
+    plan_id INTEGER NOT NULL,
+    subject_key TEXT NOT NULL, -- lower(trim(subject_name)), so "Math" and "math " are one subject
+    subject_name TEXT NOT NULL,
+    assessments INTEGER NOT NULL,
+    obtained_total REAL NOT NULL,
+    max_total REAL NOT NULL,
+    PRIMARY KEY (plan_id, subject_key),
+    FOREIGN KEY (plan_id) REFERENCES plans(id)
+) WITHOUT ROWID;
+
+-- Covers the cohort aggregates, which group every plan's row of a subject
+CREATE INDEX idx_subject_performance_subject
+    ON subject_performance(subject_key, obtained_total, max_total, assessments, subject_name);
+
+CREATE TRIGGER subject_marks_performance_insert AFTER INSERT ON subject_marks
+BEGIN
+    INSERT INTO subject_performance (plan_id, subject_key, subject_name, assessments, obtained_total, max_total)
+    VALUES (NEW.plan_id, lower(trim(NEW.subject_name)), trim(NEW.subject_name), 1, NEW.obtained_marks, NEW.max_marks)
+    ON CONFLICT (plan_id, subject_key) DO UPDATE SET
+        assessments = assessments + 1,
+        obtained_total = obtained_total + excluded.obtained_total,
+        max_total = max_total + excluded.max_total;
+END;
+
+CREATE TRIGGER subject_marks_performance_delete AFTER DELETE ON subject_marks
+BEGIN
+    UPDATE subject_performance
+    SET assessments = assessments - 1,
+        obtained_total = obtained_total - OLD.obtained_marks,
+        max_total = max_total - OLD.max_marks
+    WHERE plan_id = OLD.plan_id AND subject_key = lower(trim(OLD.subject_name));
+    DELETE FROM subject_performance
+    WHERE plan_id = OLD.plan_id AND subject_key = lower(trim(OLD.subject_name)) AND assessments <= 0;
+END;
+
+CREATE TRIGGER subject_marks_performance_update
+AFTER UPDATE OF plan_id, subject_name, max_marks, obtained_marks ON subject_marks
+BEGIN
+    UPDATE subject_performance
+    SET assessments = assessments - 1,
+        obtained_total = obtained_total - OLD.obtained_marks,
+        max_total = max_total - OLD.max_marks
+    WHERE plan_id = OLD.plan_id AND subject_key = lower(trim(OLD.subject_name));
+    DELETE FROM subject_performance
+    WHERE plan_id = OLD.plan_id AND subject_key = lower(trim(OLD.subject_name)) AND assessments <= 0;
+    INSERT INTO subject_performance (plan_id, subject_key, subject_name, assessments, obtained_total, max_total)
+    VALUES (NEW.plan_id, lower(trim(NEW.subject_name)), trim(NEW.subject_name), 1, NEW.obtained_marks, NEW.max_marks)
+    ON CONFLICT (plan_id, subject_key) DO UPDATE SET
+        assessments = assessments + 1,
+        obtained_total = obtained_total + excluded.obtained_total,
+        max_total = max_total + excluded.max_total;
+END;
+
+-- Full-text search over plans (see database.search_plans). The index stores no text of
+-- its own: snippets are read through plan_search_source, which decompresses the
+-- generated columns with unpack_text(), a function every app connection registers.
+CREATE VIEW plan_search_source AS
+SELECT id, title, description, subjects, learning_goal,
+       unpack_text(generated_guide) AS generated_guide, unpack_text(resources) AS resources
+FROM plans;
+
+CREATE VIRTUAL TABLE plan_search USING fts5(
+    title, description, subjects, learning_goal, generated_guide, resources,
+    content = 'plan_search_source', content_rowid = 'id',
+    tokenize = 'porter unicode61 remove_diacritics 2'
+);
+
+-- bm25 column weights: title, description, subjects, learning_goal, generated_guide, resources
+INSERT INTO plan_search (plan_search, rank) VALUES ('rank', 'bm25(10.0, 2.0, 5.0, 3.0, 1.0, 1.0)');
+
+CREATE TRIGGER plans_search_insert AFTER INSERT ON plans
+BEGIN
+    INSERT INTO plan_search (rowid, title, description, subjects, learning_goal, generated_guide, resources)
+    VALUES (NEW.id, NEW.title, NEW.description, NEW.subjects, NEW.learning_goal,
+            unpack_text(NEW.generated_guide), unpack_text(NEW.resources));
+END;
+
+CREATE TRIGGER plans_search_delete AFTER DELETE ON plans
+BEGIN
+    INSERT INTO plan_search (plan_search, rowid, title, description, subjects, learning_goal, generated_guide, resources)
+    VALUES ('delete', OLD.id, OLD.title, OLD.description, OLD.subjects, OLD.learning_goal,
+            unpack_text(OLD.generated_guide), unpack_text(OLD.resources));
+END;
+
+-- Only the searchable columns; schedule and status updates leave the index alone
+CREATE TRIGGER plans_search_update
+AFTER UPDATE OF title, description, subjects, learning_goal, generated_guide, resources ON plans
+BEGIN
+    INSERT INTO plan_search (plan_search, rowid, title, description, subjects, learning_goal, generated_guide, resources)
+    VALUES ('delete', OLD.id, OLD.title, OLD.description, OLD.subjects, OLD.learning_goal,
+            unpack_text(OLD.generated_guide), unpack_text(OLD.resources));
+    INSERT INTO plan_search (rowid, title, description, subjects, learning_goal, generated_guide, resources)
+    VALUES (NEW.id, NEW.title, NEW.description, NEW.subjects, NEW.learning_goal,
+            unpack_text(NEW.generated_guide), unpack_text(NEW.resources));
+END;
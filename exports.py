@@ -0,0 +1,384 @@
+"""Streaming exports of a plan's schedule as iCalendar, CSV, plain text and PDF.
+
+Every exporter is a generator of byte chunks fed from an iterable of
+schedule-block rows (date, start_time, end_time, subject, task) in date
+order, typically a database cursor, so the full schedule is never held in
+memory. ``cached_stream`` saves a finished export to disk under a key derived
+from the plan's content version, so repeat downloads are served as files.
+"""
+import csv
+import io
+import os
+import re
+import threading
+import zlib
+from datetime import date, datetime, timedelta, timezone
+
+# Bump when an exporter's output changes, so cached files are rebuilt
+EXPORT_VERSION = 1
+
+MIMETYPES = {
+    'ics': 'text/calendar; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+    'txt': 'text/plain; charset=utf-8',
+    'pdf': 'application/pdf',
+}
+
+CHUNK_ROWS = 256  # Rows rendered per yielded chunk
+
+_TAG = re.compile(r'<[^>]+>')
+
+
+def _long_date(day):
+    return f'{day:%A}, {day:%B} {day.day}, {day.year}'
+
+
+def _as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def _chunked(lines):
+    """Join lines into chunks of CHUNK_ROWS and encode them."""
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= CHUNK_ROWS:
+            yield ''.join(batch).encode('utf-8')
+            batch = []
+    if batch:
+        yield ''.join(batch).encode('utf-8')
+
+
+def _days(plan, rows):
+    """Yield (date, blocks) for every date of the plan, including days without blocks."""
+    current = _as_date(plan['start_date'])
+    end = _as_date(plan['end_date'])
+    day, blocks = None, []
+    for row in rows:
+        row_date = date.fromisoformat(row['date'])
+        if row_date != day:
+            if day is not None:
+                yield day, blocks
+            # Days in the range with no rows are off days
+            while current < row_date and current <= end:
+                yield current, []
+                current += timedelta(days=1)
+            day, blocks = row_date, []
+            current = max(current, row_date + timedelta(days=1))
+        blocks.append(row)
+    if day is not None:
+        yield day, blocks
+    while current <= end:
+        yield current, []
+        current += timedelta(days=1)
+
+
+# --- Plain text ---
+
+def iter_txt(plan, rows):
+    def lines():
+        yield 'STUDY SCHEDULE\n=============\n\n'
+        for day, blocks in _days(plan, rows):
+            heading = _long_date(day)
+            yield f'{heading}\n{"-" * len(heading)}\n'
+            if not blocks:
+                yield 'OFF DAY - No studying scheduled\n'
+            for block in blocks:
+                yield f"{block['start_time']} - {block['end_time']}: {block['subject']} - {block['task']}\n"
+            yield '\n'
+    return _chunked(lines())
+
+
+# --- CSV ---
+
+def iter_csv(plan, rows):
+    def lines():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['Date', 'Start Time', 'End Time', 'Subject', 'Task'])
+        for row in rows:
+            writer.writerow([row['date'], row['start_time'], row['end_time'], row['subject'], row['task']])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    return _chunked(lines())
+
+
+# --- iCalendar ---
+
+def _ics_text(value):
+    return (str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _ics_line(line):
+    """Fold a content line at 75 octets as RFC 5545 requires."""
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line + '\r\n'
+    parts = []
+    while data:
+        limit = 75 if not parts else 74
+        cut = min(limit, len(data))
+        while cut < len(data) and (data[cut] & 0xC0) == 0x80:
+            cut -= 1  # Don't split a UTF-8 sequence
+        parts.append(data[:cut].decode('utf-8'))
+        data = data[cut:]
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _ics_time(day, clock):
+    hour, minute = (int(part) for part in clock.split(':')[:2])
+    if hour >= 24:
+        day, hour = day + timedelta(days=1), hour - 24
+    return f'{day:%Y%m%d}T{hour:02d}{minute:02d}00'
+
+
+def iter_ics(plan, rows, stamp=None):
+    """Floating local times, so events stay at the planned hour in the student's own time zone."""
+    stamp = (stamp or datetime.now(timezone.utc)).strftime('%Y%m%dT%H%M%SZ')
+
+    def lines():
+        yield from (_ics_line(line) for line in (
+            'BEGIN:VCALENDAR',
+            'VERSION:2.0',
+            'PRODID:-//AI Study Planner//Study Plan//EN',
+            'CALSCALE:GREGORIAN',
+            'METHOD:PUBLISH',
+            f"X-WR-CALNAME:{_ics_text(plan['title'])}",
+            'REFRESH-INTERVAL;VALUE=DURATION:PT12H',
+            'X-PUBLISHED-TTL:PT12H',
+        ))
+        previous_start, repeat = None, 0
+        for row in rows:
+            try:
+                day = date.fromisoformat(row['date'])
+                start, end = _ics_time(day, row['start_time']), _ics_time(day, row['end_time'])
+            except ValueError:
+                continue  # Not a usable date or time; skip the block rather than break the calendar
+            # UIDs follow the block's start, so subscribed calendars update events in place
+            repeat = repeat + 1 if start == previous_start else 0
+            previous_start = start
+            yield ''.join(_ics_line(line) for line in (
+                'BEGIN:VEVENT',
+                f"UID:plan-{plan['id']}-{start}{f'-{repeat}' if repeat else ''}@ai-study-planner",
+                f'DTSTAMP:{stamp}',
+                f'DTSTART:{start}',
+                f'DTEND:{end}',
+                f"SUMMARY:{_ics_text(row['subject'])}: {_ics_text(row['task'])}",
+                f"CATEGORIES:{_ics_text(row['subject'])}",
+                'END:VEVENT',
+            ))
+        yield _ics_line('END:VCALENDAR')
+    return _chunked(lines())
+
+
+# --- PDF ---
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 50
+FONTS = {'regular': '/F1', 'bold': '/F2', 'italic': '/F3'}
+
+
+def _pdf_text(value):
+    """Escape text for a PDF string in the standard (Latin-1) encoding of the base fonts."""
+    text = str(value).encode('latin-1', 'replace').decode('latin-1')
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _wrap(text, size, width):
+    """Wrap text to a width in points, estimating Helvetica's average glyph width."""
+    max_chars = max(10, int(width / (size * 0.5)))
+    lines = []
+    for paragraph in str(text).splitlines() or ['']:
+        words = paragraph.split()
+        line = ''
+        for word in words:
+            if line and len(line) + 1 + len(word) > max_chars:
+                lines.append(line)
+                line = word
+            else:
+                line = f'{line} {word}' if line else word
+        lines.append(line)
+    return lines
+
+
+class _PDFWriter:
+    """Writes a PDF page by page, remembering object offsets for the cross-reference table."""
+
+    def __init__(self):
+        self.offset = 0
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = 6  # 1 catalog, 2 page tree, 3-5 fonts
+
+    def obj(self, number, body):
+        self.offsets[number] = self.offset
+        data = f'{number} 0 obj\n'.encode('latin-1') + body + b'\nendobj\n'
+        self.offset += len(data)
+        return data
+
+    def header(self):
+        data = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+        self.offset += len(data)
+        data += self.obj(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        for number, font in ((3, 'Helvetica'), (4, 'Helvetica-Bold'), (5, 'Helvetica-Oblique')):
+            data += self.obj(number, f'<< /Type /Font /Subtype /Type1 /BaseFont /{font} /Encoding /WinAnsiEncoding >>'.encode('latin-1'))
+        return data
+
+    def page(self, content):
+        stream = zlib.compress(content.encode('latin-1'))
+        content_id, page_id = self.next_id, self.next_id + 1
+        self.next_id += 2
+        self.page_ids.append(page_id)
+        data = self.obj(content_id, f'<< /Length {len(stream)} /Filter /FlateDecode >>\nstream\n'.encode('latin-1')
+                        + stream + b'\nendstream')
+        data += self.obj(page_id, (
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+            f'/Resources << /Font << /F1 3 0 R /F2 4 0 R /F3 5 0 R >> >> /Contents {content_id} 0 R >>'
+        ).encode('latin-1'))
+        return data
+
+    def trailer(self):
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self.page_ids)
+        data = self.obj(2, f'<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>'.encode('latin-1'))
+        xref_offset = self.offset
+        entries = ['0000000000 65535 f \n'] + [f'{self.offsets[number]:010d} 00000 n \n'
+                                               for number in range(1, self.next_id)]
+        data += (f'xref\n0 {self.next_id}\n' + ''.join(entries)
+                 + f'trailer\n<< /Size {self.next_id} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n').encode('latin-1')
+        return data
+
+
+class _PDFPages:
+    """Lays out lines of text top to bottom, yielding each page's content stream when it is full."""
+
+    def __init__(self):
+        self.lines = []
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def add(self, text, size=11, style='regular', indent=0, color=(0, 0, 0), space_after=0):
+        """Add wrapped text; returns the content of any page that filled up."""
+        finished = []
+        for line in _wrap(text, size, PAGE_WIDTH - 2 * MARGIN - indent):
+            if self.y - size < MARGIN:
+                finished.append(self.flush())
+            self.y -= size * 1.35
+            r, g, b = color
+            self.lines.append(f'BT {FONTS[style]} {size} Tf {r} {g} {b} rg {MARGIN + indent} {self.y:.1f} Td '
+                              f'({_pdf_text(line)}) Tj ET')
+        self.y -= space_after
+        return finished
+
+    def flush(self):
+        content = '\n'.join(self.lines)
+        self.lines = []
+        self.y = PAGE_HEIGHT - MARGIN
+        return content
+
+
+def _plain(text):
+    return _TAG.sub('', text or '')
+
+
+def iter_pdf(plan, rows):
+    """The full plan (guide, resources, schedule and details) as a PDF, one page at a time."""
+    writer = _PDFWriter()
+    pages = _PDFPages()
+    yield writer.header()
+
+    def emit(finished):
+        return b''.join(writer.page(content) for content in finished)
+
+    grey, dark = (0.4, 0.4, 0.4), (0.17, 0.24, 0.31)
+    sections = [
+        (plan['title'], 22, 'bold', 0, (0, 0, 0), 10),
+        (f"Duration: {plan['start_date']} to {plan['end_date']}", 11, 'regular', 0, grey, 14),
+    ]
+    if plan['description']:
+        sections += [('Description', 14, 'bold', 0, (0, 0, 0), 4), (plan['description'], 11, 'regular', 0, (0, 0, 0), 12)]
+    sections += [
+        ('AI Generated Learning Guide', 14, 'bold', 0, (0, 0, 0), 4),
+        (_plain(plan['generated_guide']), 11, 'regular', 0, (0, 0, 0), 12),
+        ('Learning Resources', 14, 'bold', 0, (0, 0, 0), 4),
+        (_plain(plan['resources']), 11, 'regular', 0, (0, 0, 0), 12),
+        ('Study Schedule', 14, 'bold', 0, (0, 0, 0), 6),
+    ]
+    for text, size, style, indent, color, space_after in sections:
+        chunk = emit(pages.add(text, size, style, indent, color, space_after))
+        if chunk:
+            yield chunk
+
+    for day, blocks in _days(plan, rows):
+        finished = pages.add(_long_date(day), 12, 'bold', 0, dark, 2)
+        if not blocks:
+            finished += pages.add('OFF DAY - No studying scheduled', 10, 'italic', 10, grey)
+        for block in blocks:
+            finished += pages.add(f"{block['start_time']} - {block['end_time']}   {block['subject']}: {block['task']}",
+                                  10, indent=10)
+        pages.y -= 6
+        chunk = emit(finished)
+        if chunk:
+            yield chunk
+
+    details = [('Subjects', plan['subjects']), ('Learning Goal', plan['learning_goal']),
+               ('Confidence/Difficulty', plan['difficulty_feedback']), ('Hours/Day', plan['hours_per_day']),
+               ('Off Days', plan['off_days']), ('Class Schedule', plan['class_schedule'])]
+    finished = pages.add('Plan Details', 14, 'bold', 0, (0, 0, 0), 4)
+    for label, value in details:
+        finished += pages.add(f'{label}: {value or "-"}', 10)
+    finished.append(pages.flush())
+    yield emit(finished)
+    yield writer.trailer()
+
+
+EXPORTERS = {'ics': iter_ics, 'csv': iter_csv, 'txt': iter_txt, 'pdf': iter_pdf}
+
+
+# --- Cache ---
+
+def cache_path(cache_dir, plan_id, version_key, fmt):
+    return os.path.join(cache_dir, f'plan-{plan_id}-{version_key}.{fmt}')
+
+
+def remove_cached(cache_dir, plan_id):
+    """Delete every cached export of a plan, in every format."""
+    prefix = f'plan-{plan_id}-'
+    try:
+        names = os.listdir(cache_dir)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name.startswith(prefix):
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                pass
+
+
+def cached_stream(path, chunks):
+    """Yield ``chunks`` while writing them to ``path``; the file only appears once complete.
+
+    Older exports of the same plan in the same format are removed when the new one is saved.
+    """
+    directory, name = os.path.split(path)
+    prefix, ext = name.rsplit('-', 1)[0], os.path.splitext(name)[1]
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'wb') as f:
+        try:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        except BaseException:
+            f.close()
+            os.remove(temp_path)
+            raise
+    os.replace(temp_path, path)
+    for other in os.listdir(directory):
+        if other.startswith(prefix + '-') and other.endswith(ext) and other != name:
+            try:
+                os.remove(os.path.join(directory, other))
+            except OSError:
+                pass
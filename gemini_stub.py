@@ -0,0 +1,144 @@
+"""Local stand-in for ``google.generativeai.GenerativeModel``.
+
+Enabled with ``GEMINI_STUB=1``, it answers plan prompts with a deterministic
+plan built from the prompt's own details, so plan generation and streaming can
+be exercised without an API key or network access. ``GEMINI_STUB_LATENCY``
+sets the total response time in seconds and ``GEMINI_STUB_CHUNK_SIZE`` the
+size of streamed chunks. ``GEMINI_STUB_OUTPUT`` picks the kind of output, to
+exercise the repair and fallback paths: ``valid`` (default), ``fenced``,
+``trailing_commas``, ``truncated``, ``invalid`` or ``mixed`` (cycles through
+the others). ``GEMINI_STUB_FAILURE_RATE`` is the share of calls that fail
+with a quota error (HTTP 429), to exercise retries and the circuit breaker.
+Schedules come in the compact row format when the prompt asks for it.
+"""
+import asyncio
+import json
+import os
+import itertools
+import random
+import re
+import time
+from datetime import date, timedelta
+
+import schedule_format
+
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def _prompt_field(prompt, label):
+    match = re.search(rf'- {re.escape(label)}: (.*)', prompt)
+    return match.group(1).strip() if match else ''
+
+
+def build_plan_output(prompt):
+    """Return the JSON text a well-behaved model would produce for a plan prompt."""
+    window = re.search(r'only produce the days from (\d{4}-\d{2}-\d{2}) to (\d{4}-\d{2}-\d{2})', prompt)
+    listed = re.search(r'only produce these days: ([\d\-, ]+)', prompt)
+    dates = list(window.groups()) if window else re.findall(r'\d{4}-\d{2}-\d{2}', _prompt_field(prompt, 'Duration'))
+    subjects = [s.strip() for s in _prompt_field(prompt, 'Subjects').split(',') if s.strip()] or ['Study']
+    off_days = _prompt_field(prompt, 'Days Off (No Studying)')
+    try:
+        hours = min(12, max(1, int(float(_prompt_field(prompt, 'Target Study Hours Per Day')))))
+    except ValueError:
+        hours = 2
+
+    schedule = {}
+    if len(dates) == 2:
+        current, end = date.fromisoformat(dates[0]), date.fromisoformat(dates[1])
+        index = 0
+        while current <= end:
+            blocks = []
+            if DAY_NAMES[current.weekday()] not in off_days:
+                for hour in range(9, 9 + hours):
+                    subject = subjects[index % len(subjects)]
+                    index += 1
+                    blocks.append({
+                        'start_time': f'{hour:02d}:00',
+                        'end_time': f'{hour + 1:02d}:00',
+                        'subject': subject,
+                        'task': f'Review {subject} notes and practice problems',
+                    })
+            schedule[current.isoformat()] = blocks
+            current += timedelta(days=1)
+    if listed:
+        wanted = set(re.findall(r'\d{4}-\d{2}-\d{2}', listed.group(1)))
+        schedule = {day: blocks for day, blocks in schedule.items() if day in wanted}
+
+    output = {
+        'learning_guide': 'Focus first on your weakest subjects, then review the rest daily.',
+        'resources': '\n'.join(f'- Practice problems for {subject}' for subject in subjects),
+    }
+    # "subjects" comes before "schedule", as the prompt asks
+    output.update(schedule_format.compact(schedule) if '"subjects"' in prompt else {'schedule': schedule})
+    return json.dumps(output, indent=2)
+
+
+OUTPUT_MODES = ['valid', 'fenced', 'trailing_commas', 'truncated', 'invalid']
+_mixed_modes = itertools.cycle(OUTPUT_MODES)
+
+
+def shape_output(text, mode):
+    """Turn a well-formed response into the kind of output a misbehaving model produces."""
+    if mode == 'mixed':
+        mode = next(_mixed_modes)
+    if mode == 'fenced':
+        return f'Here is your study plan:\n```json\n{text}\n```\nLet me know if you want changes!'
+    if mode == 'trailing_commas':
+        return re.sub(r'(["\]}])(\s*\n\s*[\]}])', r'\1,\2', text)
+    if mode == 'truncated':
+        return text[:int(len(text) * 0.7)]
+    if mode == 'invalid':
+        return "I'm sorry, I can't create a study schedule for these dates right now."
+    return text
+
+
+class StubAPIError(Exception):
+    """Shaped like google.api_core's errors, which carry the HTTP status in ``code``."""
+
+    def __init__(self, message, code=429):
+        super().__init__(message)
+        self.code = code
+
+
+class StubChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubGenerativeModel:
+    def __init__(self, model_name, latency=None, chunk_size=None, output=None, failure_rate=None):
+        self.model_name = model_name
+        self.latency = float(os.getenv('GEMINI_STUB_LATENCY', 0.0)) if latency is None else latency
+        self.chunk_size = int(os.getenv('GEMINI_STUB_CHUNK_SIZE', 256)) if chunk_size is None else chunk_size
+        self.output = os.getenv('GEMINI_STUB_OUTPUT', 'valid') if output is None else output
+        self.failure_rate = float(os.getenv('GEMINI_STUB_FAILURE_RATE', 0.0)) if failure_rate is None else failure_rate
+
+    def generate_content(self, prompt, stream=False):
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise StubAPIError('429 Resource has been exhausted (e.g. check quota).')
+        text = shape_output(build_plan_output(prompt), self.output)
+        if not stream:
+            time.sleep(self.latency)
+            return StubChunk(text)
+        return self._stream(text)
+
+    def _stream(self, text):
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        for chunk in chunks:
+            time.sleep(self.latency / len(chunks))
+            yield StubChunk(chunk)
+
+    async def generate_content_async(self, prompt, stream=False):
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise StubAPIError('429 Resource has been exhausted (e.g. check quota).')
+        text = shape_output(build_plan_output(prompt), self.output)
+        if not stream:
+            await asyncio.sleep(self.latency)
+            return StubChunk(text)
+        return self._stream_async(text)
+
+    async def _stream_async(self, text):
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        for chunk in chunks:
+            await asyncio.sleep(self.latency / len(chunks))
+            yield StubChunk(chunk)
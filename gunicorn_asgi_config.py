@@ -0,0 +1,10 @@
+# Serve the ASGI entry point (asgi.py) with uvicorn workers: each worker runs
+# the background jobs on its event loop, up to ASYNC_JOB_CONCURRENCY at once,
+# so a few workers are enough. Everything else is as in gunicorn_config.py.
+from gunicorn_config import *  # noqa: F401,F403
+
+wsgi_app = 'asgi:application'
+worker_class = 'uvicorn_worker.UvicornWorker'
+workers = int(os.getenv('WEB_CONCURRENCY', 2))  # noqa: F405
+# Open SSE streams and in-flight jobs are tasks, not threads
+timeout = 60
@@ -1,12 +1,23 @@
 import multiprocessing
+import os
+
+# The app (see create_app in app.py). It is imported once in the master and
+# shared by the forked workers, so a new worker serves at once instead of
+# importing the app itself. The Gemini client is only loaded inside workers,
+# on first use; database connections and background threads are per process.
+wsgi_app = 'app:create_app()'
+preload_app = True
 
 # Server socket
-bind = "0.0.0.0:10000"
+bind = f"0.0.0.0:{os.getenv('PORT', 10000)}"
 backlog = 2048
 
 # Worker processes
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = 'sync'
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# AI calls run in background job threads (see jobs.py), not in the request. Threaded
+# workers keep short-lived SSE streams (/plan/<id>/stream) from blocking other requests.
+worker_class = 'gthread'
+threads = 4
 worker_connections = 1000
 timeout = 30
 keepalive = 2
@@ -25,4 +36,12 @@ pidfile = None
 umask = 0
 user = None
 group = None
-tmp_upload_dir = None 
\ No newline at end of file
+tmp_upload_dir = None 
+# Metrics (see metrics.py): every worker writes its own file, summed on /metrics; files of exited workers are merged
+def on_starting(server):
+    import metrics
+    metrics.clear()
+
+def worker_exit(server, worker):
+    import metrics
+    metrics.flush()
@@ -0,0 +1,321 @@
+"""Background job queue for long-running work such as AI plan generation.
+
+Jobs are stored in the ``jobs`` table of the application database, so they
+survive worker restarts: any worker thread (in any gunicorn process, or a
+dedicated ``flask run-jobs`` process) can claim a queued job, and jobs left
+``running`` by a worker that died are requeued once they go stale.
+
+``work_async`` is the asyncio alternative to worker threads: one event loop
+keeps up to ``concurrency`` jobs in flight, running the coroutine handlers
+registered with ``register_async`` (other kinds run on a thread).
+"""
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+import metrics
+from database import database
+
+_handlers = {}
+_async_handlers = {}
+_failure_handlers = {}
+_wakeup = threading.Event()
+_async_wakeups = set()  # (loop, asyncio.Event) of each running work_async
+_start_lock = threading.Lock()
+_started_pid = None
+
+
+def register(kind):
+    """Decorator registering ``func(app, plan_id, payload)`` as the handler for ``kind`` jobs."""
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def register_async(kind):
+    """Decorator registering coroutine ``func(app, plan_id, payload)`` for ``kind`` jobs run by work_async."""
+    def decorator(func):
+        _async_handlers[kind] = func
+        return func
+    return decorator
+
+
+def register_failure(kind):
+    """Decorator registering ``func(db, plan_id, payload, error)``, called when a ``kind`` job has failed for good.
+
+    It runs after the job is marked failed and committed, and records the
+    failure wherever that kind keeps its outcome (the plan, a revision, ...).
+    """
+    def decorator(func):
+        _failure_handlers[kind] = func
+        return func
+    return decorator
+
+
+def _record_final_failure(db, job, error):
+    handler = _failure_handlers.get(job['kind'])
+    if handler is not None:
+        handler(db, job['plan_id'], json.loads(job['payload']), error)
+
+
+def enqueue(db, plan_id, kind, payload):
+    """Insert a queued job. The caller owns the transaction and must commit, then call notify()."""
+    cursor = db.execute(
+        'INSERT INTO jobs (plan_id, kind, payload) VALUES (?, ?, ?)',
+        (plan_id, kind, json.dumps(payload))
+    )
+    return cursor.lastrowid
+
+
+def enqueue_many(db, kind, items):
+    """Insert queued jobs for (plan_id, payload) pairs with one executemany. Same contract as enqueue()."""
+    db.executemany(
+        'INSERT INTO jobs (plan_id, kind, payload) VALUES (?, ?, ?)',
+        [(plan_id, kind, json.dumps(payload)) for plan_id, payload in items]
+    )
+
+
+def notify():
+    """Wake up this process's idle workers; workers in other processes pick the job up on their next poll."""
+    _wakeup.set()
+    for loop, event in list(_async_wakeups):
+        loop.call_soon_threadsafe(event.set)
+
+
+def get_plan_job(db, plan_id):
+    """Return the most recent job for a plan, or None."""
+    return db.execute(
+        'SELECT * FROM jobs WHERE plan_id = ? ORDER BY id DESC LIMIT 1', (plan_id,)
+    ).fetchone()
+
+
+def requeue_stale(db, timeout, max_attempts):
+    """Requeue jobs whose worker stopped while running them, failing those out of attempts."""
+    cutoff = f'-{int(timeout)} seconds'
+    error = 'Worker stopped while running the job'
+    with database.transaction(db):
+        failed = db.execute('''
+            SELECT * FROM jobs WHERE status = 'running' AND started_at < datetime('now', ?) AND attempts >= ?
+        ''', (cutoff, max_attempts)).fetchall()
+        db.executemany(
+            "UPDATE jobs SET status = 'failed', error = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+            [(error, job['id']) for job in failed]
+        )
+        db.execute('''
+            UPDATE jobs SET status = 'queued', worker_id = NULL
+            WHERE status = 'running' AND started_at < datetime('now', ?)
+        ''', (cutoff,))
+    for job in failed:
+        _record_final_failure(db, job, error)
+
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def requeue_orphaned(db):
+    """Requeue running jobs whose worker process on this host has exited, without waiting for JOB_TIMEOUT.
+
+    Used when resuming work after a crash. Returns the number of jobs requeued.
+    """
+    host = socket.gethostname()
+    orphaned = []
+    for job_id, worker_id in db.execute("SELECT id, worker_id FROM jobs WHERE status = 'running'"):
+        worker_host, _, rest = (worker_id or '').partition(':')
+        pid = rest.partition(':')[0]
+        if worker_host == host and pid.isdigit() and not _process_exists(int(pid)):
+            orphaned.append((job_id,))
+    if orphaned:
+        with database.transaction(db):
+            db.executemany("UPDATE jobs SET status = 'queued', worker_id = NULL WHERE id = ? AND status = 'running'",
+                           orphaned)
+    return len(orphaned)
+
+
+def claim(db, worker_id):
+    """Atomically move the oldest queued job to ``running`` for this worker and return it."""
+    with database.transaction(db):
+        db.execute('''
+            UPDATE jobs SET status = 'running', worker_id = ?, attempts = attempts + 1,
+                            started_at = CURRENT_TIMESTAMP
+            WHERE id = (SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1)
+        ''', (worker_id,))
+        return db.execute(
+            "SELECT * FROM jobs WHERE worker_id = ? AND status = 'running' ORDER BY id DESC LIMIT 1",
+            (worker_id,)
+        ).fetchone()
+
+
+def record_failure(db, job, error, final):
+    """Fail the job if ``final`` (see register_failure), otherwise queue it for another attempt."""
+    if final:
+        db.execute(
+            "UPDATE jobs SET status = 'failed', error = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (str(error), job['id'])
+        )
+        db.commit()
+        _record_final_failure(db, job, error)
+        return
+    db.execute(
+        "UPDATE jobs SET status = 'queued', error = ?, worker_id = NULL WHERE id = ?",
+        (str(error), job['id'])
+    )
+    db.commit()
+
+
+def record_done(db, job):
+    db.execute(
+        "UPDATE jobs SET status = 'done', error = NULL, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+        (job['id'],)
+    )
+    db.commit()
+
+
+def run_job(app, db, job):
+    """Run a claimed job and record its outcome."""
+    max_attempts = app.config['JOB_MAX_ATTEMPTS']
+    handler = _handlers.get(job['kind'])
+    started = time.perf_counter()
+    try:
+        if handler is None:
+            raise LookupError(f"No handler registered for job kind '{job['kind']}'")
+        with app.app_context():
+            handler(app, job['plan_id'], json.loads(job['payload']))
+    except Exception as e:
+        app.logger.exception(f"Job {job['id']} ({job['kind']}) failed on attempt {job['attempts']}")
+        record_failure(db, job, e, handler is None or job['attempts'] >= max_attempts)
+        metrics.observe('job_duration_seconds', time.perf_counter() - started, kind=job['kind'], outcome='failed')
+        return
+    record_done(db, job)
+    metrics.observe('job_duration_seconds', time.perf_counter() - started, kind=job['kind'], outcome='done')
+
+
+async def run_job_async(app, job):
+    """run_job for work_async: awaits the kind's coroutine handler, or runs its ordinary handler on a thread."""
+    path = app.config['DATABASE']
+    handler = _async_handlers.get(job['kind'])
+    if handler is None:
+        await asyncio.to_thread(lambda: run_job(app, database.get_connection(path), job))
+        return
+    started = time.perf_counter()
+    try:
+        with app.app_context():
+            await handler(app, job['plan_id'], json.loads(job['payload']))
+    except Exception as e:
+        app.logger.exception(f"Job {job['id']} ({job['kind']}) failed on attempt {job['attempts']}")
+        await database.run_async(path, record_failure, job, e, job['attempts'] >= app.config['JOB_MAX_ATTEMPTS'])
+        metrics.observe('job_duration_seconds', time.perf_counter() - started, kind=job['kind'], outcome='failed')
+        return
+    await database.run_async(path, record_done, job)
+    metrics.observe('job_duration_seconds', time.perf_counter() - started, kind=job['kind'], outcome='done')
+
+
+def work(app, worker_id, stop=None):
+    """Worker loop: claim and run jobs until ``stop`` is set (forever if not given)."""
+    db = database.get_connection(app.config['DATABASE'])
+    poll_interval = app.config['JOB_POLL_INTERVAL']
+    last_stale_check = 0.0
+    while stop is None or not stop.is_set():
+        try:
+            if time.monotonic() - last_stale_check > poll_interval * 10:
+                requeue_stale(db, app.config['JOB_TIMEOUT'], app.config['JOB_MAX_ATTEMPTS'])
+                last_stale_check = time.monotonic()
+            job = claim(db, worker_id)
+        except sqlite3.Error as e:
+            app.logger.error(f"Job worker {worker_id} could not claim a job: {e}")
+            db.rollback()
+            job = None
+        if job is None:
+            _wakeup.wait(poll_interval)
+            _wakeup.clear()
+            continue
+        run_job(app, db, job)
+
+
+async def work_async(app, concurrency, stop=None):
+    """Run jobs as tasks on the running event loop, up to ``concurrency`` at once, until ``stop`` is set.
+
+    Each in-flight job holds one of ``concurrency`` slots, and each slot has
+    its own worker id, so claim() always finds the job it just claimed.
+    ``stop`` is an asyncio.Event; jobs still running then are awaited, or
+    cancelled if this coroutine is cancelled (they are requeued as stale).
+    """
+    path = app.config['DATABASE']
+    poll_interval = app.config['JOB_POLL_INTERVAL']
+    stop = stop or asyncio.Event()
+    wakeup = (asyncio.get_running_loop(), asyncio.Event())
+    _async_wakeups.add(wakeup)
+    slots = asyncio.Queue()
+    for i in range(concurrency):
+        slots.put_nowait(make_worker_id(f'async-{i}'))
+    running = set()
+
+    async def run(worker_id, job):
+        try:
+            await run_job_async(app, job)
+        finally:
+            slots.put_nowait(worker_id)
+
+    last_stale_check = 0.0
+    try:
+        while not stop.is_set():
+            worker_id = await slots.get()
+            wakeup[1].clear()
+            try:
+                if time.monotonic() - last_stale_check > poll_interval * 10:
+                    await database.run_async(path, requeue_stale, app.config['JOB_TIMEOUT'], app.config['JOB_MAX_ATTEMPTS'])
+                    last_stale_check = time.monotonic()
+                job = await database.run_async(path, claim, worker_id)
+            except sqlite3.Error as e:
+                app.logger.error(f"Async job worker could not claim a job: {e}")
+                job = None
+            if job is None:
+                slots.put_nowait(worker_id)
+                stopping = asyncio.ensure_future(stop.wait())
+                woken = asyncio.ensure_future(wakeup[1].wait())
+                await asyncio.wait({stopping, woken}, timeout=poll_interval, return_when=asyncio.FIRST_COMPLETED)
+                stopping.cancel()
+                woken.cancel()
+                continue
+            task = asyncio.create_task(run(worker_id, job))
+            running.add(task)
+            task.add_done_callback(running.discard)
+    finally:
+        _async_wakeups.discard(wakeup)
+        try:
+            if running:
+                await asyncio.wait(running)
+        finally:
+            for task in list(running):
+                task.cancel()
+
+
+def make_worker_id(index):
+    """host:pid:index, which requeue_orphaned() uses to find jobs of processes that have exited."""
+    return f'{socket.gethostname()}:{os.getpid()}:{index}'
+
+
+def start_workers(app):
+    """Start this process's worker threads once; safe to call on every request and after fork."""
+    global _started_pid
+    count = app.config['JOB_WORKERS']
+    pid = os.getpid()
+    if count <= 0 or _started_pid == pid:
+        return
+    with _start_lock:
+        if _started_pid == pid:
+            return
+        _started_pid = pid
+        for i in range(count):
+            threading.Thread(target=work, args=(app, make_worker_id(i)), name=f'job-worker-{i}', daemon=True).start()
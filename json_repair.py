@@ -0,0 +1,284 @@
+"""Find and repair the JSON object in a model response.
+
+Models wrap their JSON in prose or ```json code fences, leave trailing
+commas, use single quotes or Python literals, put raw newlines inside
+strings, and sometimes stop mid-output. ``extract_json`` finds candidate
+objects by decoding at each "{" with ``JSONDecoder.raw_decode`` (so fences
+and prose around the object are skipped). Only a candidate that fails to
+decode is delimited with a string-aware brace scan and run through the
+repair pass, itself a single pass over the candidate.
+A truncated object is cut back to its last complete value and closed; if it
+has a ``schedule`` only the days that were complete are kept.
+"""
+import json
+import re
+from collections import namedtuple
+
+Extraction = namedtuple('Extraction', ['value', 'repairs'])
+
+# A stray "{" in the prose before the real object swallows it into one
+# unclosed candidate; retry from the next "{" at most this many times
+MAX_RESTARTS = 8
+
+_decoder = json.JSONDecoder()
+
+_SCAN = re.compile(r'"(?:[^"\\]|\\.)*"?|[{}\[\]]', re.S)
+
+# Whitespace matches no group, so finditer() skips it
+_TOKEN = re.compile(r'''
+    (?P<string>"(?:[^"\\]|\\.)*"?)
+  | (?P<single>'(?:[^'\\]|\\.)*'?)
+  | (?P<open>[{\[])
+  | (?P<close>[}\]])
+  | (?P<colon>:)
+  | (?P<comma>,)
+  | (?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<word>[^\s{}\[\]:,"']+)
+''', re.X | re.S)
+
+_NUMBER = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?$')
+_LITERALS = {'true': 'true', 'false': 'false', 'null': 'null',
+             'True': 'true', 'False': 'false', 'None': 'null'}
+_CONTROL = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+
+class JSONExtractionError(ValueError):
+    pass
+
+
+def extract_json(text):
+    """Return ``Extraction(value, repairs)`` for the JSON object in ``text``.
+
+    ``repairs`` names the fixes that were needed (empty for clean JSON), e.g.
+    ``('trailing_comma', 'truncated')``. The longest candidate that decodes
+    wins. Raises JSONExtractionError if no object can be recovered.
+    """
+    try:
+        return Extraction(json.loads(text), ())
+    except (ValueError, RecursionError):  # The decoder recurses, so deep nesting fails this way
+        pass
+
+    best, best_length = None, -1
+    pos = 0
+    restarts = 0
+    while True:
+        start = text.find('{', pos)
+        if start < 0:
+            break
+        try:
+            value, end = _decoder.raw_decode(text, start)
+            found = Extraction(value, ())
+        except (ValueError, RecursionError):
+            end, closed = _object_end(text, start)
+            try:
+                found = repair_json(text[start:end])
+            except ValueError:
+                if closed or best is not None or restarts >= MAX_RESTARTS:
+                    pos = end
+                else:
+                    restarts += 1
+                    pos = start + 1
+                continue
+        if end - start > best_length:
+            best, best_length = found, end - start
+        pos = end
+
+    if best is None:
+        raise JSONExtractionError('No JSON object found in the text')
+    return best
+
+
+def _object_end(text, start):
+    """Return ``(end, closed)`` for the ``{...}`` starting at ``start``, ignoring braces in strings.
+
+    An object still open at the end of the text ends there, with ``closed`` False.
+    """
+    depth = 0
+    for match in _SCAN.finditer(text, start):
+        ch = match.group()[0]
+        if ch == '"':
+            continue
+        depth += 1 if ch in '{[' else -1
+        if depth == 0:
+            return match.end(), True
+    return len(text), False
+
+
+def repair_json(text):
+    """Repair one JSON-like object and decode it; returns ``Extraction``, raises ValueError."""
+    repairer = _Repairer()
+    body, closers = repairer.run(text)
+    try:
+        value = json.loads(body + closers)
+    except RecursionError:
+        raise ValueError('JSON nested too deeply') from None
+    if ('truncated' in repairer.repairs and repairer.root_key == '"schedule"' and len(closers) > 2
+            and isinstance(value.get('schedule'), dict) and value['schedule']):
+        # The output stopped inside the last day, which may be missing blocks; keep only complete days
+        value['schedule'].popitem()
+    return Extraction(value, tuple(sorted(repairer.repairs)))
+
+
+class _Repairer:
+    """Token-level rewrite of a JSON-like object into strict JSON.
+
+    Each open container is ``[kind, state]``: objects move through
+    key -> colon -> value -> next, arrays through value -> next. After every
+    complete value the output length and open containers are remembered, so
+    truncated text can be cut back to that point and closed.
+    """
+
+    def __init__(self):
+        self.out = []
+        self.length = 0
+        self.stack = []
+        self.closers = ''
+        self.root_key = None
+        self.repairs = set()
+        self.safe = (0, '')
+        self.pending_comma = False
+        self.done = False
+
+    def run(self, text):
+        for match in _TOKEN.finditer(text):
+            try:
+                self.feed(match.lastgroup, match.group())
+            except ValueError:
+                if match.end() < len(text):
+                    raise
+                break # A token cut off at the end of the output, e.g. "tru" or "1."
+            if self.done:
+                break
+
+        if self.done:
+            return ''.join(self.out), ''
+        self.repairs.add('truncated')
+        length, closers = self.safe
+        if length <= 1:
+            raise ValueError('Nothing complete before the text was cut off')
+        return ''.join(self.out)[:length], closers
+
+    def feed(self, kind, token):
+        if kind == 'comment':
+            self.repairs.add('comment')
+            return
+        if kind == 'comma':
+            self.comma()
+            return
+        if self.pending_comma:
+            self.pending_comma = False
+            if kind == 'close':
+                self.repairs.add('trailing_comma')
+            else:
+                self.emit(',')
+                self.stack[-1][1] = 'key' if self.stack[-1][0] == '{' else 'value'
+        if kind == 'close':
+            self.close(token)
+        elif kind == 'colon':
+            self.colon()
+        elif kind == 'open':
+            self.begin_value(token, scalar=False)
+            self.stack.append([token, 'key' if token == '{' else 'value'])
+            self.closers = ('}' if token == '{' else ']') + self.closers
+            self.mark_safe()
+        elif kind == 'string':
+            # An unterminated string runs to the end of the text, where run() treats it as truncation
+            if len(token) < 2 or not _closes_string(token):
+                raise ValueError('Unterminated string')
+            self.begin_value(_escape_controls(token, self.repairs))
+        elif kind == 'single':
+            if len(token) < 2 or token[-1] != "'" or token[-2] == '\\':
+                raise ValueError('Unterminated string')
+            self.repairs.add('single_quotes')
+            body = token[1:-1].replace("\\'", "'").replace('"', '\\"')
+            self.begin_value(_escape_controls(f'"{body}"', self.repairs))
+        else:
+            self.word(token)
+
+    def emit(self, token):
+        self.out.append(token)
+        self.length += len(token)
+
+    def mark_safe(self):
+        self.safe = (self.length, self.closers)
+
+    def begin_value(self, token, scalar=True):
+        if self.stack:
+            container = self.stack[-1]
+            if container[1] == 'next':
+                self.repairs.add('missing_comma')
+                self.emit(',')
+                container[1] = 'key' if container[0] == '{' else 'value'
+            if container[1] == 'key':
+                if not scalar or not token.startswith('"'):
+                    raise ValueError(f'Expected an object key, found {token[:20]!r}')
+                if len(self.stack) == 1:
+                    self.root_key = token
+                self.emit(token)
+                container[1] = 'colon'
+                return
+            if container[1] == 'colon':
+                raise ValueError(f'Expected ":" before {token[:20]!r}')
+        elif self.out:
+            raise ValueError('Text continues after the top-level value')
+        self.emit(token)
+        if scalar:
+            self.end_value()
+
+    def end_value(self):
+        if not self.stack:
+            self.done = True
+            return
+        self.stack[-1][1] = 'next'
+        self.mark_safe()
+
+    def word(self, token):
+        if token in _LITERALS:
+            if token != _LITERALS[token]:
+                self.repairs.add('python_literal')
+            self.begin_value(_LITERALS[token])
+        elif _NUMBER.match(token):
+            self.begin_value(token)
+        elif self.stack and self.stack[-1][1] == 'key':
+            self.repairs.add('unquoted_key')
+            self.begin_value(json.dumps(token))
+        else:
+            raise ValueError(f'Unexpected {token[:20]!r}')
+
+    def comma(self):
+        if self.stack and self.stack[-1][1] == 'next' and not self.pending_comma:
+            self.pending_comma = True
+        else:
+            self.repairs.add('extra_comma')
+
+    def colon(self):
+        if not self.stack or self.stack[-1][1] != 'colon':
+            raise ValueError('Unexpected ":"')
+        self.emit(':')
+        self.stack[-1][1] = 'value'
+
+    def close(self, token):
+        if not self.stack or self.stack[-1][1] in ('colon', 'value') and self.stack[-1][0] == '{':
+            raise ValueError(f'Unexpected {token!r}')
+        if token != self.closers[0]:
+            raise ValueError(f'Mismatched {token!r}')
+        self.stack.pop()
+        self.closers = self.closers[1:]
+        self.emit(token)
+        self.end_value()
+
+
+def _closes_string(token):
+    """True if a double-quoted string token ends with an unescaped quote."""
+    if token[-1] != '"':
+        return False
+    backslashes = len(token) - 1 - len(token[:-1].rstrip('\\'))
+    return backslashes % 2 == 0
+
+
+def _escape_controls(token, repairs):
+    """Escape raw newlines and tabs inside a string token, which strict JSON rejects."""
+    if '\n' in token or '\r' in token or '\t' in token:
+        repairs.add('control_characters')
+        return ''.join(_CONTROL.get(ch, ch) for ch in token)
+    return token
@@ -0,0 +1,355 @@
+"""Counters and latency histograms, exposed in the Prometheus text format.
+
+Each process keeps its metrics in memory. Once it calls ``enable()`` (the
+app does on its first request, and the job runner when it starts), a
+background thread writes them to its own file in METRICS_DIR
+(``<pid>-<start time>.json``) about once per FLUSH_INTERVAL, off the request
+path. One-off commands never enable it, so they leave no files. ``render()``
+sums the files of every process, so /metrics reports the whole server no
+matter which worker answers. The files of exited processes are merged into
+EXITED_FILE, so counters never go backwards and the directory holds one
+file per live process. The directory is cleared when a server starts: by
+gunicorn_config.py, or by ``start_server()`` from asgi.py.
+"""
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'metrics'))
+FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 1.0))  # Seconds between writes of a process's file
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+AI_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+# Sum of the metrics of processes that have exited
+EXITED_FILE = 'exited.json'
+# Set by ``clear()``, so processes it starts know the directory belongs to their server
+CLEARED_ENV = 'METRICS_DIR_CLEARED'
+
+WAIT_BUCKETS = (0.001, 0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60)
+
+# name: (type, help, buckets)
+METRICS = {
+    'http_requests_total': ('counter', 'HTTP requests by endpoint, method and status.', None),
+    'http_request_duration_seconds': ('histogram', 'Time to produce a response, by endpoint.', LATENCY_BUCKETS),
+    'sql_statement_duration_seconds': ('histogram', 'SQLite statement execution time, by operation and table.', LATENCY_BUCKETS),
+    'template_render_duration_seconds': ('histogram', 'Jinja template rendering time, by template.', LATENCY_BUCKETS),
+    'ai_request_duration_seconds': ('histogram', 'Time spent waiting for the model, by kind of request.', AI_BUCKETS),
+    'ai_failures_total': ('counter', 'Model calls that failed or returned unusable output, by kind and reason.', None),
+    'fallback_schedules_total': ('counter', 'Schedules (or schedule windows) built locally instead of by the model, by reason.', None),
+    'json_extractions_total': ('counter', 'JSON extraction from model output, by outcome (clean, repaired, truncated, failed).', None),
+    'ai_cache_lookups_total': ('counter', 'AI response cache lookups, by outcome (memory_hit, db_hit, miss).', None),
+    'ai_cache_stores_total': ('counter', 'AI responses offered to the cache, by outcome (stored, rejected as invalid).', None),
+    'ai_cache_evictions_total': ('counter', 'AI cache entries removed as expired or least recently used.', None),
+    'page_cache_lookups_total': ('counter', 'Plan page views looked up in the rendered page cache, by outcome (hit, miss).', None),
+    'job_duration_seconds': ('histogram', 'Background job run time, by kind and outcome.', AI_BUCKETS),
+    'rate_limit_wait_seconds': ('histogram', 'Time callers waited for a rate limiter token, by upstream.', WAIT_BUCKETS),
+    'upstream_retries_total': ('counter', 'Retried upstream calls after retryable errors, by upstream.', None),
+    'circuit_breaker_opened_total': ('counter', 'Times a circuit breaker opened, by upstream.', None),
+    'process_startup_seconds': ('histogram', 'Server process startup, by phase: importing the app, and from process start (or fork) to its first finished request.', WAIT_BUCKETS),
+}
+
+_lock = threading.Lock()
+_pid = None
+_path = None
+_counters = {}
+_histograms = {}
+_dirty = False
+_enabled = False
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _reset_if_forked():
+    # A forked child must not re-report what its parent already wrote to its own file,
+    # and threads do not survive a fork, so each process starts its own flusher
+    global _pid, _path
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _path = os.path.join(METRICS_DIR, f'{_pid}-{int(time.time() * 1000)}.json')
+        _counters.clear()
+        _histograms.clear()
+        threading.Thread(target=_flush_periodically, name='metrics-flush', daemon=True).start()
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        if _dirty and _enabled:
+            flush()
+
+
+def enable():
+    """Write this process's metrics to METRICS_DIR from now on (inherited by forked children)."""
+    global _enabled
+    _enabled = True
+
+
+def inc(name, value=1, **labels):
+    """Add ``value`` to a counter."""
+    global _dirty
+    key = (name, _labels(labels))
+    with _lock:
+        _reset_if_forked()
+        _counters[key] = _counters.get(key, 0) + value
+        _dirty = True
+
+
+def observe(name, seconds, **labels):
+    """Record one observation in a histogram."""
+    global _dirty
+    buckets = METRICS[name][2]
+    key = (name, _labels(labels))
+    with _lock:
+        _reset_if_forked()
+        entry = _histograms.get(key)
+        if entry is None:
+            entry = _histograms[key] = [[0] * (len(buckets) + 1), 0.0]
+        entry[0][bisect_left(buckets, seconds)] += 1
+        entry[1] += seconds
+        _dirty = True
+
+
+@contextmanager
+def timer(name, **labels):
+    """Observe how long the ``with`` block takes."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def _snapshot():
+    return {
+        'counters': [[name, labels, value] for (name, labels), value in _counters.items()],
+        'histograms': [[name, labels, list(counts), total] for (name, labels), (counts, total) in _histograms.items()],
+    }
+
+
+def flush():
+    """Write this process's metrics to its file now (the flusher thread does this periodically)."""
+    global _dirty
+    if not _enabled:
+        return
+    with _lock:
+        _reset_if_forked()
+        _dirty = False
+        snapshot = _snapshot()
+        path = _path
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass  # Metrics must never break a request
+
+
+def clear():
+    """Remove every process's metrics file (when the server starts)."""
+    os.environ[CLEARED_ENV] = '1'
+    if not os.path.isdir(METRICS_DIR):
+        return
+    for name in os.listdir(METRICS_DIR):
+        if name.endswith('.json') or name.endswith('.tmp'):
+            try:
+                os.remove(os.path.join(METRICS_DIR, name))
+            except OSError:
+                pass
+
+
+def _add(counters, histograms, snapshot):
+    """Add a snapshot (as written by ``flush``) into (counters, histograms) keyed by (name, labels)."""
+    for name, labels, value in snapshot['counters']:
+        key = (name, tuple(map(tuple, labels)))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, counts, total in snapshot['histograms']:
+        key = (name, tuple(map(tuple, labels)))
+        entry = histograms.get(key)
+        if entry is None:
+            histograms[key] = [list(counts), total]
+        elif len(entry[0]) == len(counts):
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += total
+
+
+def _read(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None  # Gone, or left half-written by a killed worker
+
+
+def _file_pid(name):
+    try:
+        return int(name.split('-', 1)[0])
+    except ValueError:
+        return None
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextmanager
+def _directory_lock():
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    with open(os.path.join(METRICS_DIR, 'merge.lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def _merge_exited():
+    """Fold the files of exited processes into EXITED_FILE. Returns whether other live processes have files.
+
+    Callers hold the directory lock.
+    """
+    counters, histograms = {}, {}
+    exited, others_alive = [], False
+    for name in os.listdir(METRICS_DIR):
+        pid = _file_pid(name) if name.endswith('.json') else None
+        if pid is None or pid == os.getpid():
+            continue
+        if _is_alive(pid):
+            others_alive = True
+            continue
+        snapshot = _read(os.path.join(METRICS_DIR, name))
+        if snapshot is not None:
+            _add(counters, histograms, snapshot)
+        exited.append(name)
+    if exited:
+        path = os.path.join(METRICS_DIR, EXITED_FILE)
+        _add(counters, histograms, _read(path) or {'counters': [], 'histograms': []})
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+                       'histograms': [[name, labels, counts, total]
+                                      for (name, labels), (counts, total) in histograms.items()]}, f)
+        os.replace(tmp_path, path)
+        for name in exited:
+            try:
+                os.remove(os.path.join(METRICS_DIR, name))
+            except OSError:
+                pass
+    return others_alive
+
+
+def start_server():
+    """Clear the directory for a newly started server, unless other live processes are using it.
+
+    For servers without a master that clears it first (uvicorn); a worker
+    started next to live ones, or by a master that did, only merges the files
+    of exited processes.
+    """
+    try:
+        with _directory_lock():
+            if not _merge_exited() and not os.environ.get(CLEARED_ENV):
+                for name in os.listdir(METRICS_DIR):
+                    if name.endswith('.json') or name.endswith('.tmp'):
+                        os.remove(os.path.join(METRICS_DIR, name))
+    except OSError:
+        pass
+
+
+def collect():
+    """Sum the metrics of all processes. Returns (counters, histograms) keyed by (name, labels)."""
+    flush()
+    counters, histograms = {}, {}
+    try:
+        with _directory_lock():
+            _merge_exited()
+        names = [name for name in os.listdir(METRICS_DIR) if name.endswith('.json')]
+    except OSError:
+        names = []
+    with _lock:
+        _reset_if_forked()
+        own = _snapshot()
+        own_name = os.path.basename(_path)
+    for file_name in names:
+        if file_name == own_name:
+            continue
+        snapshot = _read(os.path.join(METRICS_DIR, file_name))
+        if snapshot is not None:
+            _add(counters, histograms, snapshot)
+    # This process's numbers from memory: they may be newer than its file, or it may not write one
+    _add(counters, histograms, own)
+    return counters, histograms
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """All processes' metrics in the Prometheus text exposition format."""
+    counters, histograms = collect()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_format_labels(labels)} {_format_number(value)}')
+            continue
+        for (metric, labels), (counts, total) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else _format_number(float(bound))
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", le)])} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_number(float(total))}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+# --- SQL statement labels ---
+
+_SQL_OPERATION = re.compile(r'^\s*(\w+)')
+_SQL_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN|TABLE)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?["`]?(\w+)', re.I)
+_statement_labels = {}
+
+
+def statement_labels(sql):
+    """(operation, table) for a SQL statement, e.g. ('SELECT', 'plans'); cached per statement text."""
+    labels = _statement_labels.get(sql)
+    if labels is None:
+        operation = _SQL_OPERATION.match(sql)
+        table = _SQL_TABLE.search(sql)
+        labels = ((operation.group(1).upper() if operation else 'OTHER'), (table.group(1) if table else ''))
+        if len(_statement_labels) < 1000:  # Statements are constants, but never grow without bound
+            _statement_labels[sql] = labels
+    return labels
+
+
+def observe_statement(sql, seconds):
+    operation, table = statement_labels(sql)
+    observe('sql_statement_duration_seconds', seconds, operation=operation, table=table)
@@ -0,0 +1,158 @@
+"""Cache of rendered plan pages, shared by every worker process through files.
+
+A finished plan's page only changes when the plan is written to, so it is
+rendered once and later views are served from here without touching the
+database or Jinja. Each page is a file in ``<root>/<release>/``; a process
+keeps the pages it served recently in an LRU and reuses one while its file
+is unchanged, which costs a single stat().
+
+Writers call ``invalidate`` after committing. It deletes the file, so every
+process sees the change on its next lookup. It also touches a ``.stale``
+marker, which keeps a render that read the plan before the write from
+storing its stale page afterwards (see ``put``). ``release`` is a
+fingerprint of the code and templates, so pages from a previous deploy are
+never served.
+"""
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+# Markers are compared with a margin, for filesystems that store coarse timestamps
+STALE_MARGIN_NS = 2 * 10**9
+# Stores between trims of the page directory
+PRUNE_EVERY = 100
+
+
+class PageCache:
+    """Two-tier (process LRU + shared files) cache of rendered pages, keyed on plan id."""
+
+    def __init__(self, root, release, ttl=24 * 3600, max_files=5000, memory_entries=256):
+        self.root = root
+        self.directory = os.path.join(root, release)
+        self.ttl = ttl
+        self.max_files = max_files
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stores = 0
+
+    def _path(self, key, suffix='.html'):
+        return os.path.join(self.directory, f'{key}{suffix}')
+
+    def _forget(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+
+    def get(self, key):
+        """The cached page for ``key`` or None."""
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._forget(key)
+            return None
+        if time.time() - stat.st_mtime >= self.ttl:
+            return None
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] == signature:
+                self._memory.move_to_end(key)
+                return entry[1]
+        try:
+            with open(path, encoding='utf-8') as f:
+                stat = os.fstat(f.fileno())
+                body = f.read()
+        except FileNotFoundError:
+            self._forget(key)
+            return None
+        self._remember(key, (stat.st_ino, stat.st_mtime_ns, stat.st_size), body)
+        return body
+
+    def _remember(self, key, signature, body):
+        with self._lock:
+            self._memory[key] = (signature, body)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def put(self, key, body, since):
+        """Store the page for ``key``, rendered from data read after ``since`` (a time.time_ns()).
+
+        The page is dropped again if ``key`` was invalidated after ``since``:
+        the write that did it may have committed after the render read the
+        plan, and its own invalidate may have run before this file existed.
+        Returns whether the page was kept.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(body)
+            f.flush()
+            stat = os.fstat(f.fileno())
+        os.replace(temp_path, path)
+        if self._invalidated_since(key, since):
+            self._remove(path)
+            return False
+        self._remember(key, (stat.st_ino, stat.st_mtime_ns, stat.st_size), body)
+        with self._lock:
+            self._stores += 1
+            prune = self._stores % PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+        return True
+
+    def _invalidated_since(self, key, since):
+        try:
+            return os.stat(self._path(key, '.stale')).st_mtime_ns >= since - STALE_MARGIN_NS
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def invalidate(self, key):
+        """Drop the page for ``key`` in every process; call after the write has committed."""
+        os.makedirs(self.directory, exist_ok=True)
+        marker, now = self._path(key, '.stale'), time.time_ns()
+        with open(marker, 'a'):
+            pass
+        os.utime(marker, ns=(now, now))
+        self._remove(self._path(key))
+        self._forget(key)
+
+    def prune(self):
+        """Remove expired pages and markers, then the oldest pages beyond ``max_files``."""
+        cutoff = time.time() - self.ttl
+        pages = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    mtime = entry.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                if mtime < cutoff and not entry.name.endswith('.tmp'):
+                    self._remove(entry.path)
+                elif entry.name.endswith('.html'):
+                    pages.append((mtime, entry.path))
+        pages.sort()
+        for _, path in pages[:max(len(pages) - self.max_files, 0)]:
+            self._remove(path)
+        # Pages of earlier releases are never served again
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.is_dir() and entry.path != self.directory:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+
+    def clear(self):
+        """Remove every cached page, of every release."""
+        with self._lock:
+            self._memory.clear()
+        shutil.rmtree(self.root, ignore_errors=True)
@@ -0,0 +1,116 @@
+"""Work out which days of an existing plan a change of its inputs affects.
+
+An update (new dates, off days, hours, fixed schedule, subjects or marks) is
+compared with the stored plan, and only the days it actually touches are
+regenerated; every other day keeps its blocks. Days before the update's
+effective date (by default today, for a plan that is under way) are never
+changed, except when the date range itself grows or shrinks.
+
+- Dates added to the range are generated; dates removed are dropped.
+- Days on a weekday that became a day off are cleared; days on a weekday
+  that stopped being one are generated.
+- New hours per day or a new fixed schedule regenerate every study day.
+- Changed marks, or a removed subject, regenerate the days that study an
+  affected subject; an added subject regenerates every study day.
+"""
+from datetime import date, timedelta
+
+import scheduler
+
+# Inputs an update may change
+FIELDS = ['start_date', 'end_date', 'hours_per_day', 'off_days', 'class_schedule', 'subjects']
+
+# Marks changes smaller than this (in percentage points) don't touch the schedule
+MARKS_TOLERANCE = 0.05
+
+
+def _subjects(text):
+    return {s.strip().casefold(): s.strip() for s in (text or '').split(',') if s.strip()}
+
+
+def _hours(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _dates(start_date, end_date):
+    first, last = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    return [first + timedelta(days=n) for n in range((last - first).days + 1)]
+
+
+def diff_inputs(old_form, old_marks, new_form, new_marks):
+    """Changed inputs as {field: [old, new]}; marks changes are listed per subject under 'marks'."""
+    changes = {}
+    for field in FIELDS:
+        old, new = old_form.get(field) or '', new_form.get(field) or ''
+        if field == 'hours_per_day':
+            changed = _hours(old) != _hours(new)
+        elif field == 'off_days':
+            changed = scheduler.parse_off_days(old) != scheduler.parse_off_days(new)
+        elif field == 'subjects':
+            changed = set(_subjects(old)) != set(_subjects(new))
+        else:
+            changed = old.strip() != new.strip()
+        if changed:
+            changes[field] = [old, new]
+    old_averages = {s.casefold(): pct for s, pct in scheduler.subject_averages(old_marks).items()}
+    new_averages = {s.casefold(): pct for s, pct in scheduler.subject_averages(new_marks).items()}
+    marks = {subject: [old_averages.get(subject), new_averages.get(subject)]
+             for subject in set(old_averages) | set(new_averages)
+             if old_averages.get(subject) is None or new_averages.get(subject) is None
+             or abs(old_averages[subject] - new_averages[subject]) > MARKS_TOLERANCE}
+    if marks:
+        changes['marks'] = {subject: [round(old, 1) if old is not None else None, round(new, 1) if new is not None else None]
+                            for subject, (old, new) in sorted(marks.items())}
+    return changes
+
+
+def default_effective_date(start_date, end_date, today=None):
+    """Today for a plan under way, otherwise its start (a past plan is edited as a whole)."""
+    today = (today or date.today()).isoformat()
+    return today if start_date <= today <= end_date else start_date
+
+
+def affected_days(old_form, new_form, changes, schedule, effective_from):
+    """Return (regenerate, clear, drop): sorted YYYY-MM-DD lists.
+
+    ``regenerate`` days need new blocks, ``clear`` days become empty days off
+    and ``drop`` days leave the plan. ``schedule`` is the stored schedule, used
+    to find the days that study a subject whose marks changed.
+    """
+    old_dates = set(_dates(old_form['start_date'], old_form['end_date']))
+    new_dates = set(_dates(new_form['start_date'], new_form['end_date']))
+    effective = date.fromisoformat(effective_from)
+    old_off = scheduler.parse_off_days(old_form.get('off_days'))
+    new_off = scheduler.parse_off_days(new_form.get('off_days'))
+
+    regenerate, clear = set(), set()
+    for day in new_dates - old_dates:
+        (clear if day.weekday() in new_off else regenerate).add(day)
+
+    whole_plan = 'hours_per_day' in changes or 'class_schedule' in changes
+    old_subjects, new_subjects = _subjects(old_form.get('subjects')), _subjects(new_form.get('subjects'))
+    whole_plan = whole_plan or bool(set(new_subjects) - set(old_subjects))
+    touched_subjects = set(changes.get('marks', {})) | (set(old_subjects) - set(new_subjects))
+
+    for day in old_dates & new_dates:
+        if day < effective:
+            continue
+        if day.weekday() in new_off:
+            if day.weekday() not in old_off:
+                clear.add(day)
+            continue
+        if day.weekday() in old_off or whole_plan:
+            regenerate.add(day)
+            continue
+        blocks = schedule.get(day.isoformat())
+        if not isinstance(blocks, list):
+            regenerate.add(day)  # Missing or malformed in the stored schedule
+        elif touched_subjects and any(isinstance(block, dict) and str(block.get('subject', '')).strip().casefold() in touched_subjects
+                                      for block in blocks):
+            regenerate.add(day)
+
+    iso = lambda days: sorted(day.isoformat() for day in days)
+    return iso(regenerate), iso(clear), iso(old_dates - new_dates)
@@ -0,0 +1,278 @@
+"""Rate limiting, retries and a circuit breaker for calls to an upstream API.
+
+State lives in the application database, so every thread of every gunicorn
+worker shares one token bucket and one breaker per upstream:
+
+- ``TokenBucket`` hands out ``rate`` calls per second with bursts of up to
+  ``burst`` (a rate of 0 means no limit). Callers reserve a token in one
+  short write transaction and sleep until it is theirs, so waiting callers
+  are served in order.
+- ``CircuitBreaker`` opens after ``failure_threshold`` consecutive upstream
+  failures (retryable errors, and rejected credentials). While it is open calls fail at once; after ``reset_timeout``
+  seconds a single trial call is let through and its result closes or
+  reopens the breaker.
+- ``Guard.call`` combines the two with retries of retryable errors (quotas,
+  5xx, timeouts) using full-jitter exponential backoff, within a deadline.
+  ``Guard.stream`` guards a streaming call: it is retried until its first
+  chunk arrives, and the breaker learns the outcome when the stream ends.
+  ``Guard.call_async`` and ``Guard.stream_async`` do the same for coroutines,
+  waiting with ``asyncio.sleep`` and reaching the shared state through
+  ``database.run_async``.
+"""
+import asyncio
+import random
+import time
+
+import metrics
+from database import database
+
+# HTTP statuses worth retrying (google.api_core exceptions carry theirs in ``code``)
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# Rejected credentials: not worth retrying, but every later call will fail the same way
+AUTH_STATUS = {401, 403}
+
+# Marks a stream that ended before its first chunk
+_END = object()
+
+
+class CircuitOpenError(RuntimeError):
+    """The upstream is considered unhealthy; the call was not attempted."""
+
+
+class RateLimitedError(RuntimeError):
+    """No token would become free within the caller's maximum wait."""
+
+
+def is_retryable(error):
+    """Quota, server and network errors are retried; anything else is the request's own fault."""
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return code in RETRYABLE_STATUS
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+def is_auth_error(error):
+    if getattr(error, 'code', None) in AUTH_STATUS:
+        return True
+    # Gemini answers an invalid or revoked API key with 400 INVALID_ARGUMENT
+    return getattr(error, 'reason', None) == 'API_KEY_INVALID' or 'API key not valid' in str(error)
+
+
+def is_upstream_failure(error):
+    """Errors that count against the circuit breaker; others mean the upstream answered."""
+    return is_retryable(error) or is_auth_error(error)
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """Full jitter: a random delay up to base_delay * 2**attempt, capped at max_delay."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+class TokenBucket:
+    """A token bucket shared through the ``rate_limits`` table."""
+
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+
+    def reserve(self, db, max_wait):
+        """Take a token, returning how many seconds to wait before using it.
+
+        Raises RateLimitedError (without taking a token) if that would be longer than ``max_wait``.
+        """
+        if self.rate <= 0:
+            return 0.0
+        now = time.time()
+        with database.transaction(db):
+            row = db.execute('SELECT tokens, updated_at FROM rate_limits WHERE name = ?', (self.name,)).fetchone()
+            tokens = self.burst if row is None else min(self.burst, row['tokens'] + (now - row['updated_at']) * self.rate)
+            # Tokens go negative while callers queue; each waits until its own token has refilled
+            wait = max(0.0, (1 - tokens) / self.rate)
+            if wait > max_wait:
+                raise RateLimitedError(f'{self.name}: no capacity within {max_wait:g}s (next in {wait:.1f}s)')
+            db.execute('INSERT OR REPLACE INTO rate_limits (name, tokens, updated_at) VALUES (?, ?, ?)',
+                       (self.name, tokens - 1, now))
+        return wait
+
+    def acquire(self, db, max_wait):
+        """Block until a token is available (at most ``max_wait`` seconds)."""
+        wait = self.reserve(db, max_wait)
+        metrics.observe('rate_limit_wait_seconds', wait, upstream=self.name)
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self, path, max_wait):
+        """``acquire`` without blocking the event loop; ``path`` is the database."""
+        wait = await database.run_async(path, self.reserve, max_wait)
+        metrics.observe('rate_limit_wait_seconds', wait, upstream=self.name)
+        if wait:
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """A closed/open/half-open breaker shared through the ``circuit_breakers`` table."""
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+    def _state(self, db):
+        return db.execute('SELECT state, failures, opened_at FROM circuit_breakers WHERE name = ?',
+                          (self.name,)).fetchone()
+
+    def allow(self, db):
+        """Whether a call may go ahead. After the timeout, exactly one caller gets the trial call."""
+        row = self._state(db)
+        if row is None or row['state'] == 'closed':
+            return True
+        now = time.time()
+        if now - row['opened_at'] < self.reset_timeout:
+            return False
+        # Open long enough (or a trial call never reported back): claim the next trial
+        with database.transaction(db):
+            claimed = db.execute(
+                "UPDATE circuit_breakers SET state = 'half_open', opened_at = ? WHERE name = ? AND opened_at = ?",
+                (now, self.name, row['opened_at'])
+            ).rowcount
+        return claimed == 1
+
+    def record_success(self, db):
+        row = self._state(db)
+        if row is not None and (row['state'] != 'closed' or row['failures']):
+            with database.transaction(db):
+                db.execute("UPDATE circuit_breakers SET state = 'closed', failures = 0, opened_at = NULL WHERE name = ?",
+                           (self.name,))
+
+    def record_failure(self, db):
+        now = time.time()
+        with database.transaction(db):
+            row = self._state(db)
+            failures = (row['failures'] if row is not None else 0) + 1
+            state = row['state'] if row is not None else 'closed'
+            if state == 'half_open' or (state == 'closed' and failures >= self.failure_threshold):
+                db.execute("INSERT OR REPLACE INTO circuit_breakers (name, state, failures, opened_at) VALUES (?, 'open', ?, ?)",
+                           (self.name, failures, now))
+                metrics.inc('circuit_breaker_opened_total', upstream=self.name)
+            else:
+                db.execute('INSERT OR REPLACE INTO circuit_breakers (name, state, failures, opened_at) VALUES (?, ?, ?, ?)',
+                           (self.name, state, failures, row['opened_at'] if row is not None else None))
+
+
+class Guard:
+    """Calls an upstream through a TokenBucket and CircuitBreaker, retrying retryable errors."""
+
+    def __init__(self, name, rate, burst, max_wait, failure_threshold, reset_timeout,
+                 max_retries, base_delay, max_delay, deadline):
+        self.name = name
+        self.bucket = TokenBucket(name, rate, burst)
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def _record(self, db, error):
+        """Tell the breaker about an attempt that raised ``error``."""
+        if is_upstream_failure(error):
+            self.breaker.record_failure(db)
+        else:
+            self.breaker.record_success(db)  # The upstream answered; the request itself was at fault
+
+    def _attempt(self, db, attempt, record_success=True):
+        """Return ``attempt()``, retrying retryable errors (see ``call``)."""
+        give_up_at = time.monotonic() + self.deadline
+        retries = 0
+        while True:
+            if not self.breaker.allow(db):
+                raise CircuitOpenError(f'{self.name}: circuit open after repeated upstream failures')
+            self.bucket.acquire(db, min(self.max_wait, max(0.0, give_up_at - time.monotonic())))
+            try:
+                result = attempt()
+            except Exception as e:
+                self._record(db, e)
+                delay = backoff_delay(retries, self.base_delay, self.max_delay)
+                if not is_retryable(e) or retries >= self.max_retries or time.monotonic() + delay > give_up_at:
+                    raise
+                metrics.inc('upstream_retries_total', upstream=self.name)
+                time.sleep(delay)
+                retries += 1
+                continue
+            if record_success:
+                self.breaker.record_success(db)
+            return result
+
+    def call(self, db, func, *args, **kwargs):
+        """Return ``func(*args, **kwargs)``.
+
+        Raises CircuitOpenError or RateLimitedError without calling ``func``
+        when the upstream is unhealthy or saturated, and re-raises the last
+        error once retries or the deadline run out.
+        """
+        return self._attempt(db, lambda: func(*args, **kwargs))
+
+    def stream(self, db, func, *args, **kwargs):
+        """Yield the chunks of ``func(*args, **kwargs)``, a call that returns an iterable of chunks.
+
+        Until the first chunk arrives the call is retried as in ``call``. A
+        later error cannot be retried, as chunks have been handed on, but it
+        still counts against the breaker; success is recorded when the stream ends.
+        """
+        def first_chunk():
+            chunks = iter(func(*args, **kwargs))
+            return chunks, next(chunks, _END)
+
+        chunks, chunk = self._attempt(db, first_chunk, record_success=False)
+        try:
+            while chunk is not _END:
+                yield chunk
+                chunk = next(chunks, _END)
+        except Exception as e:
+            self._record(db, e)
+            raise
+        self.breaker.record_success(db)
+
+    async def _attempt_async(self, path, attempt, record_success=True):
+        """``_attempt`` for a coroutine function ``attempt``, for the database at ``path``."""
+        give_up_at = time.monotonic() + self.deadline
+        retries = 0
+        while True:
+            if not await database.run_async(path, self.breaker.allow):
+                raise CircuitOpenError(f'{self.name}: circuit open after repeated upstream failures')
+            await self.bucket.acquire_async(path, min(self.max_wait, max(0.0, give_up_at - time.monotonic())))
+            try:
+                result = await attempt()
+            except Exception as e:
+                await database.run_async(path, self._record, e)
+                delay = backoff_delay(retries, self.base_delay, self.max_delay)
+                if not is_retryable(e) or retries >= self.max_retries or time.monotonic() + delay > give_up_at:
+                    raise
+                metrics.inc('upstream_retries_total', upstream=self.name)
+                await asyncio.sleep(delay)
+                retries += 1
+                continue
+            if record_success:
+                await database.run_async(path, self.breaker.record_success)
+            return result
+
+    async def call_async(self, path, func, *args, **kwargs):
+        """Return ``await func(*args, **kwargs)``; like ``call``, for the database at ``path``."""
+        return await self._attempt_async(path, lambda: func(*args, **kwargs))
+
+    async def stream_async(self, path, func, *args, **kwargs):
+        """``stream`` for ``await func(*args, **kwargs)`` returning an async iterable of chunks."""
+        async def first_chunk():
+            chunks = (await func(*args, **kwargs)).__aiter__()
+            return chunks, await anext(chunks, _END)
+
+        chunks, chunk = await self._attempt_async(path, first_chunk, record_success=False)
+        try:
+            while chunk is not _END:
+                yield chunk
+                chunk = await anext(chunks, _END)
+        except Exception as e:
+            await database.run_async(path, self._record, e)
+            raise
+        await database.run_async(path, self.breaker.record_success)
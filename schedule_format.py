@@ -0,0 +1,134 @@
+"""Compact schedule wire format: what the model writes instead of verbose blocks.
+
+The stored schedule maps each date to a list of blocks, each an object with
+``start_time``, ``end_time``, ``subject`` and ``task``. Asking the model for
+that repeats four keys and the subject name in every block. In the compact
+format the model lists its subjects once and writes each block as a row::
+
+    "subjects": ["Math", "Physics"],
+    "schedule": {"2025-03-03": [["09:00", "11:00", 0, "Practice integration"],
+                                ["14:00", "15:30", 1, "Review kinematics"]],
+                 "2025-03-04": []}
+
+The schedule still has one entry per date, so streaming, the salvage of
+truncated output and per-day validation work as before. ``expand`` turns it
+back into stored blocks and also accepts verbose blocks, so a model that
+ignores the format loses nothing; ``compact`` is its inverse.
+"""
+import re
+from datetime import date
+
+BLOCK_FIELDS = ('start_time', 'end_time', 'subject', 'task')
+
+TIME_PATTERN = re.compile(r'^\d{1,2}:\d{2}$')
+
+
+class ScheduleFormatError(ValueError):
+    pass
+
+
+def is_valid_block(block):
+    """A stored block has string times in HH:MM form plus a subject and task."""
+    # Spelled out rather than looping over BLOCK_FIELDS: bulk repairs call this for every stored block
+    if not isinstance(block, dict):
+        return False
+    start_time, end_time = block.get('start_time'), block.get('end_time')
+    return (isinstance(start_time, str) and isinstance(end_time, str)
+            and isinstance(block.get('subject'), str) and isinstance(block.get('task'), str)
+            and TIME_PATTERN.match(start_time) is not None and TIME_PATTERN.match(end_time) is not None)
+
+
+def is_valid_day(blocks):
+    return isinstance(blocks, list) and all(map(is_valid_block, blocks))
+
+
+def expand_block(row, subjects=None):
+    """One row as a stored block; verbose blocks are returned unchanged."""
+    if isinstance(row, dict):
+        return row
+    if not isinstance(row, list) or len(row) != len(BLOCK_FIELDS):
+        raise ScheduleFormatError(f'expected a [start_time, end_time, subject, task] row, got {row!r}')
+    start_time, end_time, subject, task = row
+    if isinstance(subject, int) and not isinstance(subject, bool):
+        if not subjects or not 0 <= subject < len(subjects):
+            raise ScheduleFormatError(f'subject index {subject} is not in the subjects list')
+        subject = subjects[subject]
+    return {'start_time': start_time, 'end_time': end_time, 'subject': subject, 'task': task}
+
+
+def expand_day(rows, subjects=None):
+    if not isinstance(rows, list):
+        raise ScheduleFormatError(f'expected a list of blocks, got {rows!r}')
+    return [expand_block(row, subjects) for row in rows]
+
+
+def expand(schedule, subjects=None):
+    """Expand a compact (or verbose) schedule. Returns (days, invalid_dates).
+
+    Days that cannot be expanded are left out and listed in ``invalid_dates``;
+    anything but an object is returned as it is, for the caller to reject.
+    """
+    if not isinstance(schedule, dict):
+        return schedule, []
+    if not isinstance(subjects, list):
+        subjects = None
+    days, invalid = {}, []
+    for day, rows in schedule.items():
+        try:
+            days[day] = expand_day(rows, subjects)
+        except ScheduleFormatError:
+            invalid.append(day)
+    return days, invalid
+
+
+def compact(schedule):
+    """The compact form of a stored schedule: {'subjects': [...], 'schedule': {...}}."""
+    subjects, index = [], {}
+    days = {}
+    for day, blocks in schedule.items():
+        rows = []
+        for block in blocks:
+            subject = block['subject']
+            if subject not in index:
+                index[subject] = len(subjects)
+                subjects.append(subject)
+            rows.append([block['start_time'], block['end_time'], index[subject], block['task']])
+        days[day] = rows
+    return {'subjects': subjects, 'schedule': days}
+
+
+def validate(output):
+    """Problems with a compact response ({'subjects', 'schedule'}), as messages; empty when valid."""
+    if not isinstance(output, dict):
+        return ['response is not an object']
+    subjects = output.get('subjects')
+    schedule = output.get('schedule')
+    problems = []
+    if not isinstance(subjects, list) or not all(isinstance(subject, str) for subject in subjects):
+        problems.append('"subjects" is not a list of strings')
+        subjects = []
+    elif len(set(subjects)) != len(subjects):
+        problems.append('"subjects" lists a subject twice')
+    if not isinstance(schedule, dict):
+        return problems + ['"schedule" is not an object']
+    for day, rows in schedule.items():
+        try:
+            date.fromisoformat(day)
+        except ValueError:
+            problems.append(f'{day}: not a YYYY-MM-DD date')
+        if not isinstance(rows, list):
+            problems.append(f'{day}: blocks are not a list')
+            continue
+        for number, row in enumerate(rows, 1):
+            try:
+                block = expand_block(row, subjects)
+            except ScheduleFormatError as e:
+                problems.append(f'{day} block {number}: {e}')
+                continue
+            if isinstance(row, dict):
+                problems.append(f'{day} block {number}: verbose block instead of a row')
+            if not all(isinstance(block.get(field), str) for field in BLOCK_FIELDS):
+                problems.append(f'{day} block {number}: times, subject and task must be strings')
+            elif not is_valid_block(block):
+                problems.append(f'{day} block {number}: times must be HH:MM')
+    return problems
@@ -0,0 +1,91 @@
+"""Check and repair stored plan schedules in bulk (see the ``repair-schedules`` command).
+
+A stored schedule is valid when it is a JSON object mapping every date of the
+plan, and no other, to a list of well-formed blocks. ``repair_schedule``
+works on one plan's stored text, marks and inputs and touches neither the
+database nor the app, so the command can run it in worker processes. It
+recovers what it can the way "Attempt to Fix JSON" does, with
+``json_repair`` and ``schedule_format.expand``. Days it cannot recover come
+from the local scheduler.
+"""
+import json
+from collections import namedtuple
+from datetime import date, timedelta
+
+import json_repair
+import schedule_format
+import scheduler
+
+# action: 'valid', 'reparsed' (recovered as a whole), 'patched' (some days from
+# the local scheduler) or 'regenerated' (all of them); schedule is None when valid
+Repair = namedtuple('Repair', ['plan_id', 'action', 'problems', 'schedule'])
+
+
+def plan_dates(start_date, end_date):
+    first, last = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    return [(first + timedelta(days=offset)).isoformat() for offset in range((last - first).days + 1)]
+
+
+def schedule_problems(schedule, dates):
+    """Why a decoded schedule is not a valid schedule of ``dates``, as messages; empty when it is."""
+    if not isinstance(schedule, dict):
+        return ['not a {date: blocks} object']
+    expected = set(dates)
+    problems = []
+    extra = [key for key in schedule if key not in expected]
+    if extra:
+        problems.append(f'{len(extra)} key(s) not dates of the plan, e.g. {extra[0]!r}')
+    problems += [f'{day}: malformed blocks' for day, blocks in schedule.items()
+                 if day in expected and not schedule_format.is_valid_day(blocks)]
+    missing = len(expected.difference(schedule))
+    if missing:
+        problems.append(f'{missing} date(s) missing')
+    return problems
+
+
+def recover(text):
+    """The schedule that can be pulled out of stored text, or None."""
+    try:
+        value = json_repair.extract_json(text).value
+    except json_repair.JSONExtractionError:
+        return None
+    if not isinstance(value, dict):
+        return None
+    if isinstance(value.get('raw_text'), str):
+        # Stored by an old extraction failure; the model's text is inside
+        return recover(value['raw_text'])
+    if 'schedule' in value:
+        return schedule_format.expand(value['schedule'], value.get('subjects'))[0]
+    return schedule_format.expand(value)[0]
+
+
+def repair_schedule(item):
+    """Check one plan and work out its repaired schedule. ``item`` is
+    (plan_id, schedule_text, form_data, marks_data); returns ``Repair``.
+    """
+    plan_id, text, form_data, marks_data = item
+    dates = plan_dates(form_data['start_date'], form_data['end_date'])
+    if text is None:
+        problems = ['no schedule']
+    else:
+        try:
+            problems = schedule_problems(json.loads(text), dates)
+        except ValueError:
+            problems = ['not valid JSON']
+    if not problems:
+        return Repair(plan_id, 'valid', problems, None)
+
+    recovered = recover(text) if text else None
+    days = {}
+    if isinstance(recovered, dict):
+        days = {day: recovered[day] for day in dates if schedule_format.is_valid_day(recovered.get(day))}
+    if len(days) == len(dates):
+        return Repair(plan_id, 'reparsed', problems, days)
+    fallback = scheduler.build_schedule(
+        form_data['start_date'], form_data['end_date'], form_data['subjects'].split(','),
+        form_data['hours_per_day'], form_data.get('off_days', ''), form_data.get('class_schedule', ''),
+        marks_data
+    )
+    if days:
+        return Repair(plan_id, 'patched', problems, dict(fallback, **days))
+    return Repair(plan_id, 'regenerated', problems, fallback)
@@ -0,0 +1,103 @@
+"""Incremental parser that pulls completed days out of a streamed plan response.
+
+The model streams one JSON object; its ``schedule`` member maps dates to
+arrays of study blocks. ``ScheduleStreamParser.feed`` scans each chunk once,
+tracking strings and nesting, and returns every ``(date, blocks)`` pair whose
+array closed in that chunk, so days can be shown before the response ends.
+A top-level ``subjects`` array (the compact format's subject dictionary, see
+``schedule_format``) is kept in ``subjects`` once it has closed.
+"""
+import json
+
+
+class ScheduleStreamParser:
+    def __init__(self):
+        self._buf = ''
+        self._pos = 0
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._key = None
+        self._schedule_depth = None
+        self._schedule_done = False
+        self._day = None
+        self._subjects_start = None
+        self.subjects = None
+
+    def feed(self, chunk):
+        """Consume the next chunk of model output; return the days it completed."""
+        self._buf += chunk
+        buf = self._buf
+        days = []
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = buf[self._string_start:i]
+            elif ch == '"':
+                self._in_string = True
+                self._string_start = i + 1
+            elif ch == ':':
+                self._key = self._last_string
+            elif ch == '{' or ch == '[':
+                depth = len(self._stack)
+                if (ch == '{' and depth == 1 and self._key == 'schedule'
+                        and self._schedule_depth is None):
+                    self._schedule_depth = depth + 1
+                elif ch == '[' and depth == self._schedule_depth and not self._schedule_done:
+                    self._day = (self._key, i)
+                elif ch == '[' and depth == 1 and self._key == 'subjects' and self.subjects is None:
+                    self._subjects_start = i
+                self._stack.append(ch)
+                self._key = None
+            elif ch == '}' or ch == ']':
+                if self._stack:
+                    self._stack.pop()
+                depth = len(self._stack)
+                if ch == ']' and self._day is not None and depth == self._schedule_depth:
+                    date, start = self._day
+                    self._day = None
+                    try:
+                        blocks = json.loads(buf[start:i + 1])
+                    except ValueError:
+                        blocks = None
+                    if isinstance(blocks, list):
+                        days.append((date, blocks))
+                elif ch == '}' and self._schedule_depth is not None and depth == self._schedule_depth - 1:
+                    self._schedule_done = True
+                elif ch == ']' and self._subjects_start is not None and depth == 1:
+                    try:
+                        subjects = json.loads(buf[self._subjects_start:i + 1])
+                    except ValueError:
+                        subjects = None
+                    self._subjects_start = None
+                    if isinstance(subjects, list):
+                        self.subjects = subjects
+            i += 1
+
+        # Only the open day or subjects array and any unfinished string still need their text
+        if self._day is not None:
+            keep_from = self._day[1]
+        elif self._subjects_start is not None:
+            keep_from = self._subjects_start
+        elif self._in_string:
+            keep_from = self._string_start
+        else:
+            keep_from = len(buf)
+        self._buf = buf[keep_from:]
+        self._pos = len(buf) - keep_from
+        if self._day is not None:
+            self._day = (self._day[0], self._day[1] - keep_from)
+        if self._subjects_start is not None:
+            self._subjects_start -= keep_from
+        if self._in_string:
+            self._string_start -= keep_from
+        return days
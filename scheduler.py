@@ -0,0 +1,234 @@
+"""Deterministic local schedule engine.
+
+Builds a day-by-day study schedule without the AI: study time is split
+between subjects in proportion to how weak they are (from the plan's subject
+marks), days off are left empty and fixed commitments parsed from the
+class/fixed schedule are kept free. It is used as the fallback whenever the
+AI output is unusable and as the instant draft shown while a plan generates.
+
+Every day with the same weekday has the same block layout, and subjects are
+assigned from a periodic weighted sequence, so a day's blocks depend only on
+its weekday and its position in that sequence. ``build_schedule`` computes
+the positions for the whole range at once and reuses the few distinct day
+templates, which keeps multi-year ranges to a few milliseconds.
+"""
+import re
+from datetime import date
+from itertools import accumulate
+
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+DAY_START = 9 * 60  # Study blocks are placed between 09:00...
+DAY_END = 22 * 60   # ...and 22:00, around fixed commitments
+SLOT_MINUTES = 30
+MAX_BLOCK_SLOTS = 4  # Two-hour blocks at most
+DEFAULT_HOURS = 2
+
+# Every subject keeps at least this weight, so strong subjects are still revised
+MIN_WEIGHT = 20
+# Weights are rounded to integers summing to about this, the period of the subject sequence
+WEIGHT_QUANTUM = 24
+
+TASKS = [
+    'Review {subject} notes and summarize key ideas',
+    'Practice {subject} problems',
+    'Revise weak {subject} topics from past assessments',
+    'Timed {subject} practice questions',
+]
+
+_DAY_WORDS = {
+    'mon': [0], 'monday': [0], 'tue': [1], 'tues': [1], 'tuesday': [1], 'wed': [2], 'wednesday': [2],
+    'thu': [3], 'thur': [3], 'thurs': [3], 'thursday': [3], 'fri': [4], 'friday': [4],
+    'sat': [5], 'saturday': [5], 'sun': [6], 'sunday': [6],
+    'weekday': [0, 1, 2, 3, 4], 'weekend': [5, 6], 'daily': list(range(7)), 'everyday': list(range(7)),
+}
+_DAY_CODES = {'M': 0, 'T': 1, 'W': 2, 'Th': 3, 'R': 3, 'F': 4, 'Sa': 5, 'Su': 6}
+_PARTS_OF_DAY = {
+    'morning': (8 * 60, 12 * 60), 'afternoon': (12 * 60, 17 * 60),
+    'evening': (17 * 60, 21 * 60), 'night': (20 * 60, 24 * 60),
+}
+
+_DAY_NAME = r'(?:mon|tue|wed|thu|fri|sat|sun)[a-z]*'
+_DAY_RANGE = re.compile(rf'\b({_DAY_NAME})\s*(?:-|–|to)\s*({_DAY_NAME})\b', re.I)
+_DAY_WORD = re.compile(r'\b(' + '|'.join(sorted(_DAY_WORDS, key=len, reverse=True)) + r')s?\b', re.I)
+_DAY_CODE_RUN = re.compile(r'\b(?:Th|Sa|Su|M|T|W|R|F){2,}\b')
+_TIME = r'(\d{1,2})(?:[:.](\d{2}))?\s*([ap])?\.?m?\.?'
+_TIME_RANGE = re.compile(rf'\b{_TIME}\s*(?:-|–|to)\s*{_TIME}(?![\d:])', re.I)
+_PART_OF_DAY = re.compile(r'\b(' + '|'.join(_PARTS_OF_DAY) + r')s?\b', re.I)
+
+
+def subject_averages(marks_data):
+    """Percentage of marks obtained per subject, e.g. {'Math': 62.5}."""
+    totals = {}
+    for mark in marks_data or []:
+        obtained, maximum = totals.get(mark['subject_name'], (0, 0))
+        totals[mark['subject_name']] = (obtained + mark['obtained_marks'], maximum + mark['max_marks'])
+    return {subject: obtained / maximum * 100 for subject, (obtained, maximum) in totals.items() if maximum}
+
+
+def subject_weights(subjects, marks_data):
+    """Integer weights favouring subjects with lower marks; unmarked subjects get the average."""
+    averages = {subject.lower(): percentage for subject, percentage in subject_averages(marks_data).items()}
+    known = [averages[s.lower()] for s in subjects if s.lower() in averages]
+    default = sum(known) / len(known) if known else 50.0
+    raw = [100 - min(100.0, averages.get(s.lower(), default)) + MIN_WEIGHT for s in subjects]
+    total = sum(raw)
+    return [max(1, round(weight / total * WEIGHT_QUANTUM)) for weight in raw]
+
+
+def weighted_sequence(weights):
+    """Smooth weighted round-robin order of indices: each appears weights[i] times, evenly spread."""
+    current = [0] * len(weights)
+    total = sum(weights)
+    sequence = []
+    for _ in range(total):
+        for i, weight in enumerate(weights):
+            current[i] += weight
+        chosen = max(range(len(weights)), key=current.__getitem__)
+        current[chosen] -= total
+        sequence.append(chosen)
+    return sequence
+
+
+def parse_off_days(off_days):
+    """Weekday numbers (Monday is 0) from a comma separated string or list of day names."""
+    if isinstance(off_days, str):
+        off_days = off_days.split(',')
+    names = {name.strip().lower() for name in off_days or [] if name.strip()}
+    if 'all' in names:
+        return set(range(7))
+    return {i for i, day in enumerate(DAY_NAMES) if day.lower() in names}
+
+
+def _minutes(hour, minute, meridiem):
+    hour, minute = int(hour), int(minute or 0)
+    if meridiem:
+        hour = hour % 12 + (12 if meridiem.lower() == 'p' else 0)
+    return hour * 60 + minute
+
+
+def _days_in(text):
+    days = set()
+    for first, last in _DAY_RANGE.findall(text):
+        start, end = _DAY_WORDS[first[:3].lower()][0], _DAY_WORDS[last[:3].lower()][0]
+        days.update(range(start, end + 1) if start <= end else list(range(start, 7)) + list(range(end + 1)))
+    text = _DAY_RANGE.sub(' ', text)
+    for word in _DAY_WORD.findall(text):
+        days.update(_DAY_WORDS[word.lower()])
+    for run in _DAY_CODE_RUN.findall(text):
+        days.update(_DAY_CODES[code] for code in re.findall(r'Th|Sa|Su|M|T|W|R|F', run))
+    return days
+
+
+def parse_class_schedule(text):
+    """Busy minutes per weekday, {weekday: [(start, end), ...]}, from free-text commitments.
+
+    Understands lines such as "Classes MWF 9am-11am", "Work Tue/Thu 1pm-5pm",
+    "Mon-Fri 8:30-15:00" or "Unavailable Saturday mornings". Times without
+    am/pm before 7 are taken as afternoon; days named without times are busy
+    all day; times without days apply to every day. A span past midnight
+    ("Fri 10pm-2am") ends its day and takes the start of the next one.
+    """
+    busy = {}
+    for segment in re.split(r'[\n;]+', text or ''):
+        spans = []
+        for match in _TIME_RANGE.finditer(segment):
+            h1, m1, p1, h2, m2, p2 = match.groups()
+            start, end = _minutes(h1, m1, p1 or p2), _minutes(h2, m2, p2)
+            if not (p1 or p2) and int(h1) < 7:
+                start, end = start + 12 * 60, end + 12 * 60
+            if end <= start and not p2:
+                end += 12 * 60
+            # A span past midnight runs to the end of its day, and its minutes after midnight the next day
+            overnight = end if end <= start else 0
+            window = (start, 24 * 60) if end <= start else (start, min(end, 24 * 60))
+            spans.append((match.start(), match.end(), window, overnight))
+        for match in _PART_OF_DAY.finditer(segment):
+            spans.append((match.start(), match.end(), _PARTS_OF_DAY[match.group(1).lower()], 0))
+        spans.sort()
+        if not spans:
+            days = _days_in(segment)
+            for day in days:
+                busy.setdefault(day, []).append((0, 24 * 60))
+            continue
+        # Days written before a time belong to it ("Mon 9-11, Wed 2-4"); otherwise the ones after it
+        previous_end = 0
+        for i, (start, end, window, overnight) in enumerate(spans):
+            days = _days_in(segment[previous_end:start])
+            if not days:
+                next_start = spans[i + 1][0] if i + 1 < len(spans) else len(segment)
+                days = _days_in(segment[end:next_start]) or set(range(7))
+            for day in days:
+                busy.setdefault(day, []).append(window)
+                if overnight:
+                    busy.setdefault((day + 1) % 7, []).append((0, overnight))
+            previous_end = end
+    return busy
+
+
+def hours_to_slots(hours_per_day):
+    """Study slots per day for a (possibly fractional) number of hours."""
+    try:
+        hours = float(hours_per_day)
+    except (TypeError, ValueError):
+        hours = DEFAULT_HOURS
+    return max(1, round(hours * 60 / SLOT_MINUTES)) if hours > 0 else 0
+
+
+def day_layout(slots, busy):
+    """(start, end) minutes of the study blocks for one weekday, around its busy windows."""
+    free = []
+    minute = DAY_START
+    while len(free) < slots and minute + SLOT_MINUTES <= DAY_END:
+        end = minute + SLOT_MINUTES
+        if not any(start < end and minute < stop for start, stop in busy):
+            free.append(minute)
+        minute = end
+    blocks = []
+    for slot in free:
+        if blocks and blocks[-1][1] == slot and (blocks[-1][1] - blocks[-1][0]) < MAX_BLOCK_SLOTS * SLOT_MINUTES:
+            blocks[-1] = (blocks[-1][0], slot + SLOT_MINUTES)
+        else:
+            blocks.append((slot, slot + SLOT_MINUTES))
+    return blocks
+
+
+def _clock(minutes):
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def build_schedule(start_date, end_date, subjects, hours_per_day, off_days='', class_schedule='', marks_data=None):
+    """Return {'YYYY-MM-DD': [block, ...]} for every date from start_date to end_date (inclusive)."""
+    subjects = [s.strip() for s in subjects if s and s.strip()] or ['Study']
+    first = date.fromisoformat(start_date).toordinal()
+    last = date.fromisoformat(end_date).toordinal()
+    off = parse_off_days(off_days)
+    busy = parse_class_schedule(class_schedule)
+    slots = hours_to_slots(hours_per_day)
+    layouts = [[] if weekday in off else day_layout(slots, busy.get(weekday, [])) for weekday in range(7)]
+
+    sequence = weighted_sequence(subject_weights(subjects, marks_data))
+    period = len(sequence) * len(TASKS)
+
+    # date.fromordinal(o).weekday() == (o - 1) % 7; every day's first block index is a running total
+    weekdays = [(ordinal - 1) % 7 for ordinal in range(first, last + 1)]
+    offsets = accumulate((len(layouts[weekday]) for weekday in weekdays), initial=0)
+
+    templates = {}
+    schedule = {}
+    for ordinal, weekday, offset in zip(range(first, last + 1), weekdays, offsets):
+        key = (weekday, offset % period)
+        template = templates.get(key)
+        if template is None:
+            template = templates[key] = []
+            for index, (start, end) in enumerate(layouts[weekday], start=key[1]):
+                subject = subjects[sequence[index % len(sequence)]]
+                task = TASKS[index // len(sequence) % len(TASKS)]
+                template.append({
+                    'start_time': _clock(start),
+                    'end_time': _clock(end),
+                    'subject': subject,
+                    'task': task.format(subject=subject),
+                })
+        schedule[date.fromordinal(ordinal).isoformat()] = [dict(block) for block in template]
+    return schedule
@@ -0,0 +1,85 @@
+"""Startup time report: what importing the app costs, and how long until its first response.
+
+``measure()`` starts a fresh interpreter with ``-X importtime``, imports the
+app, calls ``create_app()`` as gunicorn does and requests one page, so the
+numbers are those of a newly started server process (apart from the OS file
+cache, which a real cold start may not have).
+"""
+import json
+import os
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Run in the fresh interpreter; prints the phase timings as JSON
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import app
+client = app.create_app().test_client()
+created = time.perf_counter()
+response = client.get(sys.argv[1])
+finished = time.perf_counter()
+print(json.dumps({
+    "import": app.app.config["STARTUP_IMPORT_SECONDS"],
+    "create_app": created - started - app.app.config["STARTUP_IMPORT_SECONDS"],
+    "first_request": finished - created,
+    "status": response.status_code,
+}))
+'''
+
+
+def parse_importtime(text, module='app'):
+    """The modules ``module`` imports directly, as [(name, cumulative_seconds)], slowest first.
+
+    ``text`` is the stderr of ``python -X importtime``, which lists each import
+    after the imports it caused, indented by depth.
+    """
+    entries = []
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.split('|', 2)
+        if not cumulative.strip().isdigit():
+            continue  # The header line
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((depth, name.strip(), int(cumulative) / 1e6))
+    for index, (depth, name, _) in enumerate(entries):
+        if depth == 0 and name == module:
+            children = []
+            for child_depth, child_name, seconds in reversed(entries[:index]):
+                if child_depth == 0:
+                    break
+                if child_depth == 1:
+                    children.append((child_name, seconds))
+            return sorted(children, key=lambda child: child[1], reverse=True)
+    return []
+
+
+def measure(path='/', env=None):
+    """Time a fresh process's startup and first request for ``path``.
+
+    Returns {'import', 'create_app', 'first_request', 'status', 'imports'}.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE, path], cwd=APP_DIR,
+                            env=dict(os.environ, **(env or {})), capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'Startup probe failed:\n{result.stderr[-2000:]}')
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report['imports'] = parse_importtime(result.stderr)
+    return report
+
+
+def format_report(report, path='/', top=15):
+    total = report['import'] + report['create_app'] + report['first_request']
+    lines = [
+        f"Import app:     {report['import']:.3f}s",
+        f"create_app():   {report['create_app']:.3f}s",
+        f"First request:  {report['first_request']:.3f}s (GET {path} -> {report['status']})",
+        f"Time to first response: {total:.3f}s",
+        '',
+        'Slowest imports of app.py (cumulative):',
+    ]
+    lines += [f'  {seconds:7.3f}s  {name}' for name, seconds in report['imports'][:top]]
+    return '\n'.join(lines)
@@ -0,0 +1,198 @@
+// Plan page: calendar view, downloads and image export.
+// Expects eventsUrl, planStartDate, planEndDate, hasSchedule and scheduleIsRaw from the page.
+let calendarInstance = null; // Hold the calendar instance
+
+// Colour events from the feed by subject
+function decorateEvent(event) {
+    const color = getSubjectColor(event.extendedProps.subject);
+    event.backgroundColor = color;
+    event.borderColor = color;
+    event.textColor = '#000000';
+    return event;
+}
+
+// Open the calendar on today if it falls inside the plan, otherwise on the plan's first day
+function initialCalendarDate() {
+    const today = new Date().toISOString().slice(0, 10);
+    return (today >= planStartDate && today <= planEndDate) ? today : planStartDate;
+}
+
+function buildCalendarConfig() {
+    return {
+        initialView: 'timeGridWeek',
+        initialDate: initialCalendarDate(),
+        headerToolbar: {
+            left: 'prev,next today',
+            center: 'title',
+            right: 'dayGridMonth,timeGridWeek,listMonth'
+        },
+        events: { url: eventsUrl },
+        eventDataTransform: decorateEvent,
+        editable: false,
+        dayMaxEvents: true,
+        height: 'auto',
+        slotMinTime: '06:00:00',
+        slotMaxTime: '22:00:00',
+        expandRows: true,
+        nowIndicator: true,
+        displayEventTime: true,
+        displayEventEnd: true,
+        eventDisplay: 'block',
+        slotDuration: '00:30:00',
+        slotLabelInterval: '01:00',
+        eventContent: function(arg) {
+            // Different content for month view vs week view
+            if (arg.view.type === 'dayGridMonth') {
+                return {
+                    html: `<div class="fc-event-main-frame">
+                        <div class="fc-event-title">${arg.event.title}</div>
+                    </div>`
+                };
+            }
+            // Week view
+            return {
+                html: `<div class="fc-event-main-frame">
+                    <div class="fc-event-time">${arg.timeText}</div>
+                    <div class="fc-event-title-container">
+                        <div class="fc-event-title">${arg.event.title}</div>
+                    </div>
+                </div>`
+            };
+        },
+        eventTimeFormat: {
+            hour: '2-digit',
+            minute: '2-digit',
+            hour12: true
+        },
+        slotEventOverlap: false,
+        allDaySlot: false,
+        views: {
+            timeGridWeek: {
+                dayHeaderFormat: { weekday: 'short', month: 'numeric', day: 'numeric', omitCommas: true }
+            }
+        }
+    };
+}
+
+// Function to generate consistent colors for subjects
+function getSubjectColor(subject) {
+    // Simple hash function to generate a color based on subject name
+    let hash = 0;
+    for (let i = 0; i < subject.length; i++) {
+        hash = subject.charCodeAt(i) + ((hash << 5) - hash);
+    }
+    
+    // Convert to RGB color with reasonable brightness
+    const r = Math.abs((hash & 0xFF0000) >> 16) % 156 + 100; // Values between 100-255
+    const g = Math.abs((hash & 0x00FF00) >> 8) % 156 + 100;
+    const b = Math.abs(hash & 0x0000FF) % 156 + 100;
+    
+    return `rgb(${r}, ${g}, ${b})`;
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    const calendarBtn = document.getElementById('view-calendar-btn');
+    const calendarViewEl = document.getElementById('calendar-view');
+    const scheduleRawView = document.getElementById('schedule-raw');
+
+    if (calendarBtn && calendarViewEl && scheduleRawView) {
+        calendarBtn.addEventListener('click', () => {
+            const isHidden = calendarViewEl.style.display === 'none';
+            calendarViewEl.style.display = isHidden ? 'block' : 'none';
+            scheduleRawView.style.display = isHidden ? 'none' : 'block';
+            calendarBtn.textContent = isHidden ? 'View Raw Schedule' : 'View as Calendar';
+
+            if (isHidden && !calendarInstance) {
+                try {
+                    console.log("Initializing FullCalendar...");
+
+                    if (!hasSchedule) {
+                        if (scheduleIsRaw) {
+                            calendarViewEl.innerHTML = '<p class="error-message">Schedule data is invalid. Please try fixing the JSON format.</p>';
+                        } else {
+                            calendarViewEl.innerHTML = '<p class="error-message">No schedule events found.</p>';
+                        }
+                        return;
+                    }
+
+                    const calendarConfig = buildCalendarConfig();
+                    calendarInstance = new FullCalendar.Calendar(calendarViewEl, calendarConfig);
+
+                    calendarInstance.render();
+                    console.log("FullCalendar rendered successfully.");
+                } catch (error) {
+                    console.error("Error initializing calendar:", error);
+                    calendarViewEl.innerHTML = '<p class="error-message">Error loading calendar. Please try again.</p>';
+                }
+            }
+        });
+    }
+
+    // Export calendar as image functionality
+    const exportImageBtn = document.getElementById('export-image-btn');
+    if (exportImageBtn) {
+        exportImageBtn.addEventListener('click', async () => {
+            const calendarViewEl = document.getElementById('calendar-view');
+            
+            try {
+                // Store original styles
+                const originalDisplay = calendarViewEl.style.display;
+                const originalPosition = calendarViewEl.style.position;
+                const originalTop = calendarViewEl.style.top;
+                const originalWidth = calendarViewEl.style.width;
+                
+                // Show calendar if hidden
+                calendarViewEl.style.display = 'block';
+                
+                // Initialize calendar if needed
+                if (!calendarInstance) {
+                    const calendarConfig = buildCalendarConfig();
+                    calendarInstance = new FullCalendar.Calendar(calendarViewEl, calendarConfig);
+                    calendarInstance.render();
+                    await new Promise(resolve => setTimeout(resolve, 500));
+                }
+                
+                // Prepare for capture
+                calendarViewEl.style.position = 'static';
+                calendarViewEl.style.width = '1200px';
+                await new Promise(resolve => setTimeout(resolve, 100));
+
+                // Scroll to calendar
+                calendarViewEl.scrollIntoView({ behavior: 'auto', block: 'nearest' });
+                await new Promise(resolve => setTimeout(resolve, 100));
+
+                // Capture the calendar
+                const canvas = await html2canvas(calendarViewEl, {
+                    scale: 2,
+                    useCORS: true,
+                    logging: false,
+                    windowWidth: 1200,
+                    backgroundColor: '#ffffff',
+                    onclone: function(clonedDoc) {
+                        const clonedElement = clonedDoc.getElementById('calendar-view');
+                        clonedElement.style.transform = 'none';
+                    }
+                });
+
+                // Restore original styles
+                calendarViewEl.style.display = originalDisplay;
+                calendarViewEl.style.position = originalPosition;
+                calendarViewEl.style.top = originalTop;
+                calendarViewEl.style.width = originalWidth;
+
+                // Download the image
+                const image = canvas.toDataURL('image/png', 1.0);
+                const a = document.createElement('a');
+                a.href = image;
+                a.download = 'study_calendar.png';
+                document.body.appendChild(a);
+                a.click();
+                document.body.removeChild(a);
+
+            } catch (error) {
+                console.error('Error exporting calendar as image:', error);
+                alert('Error creating calendar image. Please try again.');
+            }
+        });
+    }
+});